@@ -0,0 +1,185 @@
+# admission.py
+"""
+Per-target admission control for live LLM streams.
+Each target gets one AdmissionController that bounds the streams open at once,
+spaces request starts with a token bucket (requests per minute plus a burst) and
+lets at most max_queue requests wait for a slot, each for at most its queue
+deadline. Requests that cannot be admitted in time fail fast with
+AdmissionRejected instead of piling onto an overloaded server.
+
+Waiters may live on different threads and event loops (batch workers, the
+daemon), so slots are handed over under a threading lock and waiters are woken
+with loop.call_soon_threadsafe (as in single_flight).
+"""
+import os
+import time
+import asyncio
+import threading
+import contextlib
+from collections import deque
+from typing import Optional, Dict, Any, AsyncIterator
+
+import metrics # Queue wait is recorded as the 'admission' stage
+
+# Defaults for targets whose configuration does not set them (overridable via environment variables)
+DEFAULT_MAX_QUEUE = int(os.environ.get("LLM_ADMISSION_MAX_QUEUE", "64"))
+DEFAULT_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("LLM_ADMISSION_QUEUE_TIMEOUT_SECONDS", "60"))
+
+class AdmissionRejected(Exception): pass
+
+
+class _Waiter:
+    """A request queued for a stream slot."""
+    __slots__ = ('loop', 'future', 'granted')
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False # Set under the controller lock when a slot is handed over
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionController:
+    """Concurrency limit, request rate and bounded wait queue of one target."""
+    def __init__(self, target: str, max_concurrency: int = 0, requests_per_minute: float = 0.0,
+                 burst: int = 1, max_queue: int = DEFAULT_MAX_QUEUE,
+                 queue_timeout: float = DEFAULT_QUEUE_TIMEOUT_SECONDS):
+        """
+        Args:
+            target: Target name (for messages).
+            max_concurrency: Streams open at once (0: unlimited).
+            requests_per_minute: Sustained request rate (0: unlimited).
+            burst: Requests that may start back to back before the rate applies.
+            max_queue: Requests allowed to wait for a slot; further ones are rejected at once.
+            queue_timeout: Longest a request waits for admission (slot and rate) in seconds.
+        """
+        self.target = target
+        self.max_concurrency = max(0, int(max_concurrency))
+        self.rate = max(0.0, float(requests_per_minute)) / 60.0 # Tokens per second
+        self.burst = max(1, int(burst))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters: deque = deque()
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self.rejected = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'active': self._active, 'queued': len(self._waiters), 'rejected': self.rejected}
+
+    def pause(self, seconds: float) -> None:
+        """Holds back new requests for seconds (the server asked us to slow down, e.g. HTTP 429)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = min(self._tokens, 0.0) # No burst right after a rate limit
+
+    def _reject_locked(self, reason: str) -> AdmissionRejected:
+        self.rejected += 1
+        return AdmissionRejected(f"Target '{self.target}' is overloaded: {reason}.")
+
+    async def _acquire_slot(self, deadline: float) -> None:
+        with self._lock:
+            if self.max_concurrency == 0 or (self._active < self.max_concurrency and not self._waiters):
+                self._active += 1
+                return
+            if len(self._waiters) >= self.max_queue:
+                raise self._reject_locked(f"{len(self._waiters)} request(s) already queued")
+            waiter = _Waiter(asyncio.get_running_loop())
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            with self._lock:
+                if not waiter.granted: # Otherwise the slot arrived just in time
+                    self._waiters.remove(waiter)
+                    raise self._reject_locked(f"no stream slot within {self.queue_timeout:g}s") from None
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self._waiters.remove(waiter)
+            if granted: # Pass the slot on
+                self._release_slot()
+            raise
+
+    def _release_slot(self) -> None:
+        with self._lock:
+            while self._waiters: # Hand the slot straight to the oldest waiter
+                waiter = self._waiters.popleft()
+                try:
+                    waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+                except RuntimeError: # Waiter's loop is closed; it will never take the slot
+                    continue
+                waiter.granted = True
+                return
+            self._active -= 1
+
+    def _reserve_start(self, deadline: float) -> float:
+        """Takes a token for a request start; returns how long to wait for it (raises if past deadline)."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._paused_until - now)
+            if self.rate > 0:
+                self._tokens = min(float(self.burst), self._tokens + (now - self._refilled) * self.rate)
+                self._refilled = now
+                if self._tokens < 1.0:
+                    wait = max(wait, (1.0 - self._tokens) / self.rate)
+            if now + wait > deadline:
+                raise self._reject_locked(f"rate limit would delay the request {wait:.1f}s, past its queue deadline")
+            if self.rate > 0:
+                self._tokens -= 1.0 # May go negative: later requests queue behind this reservation
+            return wait
+
+    @contextlib.asynccontextmanager
+    async def admit(self, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """
+        Holds a stream slot (and a request start of the rate limit) for the body.
+
+        Args:
+            timeout: Longest wait for admission (default: the controller's queue_timeout).
+
+        Raises:
+            AdmissionRejected: If the queue is full or the request could not start in time.
+        """
+        deadline = time.monotonic() + (self.queue_timeout if timeout is None else timeout)
+        with metrics.stage('admission'):
+            await self._acquire_slot(deadline)
+            try:
+                wait = self._reserve_start(deadline)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            except BaseException:
+                self._release_slot()
+                raise
+        try:
+            yield
+        finally:
+            self._release_slot()
+
+
+_controllers: Dict[str, AdmissionController] = {}
+_controllers_lock = threading.Lock()
+
+
+def controller_for(target: str, config: Dict[str, Any]) -> AdmissionController:
+    """The process-wide controller of target, created from config on first use."""
+    with _controllers_lock:
+        controller = _controllers.get(target)
+        if controller is None:
+            controller = _controllers[target] = AdmissionController(
+                target,
+                max_concurrency=config.get('max_concurrency') or 0,
+                requests_per_minute=config.get('requests_per_minute') or 0,
+                burst=config.get('request_burst') or 1,
+                max_queue=config.get('max_queue', DEFAULT_MAX_QUEUE),
+                queue_timeout=config.get('queue_timeout_seconds') or DEFAULT_QUEUE_TIMEOUT_SECONDS,
+            )
+        return controller
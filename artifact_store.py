@@ -0,0 +1,205 @@
+# artifact_store.py
+"""
+Versioned store of pre-generated answers for the execute-prompt catalog.
+`main.py prewarm` generates the answer of every mapped (operation, product) template
+for common msg variants ahead of time (see prewarm.py); matching execute requests
+are then answered from here without calling the LLM.
+
+Artifacts are keyed by template name, a content hash of the template text, the
+msg variant (see template_variant) and the model. Editing a template in llm_prompt changes its
+hash, so stale answers are never served; prune() deletes them from disk.
+Unlike the response cache there is no TTL or LRU eviction: the catalog is small
+and an artifact stays valid as long as its template does.
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional, List, Dict, Any
+
+import response_cache # Shares the cache directory
+import prompt_registry
+import prompt_budget # OS a msg selects for templates with {os}
+
+DEFAULT_PATH = os.path.join(os.path.dirname(response_cache.DEFAULT_CACHE_PATH), 'artifacts.sqlite3')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    key TEXT PRIMARY KEY,
+    template TEXT NOT NULL,
+    template_hash TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    model TEXT NOT NULL,
+    chunks TEXT NOT NULL,
+    code_blocks TEXT NOT NULL,
+    created REAL NOT NULL
+)
+"""
+
+
+def template_hash(template: prompt_registry.CompiledTemplate) -> str:
+    """Content hash identifying the version of a template."""
+    return hashlib.sha256(template.text.encode('utf-8')).hexdigest()[:16]
+
+
+def normalize_variant(msg: Optional[str]) -> str:
+    """The msg as an artifact variant: case- and whitespace-insensitive, '' for no message."""
+    if not msg or msg.strip().upper() == "N/A":
+        return ""
+    return " ".join(msg.split()).lower()
+
+
+def template_variant(template: prompt_registry.CompiledTemplate, msg: Optional[str]) -> str:
+    """
+    The variant of msg for template: the normalized msg if the template has {msg}; else the
+    OS the msg states if the template renders an {os} other than the default; else '' (every
+    msg renders the same prompt).
+    """
+    if 'msg' in template.fields:
+        return normalize_variant(msg)
+    if 'os' in template.fields:
+        os_name = prompt_budget.request_os(template, msg)
+        return f"os: {os_name}" if os_name != prompt_budget.DEFAULT_OS else ""
+    return ""
+
+
+def _make_key(template: prompt_registry.CompiledTemplate, variant: str, model: str) -> str:
+    material = json.dumps([template.name, template_hash(template), variant, model], ensure_ascii=False)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class Artifact:
+    """A pre-generated answer: the streamed chunks and the code blocks extracted from them."""
+    __slots__ = ('chunks', 'code_blocks', 'created')
+
+    def __init__(self, chunks: List[str], code_blocks: List[str], created: float):
+        self.chunks = chunks
+        self.code_blocks = code_blocks
+        self.created = created
+
+
+class ArtifactStore:
+    """SQLite-backed artifact store (one row per template version, msg variant and model)."""
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        if not self._initialized:
+            with self._lock:
+                conn.execute(_SCHEMA)
+                conn.commit()
+                self._initialized = True
+        return conn
+
+    def exists(self) -> bool:
+        """False until the first artifact is stored (lookups can be skipped)."""
+        return os.path.exists(self.path)
+
+    def get(self, template: prompt_registry.CompiledTemplate, msg: Optional[str], model: str) -> Optional[Artifact]:
+        """
+        Looks up the artifact for the current version of template.
+
+        Args:
+            template: The catalog template (before OS section selection).
+            msg: The request's msg (reduced to its variant for template, see template_variant).
+            model: The model that would serve the request.
+
+        Returns:
+            The artifact, or None if there is none for this template version.
+        """
+        if not self.exists():
+            return None
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT chunks, code_blocks, created FROM artifacts WHERE key = ?",
+                                   (_make_key(template, template_variant(template, msg), model),)).fetchone()
+            finally:
+                conn.close()
+            if row is None:
+                return None
+            return Artifact(json.loads(row[0]), json.loads(row[1]), row[2])
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Warning: Artifact store lookup failed: {e}", file=sys.stderr)
+            return None
+
+    def put(self, template: prompt_registry.CompiledTemplate, msg: Optional[str], model: str,
+            chunks: List[str], code_blocks: List[str]) -> None:
+        """Stores (or replaces) the artifact of template/msg/model."""
+        variant = template_variant(template, msg)
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO artifacts (key, template, template_hash, variant, model, chunks, code_blocks, created)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (_make_key(template, variant, model), template.name, template_hash(template), variant, model,
+                     json.dumps(chunks, ensure_ascii=False), json.dumps(code_blocks, ensure_ascii=False), time.time()),
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Warning: Artifact store write failed: {e}", file=sys.stderr)
+
+    def prune(self, templates: List[prompt_registry.CompiledTemplate]) -> int:
+        """
+        Deletes artifacts of templates that changed or no longer exist.
+
+        Args:
+            templates: The current catalog.
+
+        Returns:
+            The number of artifacts deleted.
+        """
+        if not self.exists():
+            return 0
+        current = {template.name: template_hash(template) for template in templates}
+        conn = self._connect()
+        try:
+            stale = [(key,) for key, name, version in conn.execute("SELECT key, template, template_hash FROM artifacts")
+                     if current.get(name) != version]
+            conn.executemany("DELETE FROM artifacts WHERE key = ?", stale)
+            conn.commit()
+            return len(stale)
+        finally:
+            conn.close()
+
+    def summary(self) -> Dict[str, Any]:
+        """Artifact count per template (for the prewarm report)."""
+        if not self.exists():
+            return {}
+        conn = self._connect()
+        try:
+            return dict(conn.execute("SELECT template, COUNT(*) FROM artifacts GROUP BY template ORDER BY template"))
+        finally:
+            conn.close()
+
+    def clear(self) -> None:
+        """Removes every artifact."""
+        if not self.exists():
+            return
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM artifacts")
+            conn.commit()
+        finally:
+            conn.close()
+
+
+# Lazily instantiated store (shared by all callers in the process)
+_store_instance: Optional[ArtifactStore] = None
+
+def get_artifact_store() -> ArtifactStore:
+    """Gets or creates the singleton artifact store instance."""
+    global _store_instance
+    if _store_instance is None:
+        _store_instance = ArtifactStore()
+    return _store_instance
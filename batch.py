@@ -0,0 +1,127 @@
+# batch.py
+"""
+Runs many product/operation/mode requests from a JSONL or CSV manifest
+through the workflow concurrently, writing one JSONL result per input.
+"""
+import sys
+import csv
+import json
+import time
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional, TextIO
+
+import llm_workflow
+from output_sinks import CallbackSink
+
+_VALID_MODES = ('execute', 'fix', 'chat')
+_VALID_TARGETS = ('local', 'openrouter', 'auto')
+
+
+def read_manifest(path: str, default_target: str = 'local', default_mode: str = 'execute') -> List[Dict[str, Any]]:
+    """
+    Reads a manifest of requests from a JSONL (one object per line) or CSV (header row) file.
+
+    Args:
+        path: Path to the manifest; '.csv' files are read as CSV, everything else as JSONL.
+        default_target: Target used for entries that do not specify one.
+        default_mode: Mode used for entries that do not specify one.
+
+    Returns:
+        A list of normalized request dictionaries (product, operation, target, mode, msg).
+
+    Raises:
+        ValueError: If an entry is missing required fields or has an invalid mode/target.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            raw_entries = list(csv.DictReader(f))
+        else:
+            raw_entries = [json.loads(line) for line in f if line.strip()]
+
+    requests = []
+    for line_no, entry in enumerate(raw_entries, start=1):
+        product = (entry.get('product') or '').strip()
+        operation = (entry.get('operation') or '').strip()
+        if not product or not operation:
+            raise ValueError(f"Manifest entry {line_no}: 'product' and 'operation' are required.")
+        mode = (entry.get('mode') or default_mode).strip().lower()
+        target = (entry.get('target') or default_target).strip().lower()
+        if mode not in _VALID_MODES:
+            raise ValueError(f"Manifest entry {line_no}: invalid mode '{mode}'. Expected one of {list(_VALID_MODES)}.")
+        if target not in _VALID_TARGETS:
+            raise ValueError(f"Manifest entry {line_no}: invalid target '{target}'. Expected one of {list(_VALID_TARGETS)}.")
+        requests.append({
+            'product': product,
+            'operation': operation,
+            'target': target,
+            'mode': mode,
+            'msg': entry.get('msg') or None,
+        })
+    return requests
+
+
+def _run_one(index: int, request: Dict[str, Any], use_cache: bool, refresh: bool) -> Dict[str, Any]:
+    """Runs a single manifest entry and builds its result record."""
+    started = time.perf_counter()
+    error: Optional[str] = None
+    code_blocks: List[str] = []
+    sink = CallbackSink(on_code_block=code_blocks.append) # Quiet; collects blocks as they stream
+    try:
+        result = llm_workflow.run_request(
+            product=request['product'],
+            operation=request['operation'],
+            target=request['target'],
+            mode=request['mode'],
+            msg=request['msg'],
+            use_cache=use_cache,
+            refresh=refresh,
+            sink=sink,
+        )
+        if result.response is None:
+            error = result.error or "RequestFailed"
+    except Exception as e: # A failing entry must not take down the whole batch
+        error = type(e).__name__
+    return {
+        'index': index,
+        **request,
+        'ok': error is None,
+        'code_blocks': code_blocks,
+        'elapsed_seconds': round(time.perf_counter() - started, 4),
+        'error': error,
+    }
+
+
+def run_batch(
+    requests: List[Dict[str, Any]],
+    output: TextIO,
+    max_workers: int = 4,
+    use_cache: bool = True,
+    refresh: bool = False,
+    log: TextIO = sys.stderr
+) -> int:
+    """
+    Runs the requests with bounded concurrency, writing each result as a JSON line as it completes.
+    Progress chatter printed by the workflow is redirected to `log` so `output` stays valid JSONL.
+
+    Args:
+        requests: Normalized request dictionaries (see read_manifest).
+        output: Text stream receiving one JSON result per request.
+        max_workers: Maximum number of requests in flight at once.
+        use_cache: Whether to use the on-disk response cache.
+        refresh: Skip cache lookups but still store fresh responses.
+        log: Stream receiving the workflow's progress output.
+
+    Returns:
+        The number of failed requests.
+    """
+    failures = 0
+    with contextlib.redirect_stdout(log), ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = [pool.submit(_run_one, i, req, use_cache, refresh) for i, req in enumerate(requests)]
+        for future in as_completed(futures):
+            result = future.result()
+            if not result['ok']:
+                failures += 1
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+    return failures
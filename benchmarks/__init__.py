@@ -0,0 +1,5 @@
+# benchmarks/__init__.py
+"""
+Reproducible, network-free benchmarks for the middleware.
+Run from the repository root, e.g. `python -m benchmarks.run_all`.
+"""
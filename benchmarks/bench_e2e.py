@@ -0,0 +1,126 @@
+# benchmarks/bench_e2e.py
+"""
+End-to-end latency and throughput of handle_request / send_and_process against the
+fake server, comparing sequential, concurrent and cached runs on the same machine.
+
+Usage: python -m benchmarks.bench_e2e --requests 50 --concurrency 8 --token-rate 200
+"""
+import time
+import asyncio
+import argparse
+from typing import Dict, Any, List
+
+from benchmarks import harness
+from benchmarks.fake_server import FakeOpenAIServer
+
+import llm_config
+import llm_workflow
+import chatsend
+import http_pool
+from output_sinks import OutputSink, CallbackSink
+
+_REQUEST = dict(product='curl', operation='install', target='local', mode='execute')
+
+
+def _timed_sink(started: float, first_token: List[float]) -> CallbackSink:
+    """Sink recording the time-to-first-chunk of one request."""
+    def on_chunk(_chunk: str) -> None:
+        if not first_token:
+            first_token.append(time.perf_counter() - started)
+    return CallbackSink(on_chunk=on_chunk)
+
+
+async def _one(msg: str, use_cache: bool, latencies: List[float], ttfts: List[float]) -> None:
+    started = time.perf_counter()
+    first_token: List[float] = []
+    result = await llm_workflow.arun_request(**_REQUEST, msg=msg, use_cache=use_cache,
+                                             sink=_timed_sink(started, first_token))
+    if result.response is None:
+        raise RuntimeError(f"Request failed during benchmark: {result.error}")
+    latencies.append(time.perf_counter() - started)
+    ttfts.extend(first_token)
+
+
+def _mode_result(latencies: List[float], ttfts: List[float], wall: float) -> Dict[str, Any]:
+    return {
+        'latency': harness.summarize(latencies),
+        'ttft': harness.summarize(ttfts),
+        'throughput_rps': round(len(latencies) / wall, 2) if wall > 0 else None,
+    }
+
+
+def run_sequential(requests: int, use_cache: bool) -> Dict[str, Any]:
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    started = time.perf_counter()
+    for i in range(requests):
+        # Distinct msgs defeat the cache unless the run is meant to hit it
+        # run_sync (like handle_request) keeps the thread's loop, so pooled connections are reused
+        http_pool.run_sync(_one("N/A" if use_cache else f"request {i}", use_cache, latencies, ttfts))
+    return _mode_result(latencies, ttfts, time.perf_counter() - started)
+
+
+def run_concurrent(requests: int, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    ttfts: List[float] = []
+
+    async def bounded(i: int, limit: asyncio.Semaphore) -> None:
+        async with limit:
+            await _one(f"concurrent {i}", False, latencies, ttfts)
+
+    async def run_all() -> None:
+        limit = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(bounded(i, limit) for i in range(requests)))
+
+    started = time.perf_counter()
+    asyncio.run(run_all())
+    return _mode_result(latencies, ttfts, time.perf_counter() - started)
+
+
+def run_send_and_process(requests: int, port: int) -> Dict[str, Any]:
+    """chatsend.send_and_process alone (no prompt selection or config lookup)."""
+    config = llm_config.get_llm_config('local', port)
+    latencies: List[float] = []
+    for i in range(requests):
+        started = time.perf_counter()
+        if chatsend.send_and_process(f"benchmark prompt {i}", 'local', config, use_cache=False, sink=OutputSink()) is None:
+            raise RuntimeError("send_and_process failed during benchmark")
+        latencies.append(time.perf_counter() - started)
+    return {'latency': harness.summarize(latencies)}
+
+
+def run(requests: int = 30, concurrency: int = 8, token_rate: float = 0.0, chunk_size: int = 4,
+        first_token_delay: float = 0.0) -> Dict[str, Any]:
+    server = FakeOpenAIServer(token_rate=token_rate, chunk_size=chunk_size, first_token_delay=first_token_delay)
+    with server, harness.local_target(server), harness.quiet():
+        # The first litellm call in a process pays one-off setup; report it separately
+        cold: List[float] = []
+        asyncio.run(_one("cold start", False, cold, []))
+        results = {
+            'first_call_ms': round(1000 * cold[0], 3),
+            'sequential': run_sequential(requests, use_cache=False),
+            'concurrent': run_concurrent(requests, concurrency),
+            'cached': run_sequential(requests, use_cache=True),
+            'send_and_process': run_send_and_process(requests, server.port),
+        }
+    results['settings'] = {'requests': requests, 'concurrency': concurrency, 'token_rate': token_rate,
+                           'chunk_size': chunk_size, 'first_token_delay': first_token_delay}
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end handle_request benchmark against a fake server.")
+    parser.add_argument('--requests', type=int, default=30)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--token-rate', type=float, default=0.0, help='Fake server chunks/sec (0 = unthrottled).')
+    parser.add_argument('--chunk-size', type=int, default=4)
+    parser.add_argument('--first-token-delay', type=float, default=0.0)
+    parser.add_argument('--output', default=None, help='Write results as JSON to this file.')
+    args = parser.parse_args()
+    results = run(args.requests, args.concurrency, args.token_rate, args.chunk_size, args.first_token_delay)
+    harness.print_results("handle_request end-to-end", results)
+    harness.write_json(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
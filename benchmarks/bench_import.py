@@ -0,0 +1,88 @@
+# benchmarks/bench_import.py
+"""
+Cold-start cost measured in fresh interpreters: importing the CLI entry point,
+running `main.py --help`, importing the workflow, and importing litellm on its
+own for reference. Also checks which heavy modules each startup path loaded:
+litellm, openai and httpx must only be imported on the first send, and llama_man
+only for local requests. --check turns violations (and --max-help-ms) into a
+non-zero exit status.
+
+Usage: python -m benchmarks.bench_import --repeats 5 --check --max-help-ms 300
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+from typing import Dict, Any, List, Optional
+
+from benchmarks import harness
+
+_COMMANDS = {
+    'import_main': [sys.executable, '-c', 'import main'],
+    'main_help': [sys.executable, 'main.py', '--help'],
+    'import_workflow': [sys.executable, '-c', 'import llm_workflow'],
+    'import_litellm': [sys.executable, '-c', 'import litellm'],
+}
+
+# Modules that must stay out of the startup path (loaded on first send / first local request)
+_DEFERRED_MODULES = ('litellm', 'openai', 'httpx', 'llama_man')
+# Startup paths whose module set is checked
+_STARTUP_IMPORTS = ('main', 'llm_workflow', 'batch', 'middleware_client')
+
+
+def _time_command(command: List[str], repeats: int) -> Dict[str, float]:
+    samples = []
+    env = dict(os.environ, LITELLM_LOCAL_MODEL_COST_MAP=os.environ.get('LITELLM_LOCAL_MODEL_COST_MAP', 'True'))
+    for _ in range(repeats):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=harness.REPO_ROOT, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - started)
+    return harness.summarize(samples)
+
+
+def eagerly_loaded(module: str) -> List[str]:
+    """Deferred modules that importing module (in a fresh interpreter) loads anyway."""
+    probe = (f"import sys, {module}; "
+             f"print(' '.join(m for m in {_DEFERRED_MODULES!r} if m in sys.modules))")
+    output = subprocess.run([sys.executable, '-c', probe], cwd=harness.REPO_ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return output.split()
+
+
+def run(repeats: int = 3) -> Dict[str, Any]:
+    results: Dict[str, Any] = {name: _time_command(command, repeats) for name, command in _COMMANDS.items()}
+    results['eager_imports'] = {module: eagerly_loaded(module) or '-' for module in _STARTUP_IMPORTS}
+    results['settings'] = {'repeats': repeats, 'python': sys.version.split()[0]}
+    return results
+
+
+def check(results: Dict[str, Any], max_help_ms: Optional[float] = None) -> List[str]:
+    """Startup regressions in results (empty if there are none)."""
+    problems = [f"'import {module}' loads {', '.join(loaded)}"
+                for module, loaded in results['eager_imports'].items() if loaded != '-']
+    if max_help_ms is not None and results['main_help']['p50_ms'] > max_help_ms:
+        problems.append(f"'main.py --help' p50 {results['main_help']['p50_ms']}ms exceeds {max_help_ms}ms")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cold-start import time benchmark.")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', default=None, help='Write results as JSON to this file.')
+    parser.add_argument('--check', action='store_true', help='Exit non-zero on eager heavy imports or a slow --help.')
+    parser.add_argument('--max-help-ms', type=float, default=None, help='With --check: p50 budget for main.py --help.')
+    args = parser.parse_args()
+    results = run(args.repeats)
+    harness.print_results("cold start", results)
+    harness.write_json(args.output, results)
+    if args.check:
+        problems = check(results, args.max_help_ms)
+        for problem in problems:
+            print(f"Error: Startup regression: {problem}", file=sys.stderr)
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
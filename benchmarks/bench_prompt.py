@@ -0,0 +1,61 @@
+# benchmarks/bench_prompt.py
+"""
+Prompt rendering cost: registry lookup + pre-compiled render versus plain str.format
+on the same template, and the full llm_workflow._get_prompt selection path.
+
+Usage: python -m benchmarks.bench_prompt --iterations 20000
+"""
+import time
+import argparse
+from typing import Dict, Any
+
+from benchmarks import harness
+
+import llm_prompt
+import prompt_registry
+import llm_workflow
+
+_CASES = {
+    'execute_mapped': ('splunk-otel-collector', 'install', 'execute'),
+    'execute_fallback': ('unknown-product', 'install', 'execute'),
+    'chat': ('curl', 'install', 'chat'),
+    'fix': ('curl', 'install', 'fix'),
+}
+_MSG = "Error: curl: (6) Could not resolve host: example.com"
+
+
+def _per_call_us(iterations: int, func) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return round(1e6 * (time.perf_counter() - started) / iterations, 3)
+
+
+def run(iterations: int = 20000) -> Dict[str, Any]:
+    values = dict(product='splunk-otel-collector', operation='install', mode='execute', msg=_MSG)
+    template = prompt_registry.lookup_execute('install', 'splunk-otel-collector')
+    results: Dict[str, Any] = {
+        'render_str_format_us': _per_call_us(iterations, lambda: llm_prompt.INSTALL_SPLUNK_OTEL_COLLECTOR.format(**values)),
+        'render_compiled_us': _per_call_us(iterations, lambda: template.render(**values)),
+        'lookup_execute_us': _per_call_us(iterations, lambda: prompt_registry.lookup_execute('install', 'splunk-otel-collector')),
+    }
+    with harness.quiet():
+        for name, (product, operation, mode) in _CASES.items():
+            results[f"get_prompt_{name}_us"] = _per_call_us(
+                iterations, lambda: llm_workflow._get_prompt(product, operation, mode, _MSG))
+    results['settings'] = {'iterations': iterations}
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Prompt selection and rendering benchmark.")
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--output', default=None, help='Write results as JSON to this file.')
+    args = parser.parse_args()
+    results = run(args.iterations)
+    harness.print_results("prompt rendering", results)
+    harness.write_json(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
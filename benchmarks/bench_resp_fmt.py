@@ -0,0 +1,79 @@
+# benchmarks/bench_resp_fmt.py
+"""
+Code-block extraction throughput: extract_code_blocks on a full response versus
+StreamingCodeBlockExtractor fed the same response in chunks, plus structured
+parsing with deduplication (parse_code_blocks + dedupe_code_blocks). The
+'unclosed_fence' case is a fence that never closes, followed by a long whitespace run.
+
+Usage: python -m benchmarks.bench_resp_fmt --sizes 1000,10000,100000 --chunk-size 4
+"""
+import time
+import argparse
+from typing import Dict, Any, List
+
+from benchmarks import harness
+from benchmarks.fake_server import DEFAULT_CORPUS
+
+import resp_fmt
+
+
+def synthetic_response(size: int) -> str:
+    """Repeats the fake-server corpus (prose, fenced blocks and inline spans) up to size characters."""
+    unit = "\n\n".join(DEFAULT_CORPUS) + "\n\n"
+    return (unit * (size // len(unit) + 1))[:size]
+
+
+def _best_of(repeats: int, func) -> float:
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run(sizes: List[int] = (1_000, 10_000, 100_000, 500_000), chunk_size: int = 4, repeats: int = 5) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for size in sizes:
+        text = synthetic_response(size)
+        chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+        def streaming() -> None:
+            extractor = resp_fmt.StreamingCodeBlockExtractor()
+            for chunk in chunks:
+                extractor.feed(chunk)
+            extractor.close()
+
+        full = _best_of(repeats, lambda: resp_fmt.extract_code_blocks(text))
+        streamed = _best_of(repeats, streaming)
+        parsed = _best_of(repeats, lambda: resp_fmt.dedupe_code_blocks(resp_fmt.parse_code_blocks(text)))
+        results[f"{size}_chars"] = {
+            'blocks': len(resp_fmt.extract_code_blocks(text)),
+            'full_ms': round(1000 * full, 3),
+            'full_mb_per_s': round(size / full / 1e6, 2),
+            'streaming_ms': round(1000 * streamed, 3),
+            'streaming_mb_per_s': round(size / streamed / 1e6, 2),
+            'parse_dedupe_ms': round(1000 * parsed, 3),
+        }
+    # Worst case for a lazy-body regex: every position retries the closing-fence match
+    unclosed = "```bash\n" + " " * max(sizes) + "x"
+    results['unclosed_fence'] = {'chars': len(unclosed),
+                                 'full_ms': round(1000 * _best_of(repeats, lambda: resp_fmt.extract_code_blocks(unclosed)), 3)}
+    results['settings'] = {'chunk_size': chunk_size, 'repeats': repeats}
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="resp_fmt code-block extraction benchmark.")
+    parser.add_argument('--sizes', default='1000,10000,100000,500000', help='Comma-separated response sizes in characters.')
+    parser.add_argument('--chunk-size', type=int, default=4, help='Characters per streamed chunk.')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--output', default=None, help='Write results as JSON to this file.')
+    args = parser.parse_args()
+    results = run([int(size) for size in args.sizes.split(',')], args.chunk_size, args.repeats)
+    harness.print_results("resp_fmt extraction", results)
+    harness.write_json(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+# benchmarks/fake_server.py
+"""
+Local stand-in for an OpenAI-compatible server (llama-server / openrouter).
+Speaks POST /v1/chat/completions (streaming SSE and non-streaming), GET /v1/models
+and GET /health, with a configurable token rate, chunk size, first-token delay and
+response corpus, so benchmarks are deterministic and network-free.
+
+Run standalone:  python -m benchmarks.fake_server --port 8012 --token-rate 200
+"""
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Optional
+
+# Built-in corpus: answers shaped like the real ones (prose plus fenced and inline code)
+DEFAULT_CORPUS = [
+    "To check whether curl is installed, run:\n```bash\ncurl --version\n```\n"
+    "If it is missing, install it with Homebrew using `brew install curl`:\n"
+    "```bash\nbrew install curl\n```\nAfterwards verify with `which curl`.",
+
+    "First check for an existing installation:\n```bash\nlaunchctl list | grep otel\n```\n"
+    "If nothing is listed, download and run the installer:\n"
+    "```bash\ncurl -sSL https://dl.signalfx.com/splunk-otel-collector.sh > /tmp/splunk-otel-collector.sh\n"
+    "sudo sh /tmp/splunk-otel-collector.sh --realm $SPLUNK_REALM -- $SPLUNK_ACCESS_TOKEN\n```\n"
+    "Then confirm the service is running with `sudo systemctl status splunk-otel-collector`.",
+
+    "The error indicates a missing dependency. Install it and retry:\n"
+    "```bash\nbrew update && brew install openssl@3\n```\n"
+    "If the problem persists, remove the partial install with `brew uninstall --force curl` and reinstall.",
+]
+
+DEFAULT_MODEL = 'gemma-3-1b-it-Q4_K_M.gguf'
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass # Clients dropping pooled keep-alive connections is expected
+
+
+class FakeOpenAIServer:
+    """Threaded fake server; use as a context manager or call start()/stop()."""
+    def __init__(self,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 token_rate: float = 0.0,
+                 chunk_size: int = 4,
+                 first_token_delay: float = 0.0,
+                 corpus: Optional[List[str]] = None,
+                 fail_requests: int = 0,
+                 fail_status: int = 429,
+                 retry_after: Optional[float] = None):
+        """
+        Args:
+            host: Interface to bind.
+            port: Port to bind (0 picks a free port; see .port).
+            token_rate: Chunks per second to stream (0 streams as fast as possible).
+            chunk_size: Characters per streamed chunk.
+            first_token_delay: Seconds to wait before the first chunk (simulated prefill).
+            corpus: Candidate responses; each prompt deterministically maps to one.
+            fail_requests: Chat completions answered with fail_status before serving normally
+                (simulated rate limiting or overload).
+            fail_status: HTTP status of those failures (429, 503, ...).
+            retry_after: Retry-After seconds sent with the failures (None: no header).
+        """
+        self.token_rate = token_rate
+        self.chunk_size = max(1, chunk_size)
+        self.first_token_delay = first_token_delay
+        self.corpus = corpus or DEFAULT_CORPUS
+        self.fail_requests = fail_requests
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.requests_served = 0
+        self._lock = threading.Lock()
+        self._httpd = _QuietHTTPServer((host, port), self._make_handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    @property
+    def api_base(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def response_for(self, messages: List[dict]) -> str:
+        """Picks the corpus entry for a conversation (stable across runs)."""
+        digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode('utf-8')).digest()
+        return self.corpus[digest[0] % len(self.corpus)]
+
+    def start(self) -> 'FakeOpenAIServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._thread is not None: # shutdown() blocks unless serve_forever is running
+            self._httpd.shutdown()
+            self._thread = None
+        self._httpd.server_close()
+
+    def __enter__(self) -> 'FakeOpenAIServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def serve_forever(self) -> None:
+        """Serves in the calling thread until interrupted."""
+        try:
+            self._httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._httpd.server_close()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass # Keep benchmark output clean
+
+            def _send_json(self, status: int, payload: dict, headers: Optional[dict] = None) -> None:
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _write_chunk(self, data: bytes) -> None:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path == '/health':
+                    self._send_json(200, {'status': 'ok'})
+                elif self.path == '/v1/models':
+                    self._send_json(200, {'object': 'list', 'data': [{'id': DEFAULT_MODEL, 'object': 'model'}]})
+                else:
+                    self._send_json(404, {'error': 'not found'})
+
+            def do_POST(self):
+                if self.path.rstrip('/') != '/v1/chat/completions':
+                    self._send_json(404, {'error': 'not found'})
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                request = json.loads(self.rfile.read(length) or b'{}')
+                with server._lock:
+                    server.requests_served += 1
+                    failing = server.requests_served <= server.fail_requests
+                if failing:
+                    headers = {'Retry-After': f"{server.retry_after:g}"} if server.retry_after is not None else None
+                    self._send_json(server.fail_status, {'error': {'message': 'Simulated failure', 'code': server.fail_status}},
+                                    headers)
+                    return
+                text = server.response_for(request.get('messages', []))
+                model = request.get('model', DEFAULT_MODEL)
+                if not request.get('stream'):
+                    self._send_json(200, {
+                        'id': 'chatcmpl-fake', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+                    })
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                if server.first_token_delay:
+                    time.sleep(server.first_token_delay)
+                interval = 1.0 / server.token_rate if server.token_rate > 0 else 0.0
+                created = int(time.time())
+                for start in range(0, len(text), server.chunk_size):
+                    event = {
+                        'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                        'choices': [{'index': 0, 'delta': {'content': text[start:start + server.chunk_size]}, 'finish_reason': None}],
+                    }
+                    self._write_chunk(b"data: " + json.dumps(event).encode('utf-8') + b"\n\n")
+                    if interval:
+                        time.sleep(interval)
+                final = {
+                    'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                    'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+                }
+                self._write_chunk(b"data: " + json.dumps(final).encode('utf-8') + b"\n\n")
+                # Last event and the chunked-encoding terminator go out together, so a client that
+                # stops reading at [DONE] still finds the response complete and keeps the connection
+                done = b"data: [DONE]\n\n"
+                self.wfile.write(b"%x\r\n%s\r\n0\r\n\r\n" % (len(done), done))
+                self.wfile.flush()
+
+        return Handler
+
+
+def load_corpus(path: str) -> List[str]:
+    """Reads a corpus file: JSON lines of strings or of objects with a 'text' field."""
+    corpus = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                corpus.append(entry['text'] if isinstance(entry, dict) else entry)
+    return corpus
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8012, help='Port (8012 is the local target default).')
+    parser.add_argument('--token-rate', type=float, default=0.0, help='Chunks per second (0 = unthrottled).')
+    parser.add_argument('--chunk-size', type=int, default=4, help='Characters per chunk.')
+    parser.add_argument('--first-token-delay', type=float, default=0.0, help='Seconds before the first chunk.')
+    parser.add_argument('--corpus', default=None, help='JSONL corpus file (strings or {"text": ...}).')
+    args = parser.parse_args()
+    corpus = load_corpus(args.corpus) if args.corpus else None
+    server = FakeOpenAIServer(args.host, args.port, args.token_rate, args.chunk_size, args.first_token_delay, corpus)
+    print(f"Info: Fake OpenAI-compatible server on {server.api_base} (Ctrl+C to stop).")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# benchmarks/harness.py
+"""
+Shared helpers for the benchmark scripts: pointing the 'local' target at a fake
+server, isolating the response cache, silencing workflow output and summarizing samples.
+"""
+import os
+import sys
+import json
+import math
+import tempfile
+import contextlib
+from typing import Dict, Any, List, Iterator, Optional
+
+# Benchmarks import the middleware modules from the repository root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import local_server_manager
+import response_cache
+import semantic_cache
+import artifact_store
+from benchmarks.fake_server import FakeOpenAIServer
+
+
+class _FakeServerManager:
+    """Stands in for LocalServerManager: the fake server is always 'running' on its port."""
+    def __init__(self, port: int):
+        self.port = port
+
+    @property
+    def instances(self) -> List[local_server_manager.ServerInstance]:
+        return [local_server_manager.ServerInstance(self.port, primary=True)]
+
+    def ensure_running(self) -> bool:
+        return True
+
+    def get_port(self) -> Optional[int]:
+        return self.port
+
+    def acquire(self) -> Optional[int]:
+        return self.port
+
+    def release(self, port: int, failed: bool = False) -> None:
+        pass
+
+
+@contextlib.contextmanager
+def local_target(server: FakeOpenAIServer) -> Iterator[FakeOpenAIServer]:
+    """
+    Routes the 'local' target to the fake server (the api_base llm_config builds for
+    its port) and gives the run private, empty response/semantic caches and artifact store.
+    """
+    saved_manager = local_server_manager._manager_instance
+    saved_cache = response_cache._cache_instance
+    saved_index = semantic_cache._index_instance
+    saved_artifacts = artifact_store._store_instance
+    with tempfile.TemporaryDirectory(prefix='middleware-bench-') as cache_dir:
+        local_server_manager._manager_instance = _FakeServerManager(server.port)
+        response_cache._cache_instance = response_cache.ResponseCache(path=os.path.join(cache_dir, 'responses.sqlite3'))
+        semantic_cache._index_instance = semantic_cache.SemanticIndex(path=os.path.join(cache_dir, 'semantic.sqlite3'))
+        artifact_store._store_instance = artifact_store.ArtifactStore(path=os.path.join(cache_dir, 'artifacts.sqlite3'))
+        try:
+            yield server
+        finally:
+            local_server_manager._manager_instance = saved_manager
+            response_cache._cache_instance = saved_cache
+            semantic_cache._index_instance = saved_index
+            artifact_store._store_instance = saved_artifacts
+
+
+@contextlib.contextmanager
+def quiet() -> Iterator[None]:
+    """Discards the workflow's progress prints while measuring."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds."""
+    values = sorted(samples)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(1000 * sum(values) / len(values), 3),
+        'p50_ms': round(1000 * percentile(values, 0.50), 3),
+        'p95_ms': round(1000 * percentile(values, 0.95), 3),
+        'p99_ms': round(1000 * percentile(values, 0.99), 3),
+        'min_ms': round(1000 * values[0], 3),
+        'max_ms': round(1000 * values[-1], 3),
+    }
+
+
+def print_results(title: str, results: Dict[str, Any]) -> None:
+    """Prints one benchmark's results as an aligned table."""
+    print(f"\n=== {title} ===")
+    width = max((len(name) for name in results), default=0)
+    for name, value in results.items():
+        if isinstance(value, dict):
+            value = ", ".join(f"{key}={val}" for key, val in value.items())
+        print(f"{name.ljust(width)}  {value}")
+
+
+def write_json(path: Optional[str], results: Dict[str, Any]) -> None:
+    if path:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nInfo: Results written to {path}")
@@ -0,0 +1,35 @@
+# benchmarks/run_all.py
+"""
+Runs every benchmark with its defaults (or a reduced --quick configuration) and
+optionally writes one combined JSON report for comparing runs.
+
+Usage: python -m benchmarks.run_all --output bench.json
+"""
+import argparse
+from typing import Dict, Any
+
+from benchmarks import harness, bench_e2e, bench_resp_fmt, bench_prompt, bench_import
+
+
+def run(quick: bool = False) -> Dict[str, Any]:
+    return {
+        'e2e': bench_e2e.run(requests=10 if quick else 30),
+        'resp_fmt': bench_resp_fmt.run(sizes=[1_000, 100_000] if quick else [1_000, 10_000, 100_000, 500_000]),
+        'prompt': bench_prompt.run(iterations=2000 if quick else 20000),
+        'import': bench_import.run(repeats=1 if quick else 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the full benchmark suite.")
+    parser.add_argument('--quick', action='store_true', help='Fewer iterations for a fast smoke run.')
+    parser.add_argument('--output', default=None, help='Write combined results as JSON to this file.')
+    args = parser.parse_args()
+    results = run(args.quick)
+    for name, section in results.items():
+        harness.print_results(name, section)
+    harness.write_json(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
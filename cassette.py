@@ -0,0 +1,164 @@
+# cassette.py
+"""
+Deterministic record/replay of LLM streams.
+In record mode every completed stream of llm_interface.astream_litellm_response is
+saved as a cassette: the content chunks with the delay before each (the first delay
+is the time to first token), gzip-compressed JSON in one file per request hash.
+In replay mode streams are served from those cassettes at the recorded pace, sped
+up, or instantly: no litellm call, no network, no llama-server and no admission
+control (replays stand in for the server, not for this client's limits).
+
+This reproduces recorded latency profiles offline, load-tests the workflow's
+concurrency and resp_fmt at scale, and separates our own overhead from model time.
+Requests are keyed by model, messages and sampling parameters; endpoint and key
+are left out, so a recording from one local instance replays against any.
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+import tempfile
+import threading
+from typing import Optional, Dict, Any, List, AsyncIterator
+
+FORMAT_VERSION = 1
+# litellm arguments that determine the response (everything else is transport)
+KEY_ARGS = ('model', 'messages', 'temperature', 'top_p', 'max_tokens', 'stop', 'seed')
+
+class CassetteMiss(Exception): pass
+
+
+def request_key(litellm_args: Dict[str, Any]) -> str:
+    """Hash identifying a request across processes and endpoints."""
+    material = {name: litellm_args[name] for name in KEY_ARGS if litellm_args.get(name) is not None}
+    encoded = json.dumps(material, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class Recording:
+    """One stream being recorded (created when the request is sent)."""
+    def __init__(self, deck: 'CassetteDeck', litellm_args: Dict[str, Any], target: str):
+        self._deck = deck
+        self.key = request_key(litellm_args)
+        self.model = litellm_args.get('model')
+        self.target = target
+        self._last = time.perf_counter()
+        self.chunks: List[List[Any]] = []
+
+    def add(self, text: str) -> None:
+        now = time.perf_counter()
+        self.chunks.append([round(now - self._last, 4), text])
+        self._last = now
+
+    def save(self) -> None:
+        """Writes the cassette (the stream completed); replaces an older one of the same request."""
+        self._deck.save(self)
+
+
+class CassetteDeck:
+    """Record/replay configuration of the process (see configure)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.record_dir: Optional[str] = None
+        self.replay_dir: Optional[str] = None
+        self.speed = 1.0
+        self.recorded = 0
+        self.replayed = 0
+        self.configure(record_dir=os.environ.get("LLM_RECORD_DIR") or None,
+                       replay_dir=os.environ.get("LLM_REPLAY_DIR") or None,
+                       speed=float(os.environ.get("LLM_REPLAY_SPEED", "1.0")))
+
+    def configure(self, record_dir: Optional[str] = None, replay_dir: Optional[str] = None,
+                  speed: float = 1.0) -> None:
+        """
+        Args:
+            record_dir: Directory receiving a cassette for every completed live stream.
+            replay_dir: Directory to serve streams from instead of calling the LLM.
+            speed: Replay pace relative to the recording (2.0: twice as fast; 0: instant).
+        """
+        if record_dir and replay_dir:
+            raise ValueError("Recording and replaying at the same time is not supported.")
+        if speed < 0:
+            raise ValueError("The replay speed must not be negative.")
+        self.record_dir = record_dir
+        self.replay_dir = replay_dir
+        self.speed = speed
+
+    @property
+    def recording(self) -> bool:
+        return self.record_dir is not None
+
+    @property
+    def replaying(self) -> bool:
+        return self.replay_dir is not None
+
+    def _path(self, directory: str, key: str) -> str:
+        return os.path.join(directory, f"{key}.json.gz")
+
+    def start(self, litellm_args: Dict[str, Any], target: str) -> Optional[Recording]:
+        """A Recording for this request, or None when not recording."""
+        return Recording(self, litellm_args, target) if self.recording else None
+
+    def save(self, recording: Recording) -> None:
+        document = {
+            'version': FORMAT_VERSION,
+            'key': recording.key,
+            'model': recording.model,
+            'target': recording.target,
+            'recorded_at': time.time(),
+            'chunks': recording.chunks,
+        }
+        try:
+            os.makedirs(self.record_dir, exist_ok=True)
+            # Written under a temporary name and renamed, so replays never read a partial cassette
+            fd, tmp_path = tempfile.mkstemp(dir=self.record_dir, prefix='.cassette-')
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as f:
+                f.write(json.dumps(document, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+            os.replace(tmp_path, self._path(self.record_dir, recording.key))
+            with self._lock:
+                self.recorded += 1
+        except OSError as e:
+            print(f"Warning: Could not write cassette {recording.key[:12]}: {e}", file=sys.stderr)
+
+    def load(self, litellm_args: Dict[str, Any]) -> List[List[Any]]:
+        """
+        The recorded [delay, text] chunks of a request.
+
+        Raises:
+            CassetteMiss: If there is no readable cassette for the request.
+        """
+        key = request_key(litellm_args)
+        path = self._path(self.replay_dir, key)
+        try:
+            with gzip.open(path, 'rb') as f:
+                document = json.loads(f.read())
+        except FileNotFoundError:
+            raise CassetteMiss(f"No cassette for request {key[:12]} (model {litellm_args.get('model')}) "
+                               f"in '{self.replay_dir}'.") from None
+        except (OSError, ValueError) as e:
+            raise CassetteMiss(f"Unreadable cassette '{path}': {e}") from e
+        if document.get('version') != FORMAT_VERSION:
+            raise CassetteMiss(f"Cassette '{path}' has unsupported format version {document.get('version')}.")
+        return document['chunks']
+
+    async def areplay(self, litellm_args: Dict[str, Any]) -> AsyncIterator[str]:
+        """Yields the recorded chunks of a request at the configured speed."""
+        chunks = self.load(litellm_args)
+        with self._lock:
+            self.replayed += 1
+        started = time.perf_counter()
+        elapsed = 0.0 # Recorded time up to the current chunk; sleeps follow it without drifting
+        for delay, text in chunks:
+            if self.speed > 0:
+                elapsed += delay
+                wait = started + elapsed / self.speed - time.perf_counter()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            yield text
+
+
+# Process-wide deck (configured from LLM_RECORD_DIR / LLM_REPLAY_DIR / LLM_REPLAY_SPEED or the CLI)
+deck = CassetteDeck()
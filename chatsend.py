@@ -2,80 +2,191 @@
 """
 Handles sending a chat request and processing the response stream.
 Requires configuration to be passed in.
+The implementation is async (asend, which returns the error with the response);
+asend_and_process and send_and_process are thin wrappers returning just the response
+(callers that need the error class use asend).
 """
 import sys
-from typing import List, Optional, Dict, Any
+import time
+import asyncio
+from typing import List, Optional, Dict, Any, AsyncIterator, NamedTuple
 
 # Direct imports of dependencies
 import llm_interface # Handles actual litellm calls
-from local_server_manager import LocalServerManager # Manages local server
+import http_pool # Per-thread event loop for the sync wrapper
+import llm_config # Builds the api_base of leased local server instances
+import response_cache # On-disk cache of previous responses
+import resp_fmt # Incremental code block extraction while streaming
+import metrics # Per-request stage timings
+import single_flight # Coalesces identical in-flight requests
+import semantic_cache # Near-duplicate lookup for chat/fix messages
+import cassette # Replays need no local server
+from response_buffer import ResponseBuffer # Spills very large responses to a temporary file
+from output_sinks import OutputSink, ConsoleSink # Where prompt/stream output goes
 
-# Lazily instantiated manager (kept internal to this module)
-_server_manager_instance: Optional[LocalServerManager] = None
 
-def _get_server_manager() -> LocalServerManager:
-    """Gets or creates the singleton server manager instance."""
-    global _server_manager_instance
-    if _server_manager_instance is None:
-        _server_manager_instance = LocalServerManager()
-    return _server_manager_instance
+class LocalServerError(Exception): pass
 
 
-# --- Only Public Method ---
+class SendResult(NamedTuple):
+    """Outcome of one asend call."""
+    response: Optional[str] # Full response, or None on error
+    error: Optional[str] = None # Error class name if the send failed
+    cache_hit: bool = False # Served from the response (or semantic) cache
+
+
+# --- Public Methods ---
 def send_and_process(
     prompt: str,
     target: str,
-    config: Dict[str, Any] # Configuration MUST be provided now
+    config: Dict[str, Any], # Configuration MUST be provided now
+    use_cache: bool = True,
+    refresh: bool = False,
+    sink: Optional[OutputSink] = None,
+    similar: Optional[semantic_cache.SemanticQuery] = None
+) -> str | None | Any:
+    """
+    Synchronous wrapper around asend_and_process (see there for details).
+    Runs on the thread's long-lived event loop so pooled connections are reused across calls.
+    Must not be called from inside a running event loop; await asend_and_process instead.
+    """
+    result = http_pool.run_sync(asend(prompt, target, config, use_cache=use_cache, refresh=refresh,
+                                      sink=sink, similar=similar))
+    return result.response
+
+
+async def asend_and_process(
+    prompt: str,
+    target: str,
+    config: Dict[str, Any],
+    use_cache: bool = True,
+    refresh: bool = False,
+    sink: Optional[OutputSink] = None,
+    similar: Optional[semantic_cache.SemanticQuery] = None
 ) -> str | None | Any:
+    """Like asend, but returns only the response (None on error)."""
+    result = await asend(prompt, target, config, use_cache=use_cache, refresh=refresh, sink=sink, similar=similar)
+    return result.response
+
+
+async def asend(
+    prompt: str,
+    target: str,
+    config: Dict[str, Any],
+    use_cache: bool = True,
+    refresh: bool = False,
+    sink: Optional[OutputSink] = None,
+    similar: Optional[semantic_cache.SemanticQuery] = None
+) -> SendResult:
     """
     Sends prompt, checks server, calls LLM interface, processes response.
+    Responses are served from / stored in the on-disk response cache unless disabled.
+    Chat/fix requests (similar) that miss the exact cache may reuse the response of a
+    near-duplicate message found by the semantic cache.
+    Identical requests (same prompt, model and api_base) already in flight in this
+    process are joined instead of generating the response again.
 
     Args:
         prompt: The prompt string to send.
         target: The target endpoint ('local' or 'openrouter').
         config: The LLM configuration dictionary for the target.
+        use_cache: Whether to read from and write to the response cache.
+        refresh: Skip the cache lookup but still store the fresh response.
+        sink: Receives the prompt, each streamed chunk and, if the sink asks for them,
+            each code block as soon as it is complete. Defaults to echoing to stdout
+            (ConsoleSink); pass OutputSink() for a quiet run.
+        similar: Normalized chat/fix message (semantic_cache.make_query), or None for exact caching only.
 
     Returns:
-        A list of strings (code blocks) if successful, None on error.
+        SendResult: the full response (None on error), the error class name and whether
+        the response came from the cache.
     """
-    server_manager = _get_server_manager() # Get manager instance
+    if sink is None:
+        sink = ConsoleSink()
+    request_metrics = metrics.current()
+
+    # 0. Look up the response cache (keyed on prompt + model + api_base)
+    # SQLite reads and MinHash matching run off the event loop, like the server check below
+    with metrics.stage('cache_lookup'):
+        cache = response_cache.get_response_cache() if use_cache else None
+        cache_key = response_cache.make_cache_key(prompt, config)
+        cached_chunks = await asyncio.to_thread(cache.get, cache_key) if cache and not refresh else None
+        semantic_index = semantic_cache.get_semantic_index() if cache and similar is not None else None
+        if cached_chunks is None and semantic_index and not refresh:
+            cached_chunks = await asyncio.to_thread(_semantic_lookup, cache, semantic_index, similar, config)
+    cache_hit = cached_chunks is not None
+    if request_metrics:
+        request_metrics.cache_hit = cache_hit
 
     # 1. Check local server if applicable (internal detail of sending to local)
-    if target == 'local':
-        if not server_manager.ensure_running():
+    # A cache hit (or a replayed cassette) never reaches the server, so the check is skipped.
+    # The check may block on a server start, so it runs off the event loop.
+    if target == 'local' and cached_chunks is None and not cassette.deck.replaying:
+        from local_server_manager import get_server_manager # Deferred: only local requests need it
+        server_manager = get_server_manager() # Get shared manager instance
+        with metrics.stage('ensure_running'):
+            server_running = await asyncio.to_thread(server_manager.ensure_running)
+        if not server_running:
             print("Aborting prompt due to local server issue.")
-            return None
+            return SendResult(None, "LocalServerError")
 
-    # --- >>> ADD THIS BLOCK TO PRINT THE PROMPT <<< ---
-    # Use standard print, no need for click here
-    print("\n--- Start of Final Prompt for LLM ---")
-    print(prompt)
-    print("--- End of Final Prompt for LLM ---\n")
-    # --- >>> END OF ADDED BLOCK <<< ---
+    # Echo the final prompt (if the sink wants it)
+    sink.prompt(prompt)
 
-    # 2. Prepare Arguments (using provided config)
-    # Config lookup is no longer done here
-    llm_args = llm_interface.prepare_litellm_args(prompt, config, target)
+    # 2./3. Execute Chat and Stream Response (calls llm_interface, or replays the cache)
+    # Live requests go through the single-flight layer, keyed like the cache.
+    # Chunks are collected in a ResponseBuffer (spilled to disk past a size threshold) and
+    # joined once at the end.
+    chunks = ResponseBuffer()
+    joined = False
+
+    def on_join() -> None:
+        nonlocal joined
+        joined = True
+        print(f"Info: Joined an identical in-flight request for target '{target}' (Model: {config['model']}).")
+        if request_metrics:
+            request_metrics.coalesced = True
 
-    # 3. Execute Chat and Stream Response (calls llm_interface)
-    full_response = ""
     try:
-        response_stream = llm_interface.stream_litellm_response(llm_args, config, target)
-        print("--- Start of Response Stream ---") # Keep progress print
-        for chunk in response_stream:
-             print(chunk, end='', flush=True)
-             full_response += chunk
-        print("\n--- End of Response Stream ---")
+        if cached_chunks is not None:
+            print(f"Info: Response cache hit for target '{target}' (Model: {config['model']}).")
+            response_stream = response_cache.areplay(cached_chunks)
+        else:
+            response_stream = single_flight.llm_flights.stream(
+                cache_key, lambda: _live_stream(prompt, target, config), on_join=on_join)
+        await _stream_to_sink(response_stream, sink, chunks)
 
     except (llm_interface.LLMConnectionError,
             llm_interface.LLMAuthenticationError,
             llm_interface.LLMAPITError,
             llm_interface.LLMUnexpectedError) as e:
+        sink.flush()
+        chunks.close()
         print(f"\nError during chat execution: {e}", file=sys.stderr)
-        return None
+        return SendResult(None, type(e).__name__)
+    except LocalServerError as e:
+        sink.flush()
+        chunks.close()
+        print(f"Aborting prompt due to local server issue: {e}")
+        return SendResult(None, type(e).__name__)
     except Exception as e:
+        sink.flush()
+        chunks.close()
         print(f"\nUnexpected error processing stream in chatsend: {type(e).__name__}: {e}", file=sys.stderr)
-        return None
+        return SendResult(None, type(e).__name__)
+
+    full_response = chunks.text()
+    if chunks.spilled:
+        print(f"Info: Response of {len(chunks)} characters was spooled to a temporary file while streaming.")
+
+    # Only complete, non-empty live responses are stored (by the request that generated them)
+    try:
+        if cache and cached_chunks is None and not joined and full_response:
+            await asyncio.to_thread(cache.put, cache_key, chunks) # Read piece by piece, not copied
+            if semantic_index:
+                await asyncio.to_thread(semantic_index.add, similar, config, cache_key)
+    finally:
+        chunks.close()
 
     # 4. Return Full Response (Code block extraction removed)
     # If the stream was empty but there was no error, return the empty string
@@ -83,7 +194,110 @@ def send_and_process(
         print("Warning: No final response content accumulated.", file=sys.stderr)
         # Depending on desired behavior, could return "" or None here.
         # Returning "" seems more appropriate if the LLM just gave no output.
-        return ""
+        return SendResult("", cache_hit=cache_hit)
 
     # Return the accumulated full_response string
-    return full_response # <<< Return the raw string
\ No newline at end of file
+    return SendResult(full_response, cache_hit=cache_hit) # <<< Return the raw string
+
+
+async def areplay_chunks(prompt: str, chunks: List[str], sink: Optional[OutputSink] = None) -> str:
+    """
+    Plays a stored response (e.g. a pre-generated artifact) into sink exactly like a
+    cached response: prompt, chunks and code blocks as they complete.
+
+    Returns:
+        The full response string.
+    """
+    if sink is None:
+        sink = ConsoleSink()
+    sink.prompt(prompt)
+    replayed = ResponseBuffer()
+    await _stream_to_sink(response_cache.areplay(chunks), sink, replayed)
+    full_response = replayed.text()
+    replayed.close()
+    return full_response
+
+
+async def _stream_to_sink(response_stream: AsyncIterator[str], sink: OutputSink, chunks: ResponseBuffer) -> None:
+    """Feeds response_stream into sink (and chunks), extracting code blocks if the sink wants them."""
+    request_metrics = metrics.current()
+    extractor = resp_fmt.StreamingCodeBlockExtractor() if sink.wants_code_blocks else None
+    sink.stream_start()
+    with metrics.span('stream'):
+        async for chunk in response_stream:
+             chunks.append(chunk)
+             if request_metrics:
+                 request_metrics.record_chunk(chunk)
+             sink.chunk(chunk)
+             if extractor:
+                 extract_started = time.perf_counter()
+                 completed_blocks = extractor.feed(chunk)
+                 extract_ended = time.perf_counter()
+                 if request_metrics:
+                     request_metrics.add_stage('extract', extract_ended - extract_started)
+                 metrics.emit_span('extract', extract_started, extract_ended)
+                 for block in completed_blocks:
+                     sink.code_block(block)
+    if extractor:
+        with metrics.stage('extract'):
+            completed_blocks = extractor.close()
+        for block in completed_blocks:
+            sink.code_block(block)
+    sink.stream_end()
+
+
+def _semantic_lookup(cache: response_cache.ResponseCache,
+                     index: semantic_cache.SemanticIndex,
+                     similar: semantic_cache.SemanticQuery,
+                     config: Dict[str, Any]) -> Optional[List[str]]:
+    """Cached chunks of the closest near-duplicate message, if it is similar enough (runs in a worker thread)."""
+    match = index.lookup(similar, config)
+    if match is None:
+        return None
+    response_key, similarity = match
+    chunks = cache.get(response_key)
+    if chunks is None: # The response expired or was evicted from the exact cache
+        index.forget(response_key)
+        return None
+    print(f"Info: Semantic cache hit (similarity {similarity:.2f}) for a '{similar.mode}' message.")
+    request_metrics = metrics.current()
+    if request_metrics:
+        request_metrics.semantic_hit = True
+    return chunks
+
+
+async def _live_stream(prompt: str, target: str, config: Dict[str, Any]) -> AsyncIterator[str]:
+    """
+    Generates a live response: leases the least-loaded local server instance (for the
+    'local' target), prepares the litellm arguments and streams the reply.
+    """
+    server_manager = None
+    leased_port: Optional[int] = None
+    if target == 'local' and not cassette.deck.replaying:
+        from local_server_manager import get_server_manager
+        server_manager = get_server_manager()
+        leased_port = server_manager.acquire()
+        if leased_port is None:
+            raise LocalServerError("No healthy local server instance is available.")
+        if leased_port != server_manager.get_port():
+            # The cache/flight key stays on the primary api_base, so it is the same for every instance
+            config = dict(config, api_base=llm_config.local_api_base(leased_port))
+
+    # Prepare Arguments (using provided config)
+    llm_args = llm_interface.prepare_litellm_args(prompt, config, target)
+    received = False
+    failed = False
+    try:
+        async for chunk in llm_interface.astream_litellm_response(llm_args, config, target):
+            received = True
+            yield chunk
+    except llm_interface.LLMOverloadedError:
+        raise # Not admitted: the instance itself is fine
+    except (llm_interface.LLMConnectionError, llm_interface.LLMAPITError, llm_interface.LLMUnexpectedError):
+        # An instance that fails before answering is taken out of rotation until it is
+        # re-checked (or restarted) on the next request
+        failed = not received
+        raise
+    finally:
+        if leased_port is not None:
+            server_manager.release(leased_port, failed=failed)
@@ -1,48 +1,167 @@
 # clitest_middleware.py (Previously clitest_client.py)
 """
 Defines the command-line interface using Click.
-Invokes the workflow directly.
+Forwards requests to a running middleware daemon if there is one,
+otherwise invokes the workflow directly.
 """
 import click
 import sys
-from typing import Optional
+import contextlib
+from typing import Optional, Dict, Any
 
-# Direct import of the main workflow function
-import llm_workflow
 import resp_fmt
+import middleware_client # Stdlib only; llm_workflow (and litellm) is imported only when needed
+import metrics
+from output_sinks import ConsoleSink, CallbackSink, EventSink, EVENT_FORMATS, DEFAULT_FLUSH_CHARS
+
+def _configure_cassettes(record_dir: Optional[str], replay_dir: Optional[str], replay_speed: float) -> bool:
+    """Applies --record/--replay/--replay-speed; returns True if either mode is on."""
+    if record_dir is None and replay_dir is None:
+        return False
+    if record_dir is not None and replay_dir is not None:
+        raise click.UsageError("--record and --replay are mutually exclusive.")
+    import cassette # Only needed when recording or replaying
+    cassette.deck.configure(record_dir=record_dir, replay_dir=replay_dir, speed=replay_speed)
+    return True
 
 @click.command()
 @click.option('--product', required=True, help='The target product (e.g., Splunk OpenTelemetry Collector, curl).')
 @click.option('--operation', required=True, help='The operation (e.g., install, uninstall, configure, chat).')
 # Set target and mode to case_sensitive=False
-@click.option('--target', default='local', type=click.Choice(['local', 'openrouter'], case_sensitive=False),
-              help='The target LLM endpoint. Default: local.')
+@click.option('--target', default='local', type=click.Choice(['local', 'openrouter', 'auto'], case_sensitive=False),
+              help='The target LLM endpoint; auto picks the fastest healthy one and fails over. Default: local.')
+@click.option('--hedge', is_flag=True, default=False,
+              help='With --target auto: also query the next target if the first is slow to start streaming.')
 @click.option('--mode', default='execute', type=click.Choice(['execute', 'fix', 'chat'], case_sensitive=False),
               help='Interaction mode: execute (default), fix errors, or chat.')
 @click.option('--msg', default=None, type=str,
               help='Optional message (e.g., chat text, error details, OS info).')
-def main_command(product: str, operation: str, target: str, mode: str, msg: Optional[str]):
+@click.option('--msg-file', default=None, type=click.Path(dir_okay=False, allow_dash=True),
+              help="Read the message from a file ('-' for stdin), e.g. a large install log for fix mode. "
+                   "Only its head and tail are read when it exceeds the target's prompt budget.")
+@click.option('--no-cache', 'no_cache', is_flag=True, default=False,
+              help='Bypass the on-disk response cache entirely.')
+@click.option('--refresh', is_flag=True, default=False,
+              help='Ignore any cached response, query the LLM and update the cache.')
+@click.option('--no-daemon', 'no_daemon', is_flag=True, default=False,
+              help='Always handle the request in this process, even if a middleware daemon is running.')
+@click.option('--quiet', '-q', is_flag=True, default=False,
+              help='Do not echo the prompt or the response stream; print only the code blocks.')
+@click.option('--format', 'output_format', default='text', type=click.Choice(['text', 'json'], case_sensitive=False),
+              help='text: formatted code blocks; json: the parsed, deduplicated code blocks as one JSON document '
+                   'on stdout (progress output goes to stderr).')
+@click.option('--output', 'output_mode', default='text', type=click.Choice(['text', *EVENT_FORMATS], case_sensitive=False),
+              help='text: human-readable output; ndjson/sse: stream prompt_selected, first_token, chunk, code_block '
+                   'and done/error events as they happen (all other output goes to stderr).')
+@click.option('--output-fd', default=None, type=click.IntRange(min=1),
+              help='With --output ndjson/sse: write the events to this file descriptor instead of stdout.')
+@click.option('--flush-chars', default=DEFAULT_FLUSH_CHARS, show_default=True, type=click.IntRange(min=1),
+              help='Buffer this many streamed characters before writing them to the terminal.')
+@click.option('--metrics-file', default=None, type=click.Path(dir_okay=False),
+              help='Append per-request metrics (stage timings, TTFT, throughput) as JSON lines.')
+@click.option('--prometheus-file', default=None, type=click.Path(dir_okay=False),
+              help='Write aggregated metrics in Prometheus text format (e.g. for a textfile collector).')
+@click.option('--record', 'record_dir', default=None, type=click.Path(file_okay=False),
+              help='Record every live LLM stream (chunks and timings) as a cassette in this directory.')
+@click.option('--replay', 'replay_dir', default=None, type=click.Path(exists=True, file_okay=False),
+              help='Serve LLM streams from the cassettes in this directory (no network, no local server).')
+@click.option('--replay-speed', default=1.0, show_default=True, type=click.FloatRange(min=0),
+              help='Replay pace relative to the recording (e.g. 10 for ten times faster; 0: instant).')
+@click.option('--profile', 'profile_dir', default=None, type=click.Path(file_okay=False),
+              help='Profile the run in-process (cProfile, span trace, import times, tracemalloc) into this directory.')
+def main_command(product: str, operation: str, target: str, hedge: bool, mode: str, msg: Optional[str],
+                 msg_file: Optional[str], no_cache: bool, refresh: bool, no_daemon: bool, quiet: bool, output_format: str, output_mode: str,
+                 output_fd: Optional[int], flush_chars: int, metrics_file: Optional[str], prometheus_file: Optional[str],
+                 record_dir: Optional[str], replay_dir: Optional[str], replay_speed: float,
+                 profile_dir: Optional[str]):
     """
     Agentic Middleware CLI to get assistance for product operations via LLM.
+
+    Metrics are recorded by the process that handles the request; requests forwarded
+    to a running daemon are recorded by the daemon (see its /metrics endpoint).
     """
-    # Call the workflow handler to get the raw response
-    # Changed variable name from final_output_string to full_response
-    full_response = llm_workflow.handle_request(
-        product=product,
-        operation=operation,
-        target=target,
-        mode=mode,
-        msg=msg
-    )
+    output_mode = output_mode.lower()
+    event_output = output_mode in EVENT_FORMATS
+    if event_output and output_format.lower() == 'json':
+        raise click.UsageError("--format json cannot be combined with --output ndjson/sse.")
+    if output_fd is not None and not event_output:
+        raise click.UsageError("--output-fd requires --output ndjson or sse.")
+    if msg is not None and msg_file is not None:
+        raise click.UsageError("--msg and --msg-file are mutually exclusive.")
+    if msg_file is not None:
+        import msg_source # Only needed for file input
+        try:
+            msg = msg_source.read_msg(msg_file, msg_source.window_bytes(target.lower()))
+        except OSError as e:
+            raise click.ClickException(f"Cannot read --msg-file '{msg_file}': {e}")
+    metrics.recorder.configure(jsonl_path=metrics_file, prometheus_path=prometheus_file)
+    if _configure_cassettes(record_dir, replay_dir, replay_speed):
+        no_daemon = True # The daemon records/replays per its own configuration
+    if profile_dir is not None:
+        import profiling # Only needed when profiling
+        profiler = profiling.Profiler(profile_dir)
+        profiler.start()
+        click.get_current_context().call_on_close(profiler.stop) # Also runs on sys.exit below
+        no_daemon = True # Only an in-process run can be profiled
+    request = {
+        'product': product,
+        'operation': operation,
+        'target': target,
+        'mode': mode,
+        'msg': msg,
+        'use_cache': not no_cache,
+        'refresh': refresh,
+        'hedge': hedge,
+    }
+
+    # Code blocks are collected while the response streams, so the full text is not re-scanned
+    code_blocks = []
+    json_output = output_format.lower() == 'json'
+    if event_output:
+        # The prompt is still reported (size only with --quiet); code blocks arrive as events
+        events_stream = open(output_fd, 'w', encoding='utf-8', closefd=False) if output_fd is not None else sys.stdout
+        sink = EventSink.to_stream(events_stream, framing=output_mode, include_prompt=not quiet)
+    elif json_output:
+        sink = CallbackSink() # The JSON document is built from the full response below
+    elif quiet:
+        sink = CallbackSink(on_code_block=code_blocks.append)
+    else:
+        sink = ConsoleSink(flush_chars=flush_chars, collect_code_blocks=True)
+        code_blocks = sink.code_blocks
+
+    # Prefer the warm daemon; fall back to running the workflow in-process
+    full_response = None
+    handled = False
+    # In JSON and event modes stdout carries only the JSON document / the events
+    with contextlib.redirect_stdout(sys.stderr) if json_output or event_output else contextlib.nullcontext():
+        if not no_daemon:
+            try:
+                full_response = middleware_client.request_via_daemon(request, sink=sink)
+                handled = True
+            except middleware_client.DaemonUnavailable:
+                pass
+
+        if not handled:
+            import llm_workflow # Deferred: pulls in litellm
+            # Call the workflow handler to get the raw response
+            full_response = llm_workflow.handle_request(**request, sink=sink)
 
     # --- Handle Final Output ---
-    if full_response is not None:
+    if event_output:
+        # The done/error event already ended the stream
+        if full_response is None:
+            sys.exit(1)
+    elif full_response is not None and json_output:
+        blocks = resp_fmt.parse_code_blocks(full_response)
+        unique_blocks = resp_fmt.dedupe_code_blocks(blocks)
+        click.echo(resp_fmt.code_blocks_to_json(unique_blocks, duplicates_removed=len(blocks) - len(unique_blocks)))
+    elif full_response is not None:
         # --- >>> PROCESS AND FORMAT RESPONSE HERE <<< ---
-        # 1. Extract code blocks from the full response
-        code_blocks = resp_fmt.extract_code_blocks(full_response)
+        # 1. Code blocks were extracted by the sink as they streamed; repeats are dropped
+        unique_blocks = resp_fmt.dedupe_code_blocks(resp_fmt.from_raw_blocks(code_blocks))
 
         # 2. Format the extracted blocks for display
-        display_output = resp_fmt.format_code_blocks_for_display(code_blocks)
+        display_output = resp_fmt.format_code_blocks_for_display([block.raw for block in unique_blocks])
 
         # 3. Print the formatted output
         click.echo(display_output)
@@ -52,5 +171,115 @@ def main_command(product: str, operation: str, target: str, mode: str, msg: Opti
         click.echo("\nWorkflow completed with errors.", err=True)
         sys.exit(1)
 
-# Export the command function for main.py
-cli = main_command
\ No newline at end of file
+@click.command()
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('--output', '-o', default='-', type=click.File('w', encoding='utf-8'),
+              help='File receiving one JSON result per manifest entry. Default: stdout.')
+@click.option('--concurrency', '-j', default=4, show_default=True, type=click.IntRange(min=1),
+              help='Maximum number of requests in flight at once.')
+@click.option('--target', default='local', type=click.Choice(['local', 'openrouter', 'auto'], case_sensitive=False),
+              help='Target for entries that do not specify one. Default: local.')
+@click.option('--no-cache', 'no_cache', is_flag=True, default=False,
+              help='Bypass the on-disk response cache entirely.')
+@click.option('--refresh', is_flag=True, default=False,
+              help='Ignore any cached response, query the LLM and update the cache.')
+@click.option('--metrics-file', default=None, type=click.Path(dir_okay=False),
+              help='Append per-request metrics (stage timings, TTFT, throughput) as JSON lines.')
+@click.option('--prometheus-file', default=None, type=click.Path(dir_okay=False),
+              help='Write aggregated metrics in Prometheus text format (e.g. for a textfile collector).')
+@click.option('--record', 'record_dir', default=None, type=click.Path(file_okay=False),
+              help='Record every live LLM stream (chunks and timings) as a cassette in this directory.')
+@click.option('--replay', 'replay_dir', default=None, type=click.Path(exists=True, file_okay=False),
+              help='Serve LLM streams from the cassettes in this directory (no network, no local server).')
+@click.option('--replay-speed', default=1.0, show_default=True, type=click.FloatRange(min=0),
+              help='Replay pace relative to the recording (e.g. 10 for ten times faster; 0: instant).')
+def batch_command(manifest: str, output, concurrency: int, target: str, no_cache: bool, refresh: bool,
+                  metrics_file: Optional[str], prometheus_file: Optional[str],
+                  record_dir: Optional[str], replay_dir: Optional[str], replay_speed: float):
+    """
+    Runs every request in a JSONL/CSV MANIFEST concurrently and writes JSONL results.
+
+    Each manifest entry needs 'product' and 'operation'; 'mode', 'target' and 'msg' are optional.
+    """
+    import batch # Only needed for batch runs
+    metrics.recorder.configure(jsonl_path=metrics_file, prometheus_path=prometheus_file)
+    _configure_cassettes(record_dir, replay_dir, replay_speed)
+
+    try:
+        requests = batch.read_manifest(manifest, default_target=target.lower())
+    except (ValueError, OSError) as e:
+        raise click.ClickException(f"Invalid manifest '{manifest}': {e}")
+
+    click.echo(f"Info: Running {len(requests)} request(s) with concurrency {concurrency}.", err=True)
+    failures = batch.run_batch(requests, output, max_workers=concurrency,
+                               use_cache=not no_cache, refresh=refresh)
+    click.echo(f"Info: Batch finished: {len(requests) - failures} succeeded, {failures} failed.", err=True)
+    if failures:
+        sys.exit(1)
+
+@click.command()
+@click.option('--target', default='local', type=click.Choice(['local', 'openrouter'], case_sensitive=False),
+              help='Target generating the answers. Default: local.')
+@click.option('--concurrency', '-j', default=2, show_default=True, type=click.IntRange(min=1),
+              help='Maximum number of generations in flight at once.')
+@click.option('--msg', 'msgs', multiple=True,
+              help='msg variant to pre-generate (repeatable). Default: none, "OS: Linux" and "OS: Windows".')
+@click.option('--force', is_flag=True, default=False,
+              help='Regenerate artifacts that already exist.')
+@click.option('--metrics-file', default=None, type=click.Path(dir_okay=False),
+              help='Append per-request metrics (stage timings, TTFT, throughput) as JSON lines.')
+def prewarm_command(target: str, concurrency: int, msgs, force: bool, metrics_file: Optional[str]):
+    """
+    Pre-generates answers for every mapped execute prompt into the artifact store.
+
+    Matching execute requests are then answered without an LLM call. Artifacts are tied to the
+    template text and model; stale ones are pruned. Suited for off-hours runs (e.g. from cron).
+    """
+    import prewarm # Only needed for prewarm runs
+    metrics.recorder.configure(jsonl_path=metrics_file)
+    failures = prewarm.run_prewarm(target.lower(), msgs or prewarm.DEFAULT_MSG_VARIANTS,
+                                   concurrency=concurrency, force=force)
+    if failures:
+        sys.exit(1)
+
+@click.command()
+@click.option('--socket', 'socket_path', default=None, type=click.Path(dir_okay=False),
+              help=f'Unix socket to listen on. Default: {middleware_client.DEFAULT_SOCKET_PATH}')
+@click.option('--host', default='127.0.0.1', show_default=True, help='TCP host to bind (only with --port).')
+@click.option('--port', default=None, type=click.IntRange(1, 65535),
+              help='Listen on this TCP port instead of a Unix socket.')
+@click.option('--warm-local', is_flag=True, default=False,
+              help='Check/start the local llama-server and pre-warm its prompt cache before accepting requests.')
+@click.option('--prewarm', 'prewarm_artifacts', is_flag=True, default=False,
+              help='Pre-generate missing catalog artifacts on the local target while no request is in flight.')
+@click.option('--metrics-file', default=None, type=click.Path(dir_okay=False),
+              help='Append per-request metrics (stage timings, TTFT, throughput) as JSON lines.')
+@click.option('--prometheus-file', default=None, type=click.Path(dir_okay=False),
+              help='Write aggregated metrics in Prometheus text format (e.g. for a textfile collector).')
+@click.option('--record', 'record_dir', default=None, type=click.Path(file_okay=False),
+              help='Record every live LLM stream (chunks and timings) as a cassette in this directory.')
+@click.option('--replay', 'replay_dir', default=None, type=click.Path(exists=True, file_okay=False),
+              help='Serve LLM streams from the cassettes in this directory (no network, no local server).')
+@click.option('--replay-speed', default=1.0, show_default=True, type=click.FloatRange(min=0),
+              help='Replay pace relative to the recording (e.g. 10 for ten times faster; 0: instant).')
+def serve_command(socket_path: Optional[str], host: str, port: Optional[int], warm_local: bool,
+                  prewarm_artifacts: bool, metrics_file: Optional[str], prometheus_file: Optional[str],
+                  record_dir: Optional[str], replay_dir: Optional[str], replay_speed: float):
+    """
+    Runs the long-lived middleware daemon that keeps litellm and the local server manager warm.
+
+    Single requests from main.py are forwarded to it automatically while it is running
+    (set MIDDLEWARE_SOCKET or MIDDLEWARE_ADDRESS=host:port on clients for non-default locations).
+    Aggregated metrics are served at GET /metrics in Prometheus text format.
+    """
+    metrics.recorder.configure(jsonl_path=metrics_file, prometheus_path=prometheus_file)
+    _configure_cassettes(record_dir, replay_dir, replay_speed)
+    import middleware_daemon # Pulls in the whole workflow stack
+    middleware_daemon.serve(socket_path=socket_path, host=host, port=port, warm_local=warm_local,
+                            prewarm_artifacts=prewarm_artifacts)
+
+# Export the command functions for main.py
+cli = main_command
+batch_cli = batch_command
+serve_cli = serve_command
+prewarm_cli = prewarm_command
\ No newline at end of file
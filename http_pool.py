@@ -0,0 +1,194 @@
+# http_pool.py
+"""
+Persistent HTTP clients for LLM endpoints.
+One pooled keep-alive client is kept per (event loop, target, api_base) and passed
+to litellm, so repeated requests in a process reuse open connections (and TLS
+sessions) instead of reconnecting every time.
+
+Async clients are bound to the event loop that created them, so the synchronous
+wrappers run their coroutines through run_sync(), which keeps one long-lived
+loop per thread instead of creating a new loop (and new connections) per call.
+httpx and the transport (http_transport) are imported when the first client is built.
+"""
+import os
+import sys
+import atexit
+import inspect
+import asyncio
+import threading
+import contextlib
+import contextvars
+import weakref
+from typing import Optional, Dict, Any, Tuple, List, Iterator, Coroutine, TypeVar
+
+T = TypeVar('T')
+
+# Defaults can be overridden via environment variables
+DEFAULT_POOL_SIZE = int(os.environ.get("LLM_HTTP_POOL_SIZE", "16"))
+DEFAULT_KEEPALIVE_SECONDS = float(os.environ.get("LLM_HTTP_KEEPALIVE_SECONDS", "60"))
+
+# event loop -> {(target, api_base): client}; entries go away with their loop
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, Optional[str]], Any]]" = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+_thread_state = threading.local()
+# Every thread's runner (see thread_loop), closed with its clients at exit
+_runners: List[asyncio.Runner] = []
+_runners_lock = threading.Lock()
+# Response bodies opened by the request running in this context (see collect_streams)
+_opened_streams: contextvars.ContextVar[Optional[List[Any]]] = contextvars.ContextVar(
+    'http_pool_opened_streams', default=None)
+
+
+def _create_client(config: Dict[str, Any]) -> Any:
+    """Builds the client type litellm expects for the provider of config['model'] (None if unsupported)."""
+    provider = config['model'].split('/', 1)[0]
+    import httpx # Deferred (with the transport) until the first client is needed
+    from http_transport import KeepAliveTransport, TIMEOUT, limits
+    if provider == 'openai':
+        # OpenAI-compatible endpoints (llama-server) go through the OpenAI SDK client
+        import openai
+        transport = KeepAliveTransport(limits=limits(config))
+        http_client = httpx.AsyncClient(transport=transport, timeout=TIMEOUT)
+        return openai.AsyncOpenAI(api_key=config.get('api_key') or 'dummy-key', base_url=config.get('api_base'),
+                                  http_client=http_client)
+    if provider == 'openrouter':
+        # openrouter is served by litellm's own HTTP handler
+        from litellm.llms.custom_httpx.http_handler import AsyncHTTPHandler
+        transport = KeepAliveTransport(limits=limits(config))
+        return AsyncHTTPHandler(timeout=TIMEOUT, transport=transport)
+    return None
+
+
+def get_async_client(target: str, config: Dict[str, Any]) -> Any:
+    """
+    Returns the pooled client for the target's endpoint on the running event loop,
+    creating it on first use.
+
+    Args:
+        target: The target endpoint ('local' or 'openrouter').
+        config: The LLM configuration dictionary for the target.
+
+    Returns:
+        A client to pass to litellm as 'client', or None to let litellm create its own.
+    """
+    loop = asyncio.get_running_loop()
+    key = (target, config.get('api_base'))
+    with _clients_lock:
+        loop_clients = _clients.setdefault(loop, {})
+        if key not in loop_clients:
+            loop_clients[key] = _create_client(config)
+        return loop_clients[key]
+
+
+@contextlib.contextmanager
+def collect_streams() -> Iterator[List[Any]]:
+    """
+    Records the response bodies opened by pooled clients inside the block, so the
+    caller can release them with close_streams() once it is done with the response.
+    (litellm leaves some streamed responses open, which would pin pooled connections.)
+    """
+    opened: List[Any] = []
+    token = _opened_streams.set(opened)
+    try:
+        yield opened
+    finally:
+        _opened_streams.reset(token)
+
+
+def record_stream(stream: Any) -> None:
+    """Registers a response body opened by a pooled client with the enclosing collect_streams() block, if any."""
+    opened = _opened_streams.get()
+    if opened is not None:
+        opened.append(stream)
+
+
+async def close_streams(streams: List[Any]) -> None:
+    """
+    Closes response bodies recorded by collect_streams() (already closed ones are skipped).
+    A body that fails to close is reported and the rest are still closed.
+    """
+    for stream in streams:
+        try:
+            await stream.aclose()
+        except Exception as e: # e.g. the connection broke while draining; the pool discards it
+            print(f"Warning: Could not close an HTTP response stream: {type(e).__name__}: {e}", file=sys.stderr)
+
+
+async def aclose_all() -> int:
+    """
+    Closes the pooled clients of the running event loop (their keep-alive connections)
+    and forgets them; later requests on the loop create new ones.
+
+    Returns:
+        The number of clients closed.
+    """
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        loop_clients = _clients.pop(loop, {})
+    closed = 0
+    for client in loop_clients.values():
+        if client is None:
+            continue
+        close = getattr(client, 'aclose', None) or getattr(client, 'close', None)
+        try:
+            result = close() if close else None
+            if inspect.isawaitable(result):
+                await result
+            closed += 1
+        except Exception as e: # Best effort: the connections go away with the process anyway
+            print(f"Warning: Could not close pooled HTTP client {type(client).__name__}: {e}", file=sys.stderr)
+    return closed
+
+
+def thread_loop() -> asyncio.AbstractEventLoop:
+    """The long-lived event loop of the calling thread (created on first use)."""
+    runner = getattr(_thread_state, 'runner', None)
+    if runner is None:
+        runner = _thread_state.runner = asyncio.Runner()
+        with _runners_lock:
+            if not _runners:
+                atexit.register(_close_runners)
+            _runners.append(runner)
+    return runner.get_loop()
+
+
+def _close_runner(runner: asyncio.Runner) -> None:
+    """Closes a runner's pooled clients, then the runner (and its loop)."""
+    try:
+        runner.run(aclose_all())
+    finally:
+        runner.close()
+
+
+def close_thread_loop() -> None:
+    """Tears down the calling thread's loop (see thread_loop), closing its pooled clients first."""
+    runner = getattr(_thread_state, 'runner', None)
+    if runner is None:
+        return
+    _thread_state.runner = None
+    with _runners_lock:
+        if runner in _runners:
+            _runners.remove(runner)
+    _close_runner(runner)
+
+
+def _close_runners() -> None:
+    """At exit: tears down the loops of every thread (worker threads have finished by then)."""
+    with _runners_lock:
+        runners, _runners[:] = list(_runners), []
+    for runner in runners:
+        try:
+            _close_runner(runner)
+        except Exception as e:
+            print(f"Warning: Could not close an event loop at exit: {e}", file=sys.stderr)
+
+
+def run_sync(coro: Coroutine[Any, Any, T]) -> T:
+    """
+    Runs a coroutine to completion on the calling thread's long-lived event loop.
+    Like asyncio.run (including running in a copy of the current context), but
+    the loop and its pooled connections survive for the thread's next call.
+    Must not be called from inside a running event loop.
+    """
+    thread_loop()
+    return _thread_state.runner.run(coro, context=contextvars.copy_context())
@@ -0,0 +1,69 @@
+# http_transport.py
+"""
+httpx pieces of the pooled LLM clients built by http_pool.
+Kept out of http_pool so that importing it (every request path does, for run_sync)
+does not import httpx; this module is loaded when the first client is created.
+"""
+import asyncio
+from typing import Dict, Any
+
+import httpx
+
+import http_pool # Pool settings and the per-request stream registry
+
+# Generation can take minutes; only connecting is kept short
+TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+# How long/much a closed stream may still be read so its connection can return to the pool
+_DRAIN_TIMEOUT_SECONDS = 0.05
+_DRAIN_MAX_BYTES = 64 * 1024
+
+
+class DrainOnCloseStream(httpx.AsyncByteStream):
+    """
+    Response body that reads its last few bytes when closed early.
+    SSE clients stop at 'data: [DONE]' and close the response before the end of the
+    chunked body has been read, which makes httpx discard the connection. Draining the
+    (already received) remainder lets the connection go back to the keep-alive pool.
+    """
+    def __init__(self, stream: httpx.AsyncByteStream):
+        self._stream = stream
+        self._iterator = stream.__aiter__()
+        self._closed = False
+
+    async def __aiter__(self):
+        async for part in self._iterator:
+            yield part
+
+    async def _drain(self) -> None:
+        drained = 0
+        async for part in self._iterator:
+            drained += len(part)
+            if drained > _DRAIN_MAX_BYTES:
+                break
+
+    async def aclose(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await asyncio.wait_for(self._drain(), _DRAIN_TIMEOUT_SECONDS)
+        except Exception:
+            pass # Still streaming (e.g. abandoned mid-generation): the connection is dropped as usual
+        finally:
+            await self._stream.aclose()
+
+
+class KeepAliveTransport(httpx.AsyncHTTPTransport):
+    """Pooled transport whose streamed responses are drained on close (see DrainOnCloseStream)."""
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await super().handle_async_request(request)
+        response.stream = DrainOnCloseStream(response.stream)
+        http_pool.record_stream(response.stream)
+        return response
+
+
+def limits(config: Dict[str, Any]) -> httpx.Limits:
+    """Connection pool bounds for a target (config 'http_pool_size', else http_pool.DEFAULT_POOL_SIZE)."""
+    pool_size = int(config.get('http_pool_size') or http_pool.DEFAULT_POOL_SIZE)
+    return httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size,
+                        keepalive_expiry=http_pool.DEFAULT_KEEPALIVE_SECONDS)
@@ -4,21 +4,73 @@ Manages configuration for different LLM targets.
 Accepts local port info for configuration retrieval.
 """
 import os
-from typing import Optional, Dict, Any
+import sys
+from typing import Optional, Dict, Any, List
+
+# Local target server pool: LLM_LOCAL_POOL_SIZE instances on consecutive ports starting at
+# LLM_LOCAL_POOL_BASE_PORT (default: llama_man.PORT). See local_server_manager.
+LOCAL_POOL_SIZE = int(os.environ.get("LLM_LOCAL_POOL_SIZE", "1"))
+LOCAL_POOL_BASE_PORT = int(os.environ.get("LLM_LOCAL_POOL_BASE_PORT", "0")) or None
 
 # Define template structure - port filled in by get_llm_config
+# Admission control (see admission.py): max_concurrency streams open at once, requests_per_minute
+# (0: unlimited) with request_burst back-to-back starts, max_queue waiting requests for at most
+# queue_timeout_seconds; max_retries retries of rate-limited/unavailable responses (llm_interface).
 _LLM_CONFIGS_TEMPLATE: Dict[str, Dict[str, Any]] = {
     'local': {
         'model': 'openai/gemma-3-1b-it-Q4_K_M.gguf',
         'api_base': 'http://127.0.0.1:{port}/v1', # Port placeholder
         'api_key': 'dummy-key',
+        # Prompt tokens sent at most (prompt_budget trims oversized msg); the small CPU model prefills slowly
+        'prompt_token_budget': int(os.environ.get("LLM_LOCAL_PROMPT_TOKEN_BUDGET", "3072")),
+        # llama-server serves a few parallel slots per instance; more requests only queue inside it
+        'max_concurrency': int(os.environ.get("LLM_LOCAL_MAX_CONCURRENCY", "0")) or 4 * LOCAL_POOL_SIZE,
+        'requests_per_minute': float(os.environ.get("LLM_LOCAL_REQUESTS_PER_MINUTE", "0")),
+        'request_burst': 1,
+        'max_queue': int(os.environ.get("LLM_LOCAL_MAX_QUEUE", "64")),
+        'queue_timeout_seconds': float(os.environ.get("LLM_LOCAL_QUEUE_TIMEOUT_SECONDS", "120")), # CPU generation is slow
+        'max_retries': int(os.environ.get("LLM_LOCAL_MAX_RETRIES", "2")),
+        # llama.cpp: keep the slot's KV cache and only prefill the part of the prompt after the shared prefix
+        'cache_prompt': os.environ.get("LLM_LOCAL_CACHE_PROMPT", "1") != "0",
     },
     'openrouter': {
         'model': 'openrouter/google/gemini-2.5-pro-exp-03-25:free',
         'api_key': os.environ.get("OPENROUTER_API_KEY"),
+        'prompt_token_budget': int(os.environ.get("LLM_OPENROUTER_PROMPT_TOKEN_BUDGET", "16000")),
+        # Free models allow about 20 requests per minute
+        'max_concurrency': int(os.environ.get("LLM_OPENROUTER_MAX_CONCURRENCY", "4")),
+        'requests_per_minute': float(os.environ.get("LLM_OPENROUTER_REQUESTS_PER_MINUTE", "20")),
+        'request_burst': int(os.environ.get("LLM_OPENROUTER_REQUEST_BURST", "5")),
+        'max_queue': int(os.environ.get("LLM_OPENROUTER_MAX_QUEUE", "32")),
+        'queue_timeout_seconds': float(os.environ.get("LLM_OPENROUTER_QUEUE_TIMEOUT_SECONDS", "60")),
+        'max_retries': int(os.environ.get("LLM_OPENROUTER_MAX_RETRIES", "3")),
     }
 }
 
+def local_api_base(port: int) -> str:
+    """api_base of the local server listening on port."""
+    return _LLM_CONFIGS_TEMPLATE['local']['api_base'].format(port=port)
+
+def available_targets() -> List[str]:
+    """Names of all configured targets, in preference order."""
+    return list(_LLM_CONFIGS_TEMPLATE)
+
+def prompt_token_budget(target: str) -> Optional[int]:
+    """Prompt token budget of target (None if the target is unknown or has no budget)."""
+    return _LLM_CONFIGS_TEMPLATE.get(target, {}).get('prompt_token_budget') or None
+
+def model_name(target: str) -> Optional[str]:
+    """Model of target without building its full configuration (None if unknown)."""
+    return _LLM_CONFIGS_TEMPLATE.get(target, {}).get('model')
+
+def is_target_configured(target: str) -> bool:
+    """Cheap check (no messages) whether get_llm_config would succeed for target."""
+    if target not in _LLM_CONFIGS_TEMPLATE:
+        return False
+    if target == 'openrouter':
+        return bool(_LLM_CONFIGS_TEMPLATE[target].get('api_key') or os.environ.get("OPENROUTER_API_KEY"))
+    return True
+
 def get_llm_config(target: str, local_port: Optional[int] = 8012) -> Optional[Dict[str, Any]]:
     """
     Retrieves and validates configuration for the specified LLM target.
@@ -46,6 +98,6 @@ def get_llm_config(target: str, local_port: Optional[int] = 8012) -> Optional[Di
 
     if target == 'local':
         port_to_use = local_port if local_port else 8012
-        config['api_base'] = config['api_base'].format(port=port_to_use)
+        config['api_base'] = local_api_base(port_to_use)
 
     return config
\ No newline at end of file
@@ -1,54 +1,242 @@
 # llm_interface.py
 """
 Handles interaction with the LiteLLM library. Yields response chunks or raises errors.
+The streaming call is async (astream_litellm_response, built on litellm.acompletion);
+stream_litellm_response is a thin sync wrapper over it.
+litellm takes seconds to import, so it is loaded on the first send (load_litellm).
+Every call passes the target's admission controller first, and rate-limited or
+temporarily unavailable responses are retried with jittered backoff as long as
+nothing has been yielded yet. Streams can be recorded to and replayed from
+cassettes (see cassette.py).
 """
+import os
 import sys
-import litellm
-from typing import Dict, Any, Iterator
+import random
+import asyncio
+import threading
+import contextlib
+import metrics
+import http_pool # Persistent per-endpoint HTTP clients
+import admission # Per-target concurrency/rate limits
+import prompt_registry # Splits prompts into static and per-request parts
+import cassette # Stream record/replay
+from typing import Dict, Any, Iterator, AsyncIterator, List, Optional, TypeVar
+
+T = TypeVar('T')
+
+# Imported on first use (see load_litellm)
+_litellm = None
+_litellm_lock = threading.Lock()
+
+def load_litellm():
+    """Imports and configures litellm once per process; returns the module."""
+    global _litellm
+    if _litellm is None:
+        with _litellm_lock:
+            if _litellm is None:
+                import litellm
+                litellm.drop_params = True
+                _litellm = litellm
+    return _litellm
+
+async def aload_litellm():
+    """load_litellm for async callers: the first import runs off the event loop."""
+    if _litellm is not None:
+        return _litellm
+    with metrics.stage('import_litellm'):
+        return await asyncio.to_thread(load_litellm)
 
 # Custom Exceptions (keep these)
 class LLMConnectionError(Exception): pass
 class LLMAuthenticationError(Exception): pass
 class LLMAPITError(Exception): pass
 class LLMUnexpectedError(Exception): pass
+class LLMRateLimitError(LLMAPITError): pass # Still rate limited after the retries
+class LLMOverloadedError(LLMAPITError): pass # Not admitted (see admission.py)
+class LLMReplayMissError(LLMConnectionError): pass # Replay mode without a cassette for the request
+
+# Responses worth retrying before the first chunk: rate limited, overloaded or gateway trouble
+RETRYABLE_STATUS_CODES = frozenset({429, 502, 503, 504, 529})
+RETRY_BASE_DELAY_SECONDS = float(os.environ.get("LLM_RETRY_BASE_DELAY_SECONDS", "0.5"))
+RETRY_MAX_DELAY_SECONDS = float(os.environ.get("LLM_RETRY_MAX_DELAY_SECONDS", "20"))
+
+def build_messages(prompt: str) -> List[Dict[str, str]]:
+    """
+    Chat messages for a rendered prompt: its static instructions as the system message and
+    its <input_context> as the user message, so consecutive requests share a token prefix
+    the server can serve from its prompt (KV) cache.
+    """
+    instructions, context = prompt_registry.split_prompt(prompt)
+    if not instructions:
+        return [{"role": "user", "content": prompt}]
+    return [{"role": "system", "content": instructions}, {"role": "user", "content": context}]
 
 def prepare_litellm_args(prompt: str, config: Dict[str, Any], target: str) -> Dict[str, Any]:
-    # ... (implementation unchanged from previous DI example) ...
-    messages = [{"role": "user", "content": prompt}]
+    messages = build_messages(prompt)
     litellm_args = {
         'model': config['model'],
         'messages': messages,
         'api_key': config.get('api_key'),
         'stream': True,
+        'max_retries': 0, # Retried by astream_litellm_response, not by the provider SDK as well
     }
     if target != 'openrouter' and 'api_base' in config:
         litellm_args['api_base'] = config['api_base']
+    if config.get('cache_prompt'):
+        # llama-server: reuse the KV cache of the longest matching prefix in the slot
+        litellm_args['extra_body'] = {'cache_prompt': True}
     return litellm_args
 
+def iterate_sync(async_iterator: AsyncIterator[T]) -> Iterator[T]:
+    """
+    Drives an async iterator from synchronous code on the thread's long-lived event loop
+    (so pooled connections are reused across calls).
+    Items are pulled lazily, so the caller still sees them as they arrive.
+    """
+    loop = http_pool.thread_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(async_iterator.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(async_iterator.aclose())
+
 def stream_litellm_response(litellm_args: Dict[str, Any], config: Dict[str, Any], target: str) -> Iterator[str]:
     """
-    Calls litellm.completion and yields response content chunks.
-    Raises custom exceptions on failure.
-    # ... (implementation unchanged from previous DI example) ...
+    Synchronous wrapper around astream_litellm_response.
+    Yields response content chunks; raises the same custom exceptions.
+    """
+    return iterate_sync(astream_litellm_response(litellm_args, config, target))
+
+async def awarm_prompt_cache(prompt: str, config: Dict[str, Any], target: str) -> bool:
+    """
+    Has the server prefill prompt (generating a single token) so that later requests
+    sharing its static prefix are served from the server's prompt cache.
+    Returns True on success; failures are only reported (warming is best effort).
+    """
+    litellm = await aload_litellm()
+    litellm_args = dict(prepare_litellm_args(prompt, config, target), max_tokens=1)
+    try:
+        async with contextlib.aclosing(_astream_once(litellm, litellm_args, config, target)) as contents:
+            async for _ in contents:
+                pass
+        return True
+    except Exception as e:
+        print(f"Warning: Could not pre-warm the prompt cache of '{target}' ({config.get('api_base')}): "
+              f"{type(e).__name__}", file=sys.stderr)
+        return False
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Seconds from the error response's Retry-After header (None if absent or not in seconds)."""
+    # litellm keeps the provider's response headers apart from its (rebuilt) error response
+    headers = getattr(error, 'litellm_response_headers', None) or getattr(getattr(error, 'response', None), 'headers', None)
+    try:
+        value = headers.get('retry-after') if headers else None
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+def _retry_delay(attempt: int, retry_after: Optional[float]) -> float:
+    """Full-jitter exponential backoff, or the server's Retry-After plus a little jitter."""
+    if retry_after is not None:
+        return retry_after + random.uniform(0, RETRY_BASE_DELAY_SECONDS)
+    return random.uniform(0, min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * 2 ** attempt))
+
+def _is_retryable(litellm, error: Exception) -> bool:
+    return (isinstance(error, litellm.exceptions.Timeout)
+            or getattr(error, 'status_code', None) in RETRYABLE_STATUS_CODES)
+
+def _as_llm_error(litellm, error: Exception, target: str, endpoint_info: str) -> Exception:
+    """Maps a litellm exception to the custom exceptions of this module."""
+    if isinstance(error, (LLMConnectionError, LLMAuthenticationError, LLMAPITError, LLMUnexpectedError)):
+        return error
+    if isinstance(error, litellm.exceptions.APIConnectionError):
+        return LLMConnectionError(f"Cannot connect to API Base {endpoint_info}. Details: {error}")
+    if isinstance(error, litellm.exceptions.AuthenticationError):
+        return LLMAuthenticationError(f"Authentication failed for '{target}'. Check API key. Details: {error}")
+    if isinstance(error, litellm.exceptions.RateLimitError):
+        return LLMRateLimitError(f"Rate limited by '{target}'. Details: {error}")
+    if isinstance(error, litellm.exceptions.APIError):
+        return LLMAPITError(f"API Error from '{target}'. Status: {error.status_code}. Details: {error}")
+    return LLMUnexpectedError(f"Unexpected error during LiteLLM call: {type(error).__name__}: {error}")
+
+async def astream_litellm_response(litellm_args: Dict[str, Any], config: Dict[str, Any], target: str) -> AsyncIterator[str]:
+    """
+    Calls litellm.acompletion and yields response content chunks as an async iterator.
+    The request waits for admission by the target's controller (config 'max_concurrency',
+    'requests_per_minute', ...) and goes over the pooled keep-alive client for its endpoint.
+    Timeouts and retryable statuses (RETRYABLE_STATUS_CODES) are retried up to
+    config['max_retries'] times with jittered backoff, unless a chunk was already yielded.
+    Raises custom exceptions on failure (LLMOverloadedError if the request was not admitted).
+    In replay mode (cassette.deck) the recorded stream is served instead, and in record
+    mode every completed stream is saved as a cassette.
     """
     endpoint_info = litellm_args.get('api_base', 'Default LiteLLM endpoint')
+    if cassette.deck.replaying:
+        print(f"Info: Replaying the recorded stream for target '{target}' (Model: {config['model']}).")
+        try:
+            async for content in cassette.deck.areplay(litellm_args):
+                yield content
+        except cassette.CassetteMiss as e:
+            raise LLMReplayMissError(str(e)) from e
+        return
     print(f"Info: Sending prompt to target '{target}' (Model: {config['model']}, Endpoint: {endpoint_info})...")
+    litellm = await aload_litellm()
+    controller = admission.controller_for(target, config)
+    max_retries = int(config.get('max_retries') or 0)
+    attempt = 0
+    while True:
+        received = False
+        try:
+            async with controller.admit(), contextlib.aclosing(
+                    _astream_once(litellm, litellm_args, config, target)) as contents:
+                recording = cassette.deck.start(litellm_args, target) # Times the attempt from here
+                async for content in contents:
+                    received = True
+                    if recording:
+                        recording.add(content)
+                    yield content
+            if recording: # Only complete streams are recorded
+                recording.save()
+            return
+        except admission.AdmissionRejected as e:
+            raise LLMOverloadedError(str(e)) from e
+        except Exception as e:
+            retry_after = _retry_after(e)
+            if (received or attempt >= max_retries or not _is_retryable(litellm, e)
+                    or (retry_after or 0.0) > RETRY_MAX_DELAY_SECONDS):
+                raise _as_llm_error(litellm, e, target, endpoint_info) from e
+            delay = _retry_delay(attempt, retry_after)
+            if getattr(e, 'status_code', None) == 429:
+                controller.pause(delay) # Other requests to this target back off too
+            reason = f"HTTP {e.status_code}" if getattr(e, 'status_code', None) else type(e).__name__
+        attempt += 1
+        request_metrics = metrics.current()
+        if request_metrics:
+            request_metrics.retries += 1
+        print(f"Warning: '{target}' is unavailable ({reason}); retry {attempt}/{max_retries} in {delay:.1f}s.",
+              file=sys.stderr)
+        await asyncio.sleep(delay)
+
+async def _astream_once(litellm, litellm_args: Dict[str, Any], config: Dict[str, Any], target: str) -> AsyncIterator[str]:
+    """One litellm.acompletion call; litellm exceptions pass through unmapped (see astream_litellm_response)."""
+    opened_streams = []
     try:
-        litellm.drop_params = True
-        stream = litellm.completion(**litellm_args)
+        client = http_pool.get_async_client(target, config)
+        if client is not None and 'client' not in litellm_args:
+            litellm_args = dict(litellm_args, client=client)
+        with metrics.stage('llm_setup'), http_pool.collect_streams() as opened_streams: # Until the stream is open (connect + response headers)
+            stream = await litellm.acompletion(**litellm_args)
         found_content = False
-        for chunk in stream:
+        async for chunk in stream:
             if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
                 content = chunk.choices[0].delta.content
                 yield content
                 found_content = True
         if not found_content:
              print("Warning: No response content received from stream.", file=sys.stderr)
-    except litellm.exceptions.APIConnectionError as e:
-        raise LLMConnectionError(f"Cannot connect to API Base {endpoint_info}. Details: {e}") from e
-    except litellm.exceptions.AuthenticationError as e:
-        raise LLMAuthenticationError(f"Authentication failed for '{target}'. Check API key. Details: {e}") from e
-    except litellm.exceptions.APIError as e:
-         raise LLMAPITError(f"API Error from '{target}'. Status: {e.status_code}. Details: {e}") from e
-    except Exception as e:
-        raise LLMUnexpectedError(f"Unexpected error during LiteLLM call: {type(e).__name__}: {e}") from e
\ No newline at end of file
+    finally:
+        # Release the pooled connection even if litellm left the response open
+        await http_pool.close_streams(opened_streams)
@@ -2,28 +2,37 @@
 """
 Stores reusable components, basic templates, and specific prompts.
 Uses triple quotes for easier multiline/XML definition.
-Includes placeholders like {product}, {operation}, {mode}, {msg}.
+Includes placeholders like {product}, {operation}, {mode}, {msg}, {os}.
+{os} is the request's operating system: the one its msg states ("OS: Windows"), else
+MacOS (see prompt_budget.request_os). Templates written for one OS state it literally
+("Operating System: MacOS") instead and are sent as is whatever the msg says.
+
+Layout: the fixed instructions and examples come first and the request-specific
+<input_context> block comes last. Everything before <input_context> is sent as the
+system message (see prompt_registry.split_prompt), an identical prefix for every
+request, so llama-server can reuse its cached KV state instead of re-running prefill.
+Keep placeholders inside <input_context>.
 """
 
 # --- Basic Templates by Mode ---
 # Using f-string syntax for placeholders ({variable_name})
 FIX = """
-Your task is to propose a fix for an issue encountered while trying to {operation} {product}.
+Your task is to propose a fix for an issue encountered while trying to perform the operation (Operation) on the product (Product) named in the input context.
+You must place commands in bash code blocks.
 
 <input_context>
 Mode: {mode}
 Operation: {operation}
 Product: {product}
 Error/Context: {msg}
-Operating System: MacOS
+Operating System: {os}
 </input_context>
-
-You must place commands in bash code blocks.
 """
 
 CHAT = """
-Your task is to answer questions about the topic: {operation} for {product}.
+Your task is to answer questions about the topic: the operation (Operation) for the product (Product) named in the input context.
 DO NOT answer any question beyond this topic.
+You must place commands in bash code blocks if commands are relevant to the answer.
 
 <input_context>
 Mode: {mode}
@@ -31,15 +40,15 @@ Operation: {operation}
 Product: {product}
 Question/Message: {msg}
 </input_context>
-
-You must place commands in bash code blocks if commands are relevant to the answer.
 """
 
 # --- Specific Prompts (Use Uppercase Convention: OPERATION_PRODUCT) ---
 # These override the general mode templates when matched by llm_workflow.py
+# (the first word is the operation, the rest the product)
 # Using triple quotes allows formatting and potential XML easily.
 INSTALL_CURL = """
 You need to provide a command to check if curl is installed on MacOS. If it is not installed, provide the command to install curl using Homebrew.
+You must place commands in bash code blocks.
 
 <input_context>
 Mode: {mode}
@@ -48,17 +57,11 @@ Product: {product}
 Message: {msg}
 Operating System: MacOS
 </input_context>
-
-You must place commands in bash code blocks.
 """
 
 INSTALL_SPLUNK_OTEL_COLLECTOR = """
-You need to provide a command to check if Splunk OpenTelemetry Collector is installed. If it is not installed, you need provide the command to install splunk-otel-collector. Here are the input context and examples:
-<input_context>
-Operating System: MacOS
-SPLUNK_REALM: AU0
-SPLUNK_TOKEN: dummy-token
-</inpt_context>
+You need to provide a command to check if Splunk OpenTelemetry Collector is installed. If it is not installed, you need provide the command to install splunk-otel-collector. Here are examples, followed by the input context:
+You must place commands in bash code blocks.
 
 <linux-examples>
 1. Ensure you have systemd, curl and sudo installed.
@@ -106,23 +109,29 @@ If you need to activate TLS in PowerShell, use the command:
 ```
 </windows-examples>
 
-You must place commands in bash code blocks.
+<input_context>
+Operating System: {os}
+SPLUNK_REALM: AU0
+SPLUNK_TOKEN: dummy-token
+</input_context>
 """
 
 UNINSTALL_SPLUNK_OTEL_COLLECTOR = """
 Provide the commands to completely uninstall the Splunk OpenTelemetry Collector from a standard Linux system (adapt for MacOS if significantly different, e.g., launchd services). Include removing configuration and data directories.
 
+<output_format>Place commands in bash code blocks.</output_format>
+
 <input_context>
 Mode: {mode}
 Operation: {operation}
 Product: {product}
 Message: {msg}
-Operating System: MacOS
+Operating System: {os}
 </input_context>
-
-<output_format>Place commands in bash code blocks.</output_format>
 """
 
 
 # Add more specific prompts here, following the OPERATION_PRODUCT naming convention
-# e.g., CONFIGURE_SPLUNK_OTEL_COLLECTOR = """..."""
\ No newline at end of file
+# (static instructions first, placeholders only inside a final <input_context> block)
+# e.g., CONFIGURE_SPLUNK_OTEL_COLLECTOR = """..."""
+# They are discovered automatically by prompt_registry.py (no mapping entry needed).
\ No newline at end of file
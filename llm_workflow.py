@@ -2,75 +2,66 @@
 """
 Orchestrates the client workflow: prompt generation (convention over configuration),
 config retrieval, chat execution, result display.
+The workflow is async (arun_request, which returns the error with the response);
+run_request is its synchronous form, and ahandle_request and handle_request are
+thin wrappers returning just the response.
 """
 import sys
-import re # Needed for cleaning keys
-from typing import Optional
+import time
+import asyncio
+from typing import Optional, Dict, Any, List, NamedTuple, Tuple
 
 # Direct imports of dependencies
-import llm_prompt       # Import the prompt components/templates
+import prompt_registry  # Pre-compiled templates from llm_prompt
+import prompt_budget    # Drops irrelevant sections, fits msg into the target's token budget
 import llm_config       # For getting configuration
 import chatsend         # Handles the sending process
-from local_server_manager import LocalServerManager # Needed to get port for config
+import llm_interface    # Prompt cache pre-warming
+import metrics          # Per-request stage timings
+import http_pool        # Per-thread event loop for the sync wrapper
+import target_router    # Picks the target for 'auto' requests
+import semantic_cache   # Near-duplicate cache for chat/fix messages
+import artifact_store   # Pre-generated answers of the execute catalog
+from output_sinks import OutputSink, ConsoleSink # Receives prompt/stream output
+
+class RequestResult(NamedTuple):
+    """Outcome of one arun_request call."""
+    response: Optional[str] # Full response, or None on error
+    error: Optional[str] = None # Error class name if the request failed
 
-# Instantiate manager once
-_server_manager = LocalServerManager()
 
 # --- Helper Function ---
-def _clean_key_part(part: str) -> str:
-    """Cleans string for use in dictionary keys (uppercase, replace non-alphanum with _)."""
-    part = part.strip().upper()
-    part = re.sub(r'\W+', '_', part) # Replace one or more non-alphanumeric with _
-    part = re.sub(r'_+', '_', part)   # Collapse multiple underscores
-    part = part.strip('_')          # Remove leading/trailing underscores
-    return part
+# Key cleaning is memoized in the prompt registry
+_clean_key_part = prompt_registry.clean_key_part
 
 # --- Prompt Mapping Definition ---
-# Define cleaned keys for operations and products
-INSTALL = _clean_key_part("install")
-UNINSTALL = _clean_key_part("uninstall")
-UPGRADE = _clean_key_part("upgrade") # Example: Add if needed
-CONFIGURE = _clean_key_part("configure") # Example: Add if needed
-
-CURL = _clean_key_part("curl")
-SPLUNK_OTEL = _clean_key_part("splunk-otel-collector")
-# Add other products as needed:
-# SPLUNK_OTEL_CHART = _clean_key_part("splunk-otel-collector-chart")
-# DATADOG_AGENT = _clean_key_part("datadog-agent")
-# GRAFANA_AGENT = _clean_key_part("grafana-agent")
-
-# Map (OPERATION, PRODUCT) tuples to specific prompt variables for 'execute' mode
-# Only add entries here if a specific prompt exists in llm_prompt.py
-EXECUTE_PROMPT_MAP = {
-    (INSTALL, CURL): llm_prompt.INSTALL_CURL,
-    (INSTALL, SPLUNK_OTEL): llm_prompt.INSTALL_SPLUNK_OTEL_COLLECTOR,
-    (UNINSTALL, SPLUNK_OTEL): llm_prompt.UNINSTALL_SPLUNK_OTEL_COLLECTOR,
-    # Add other specific combinations here, mapping to variables in llm_prompt.py
-    # e.g., (CONFIGURE, SPLUNK_OTEL): llm_prompt.CONFIGURE_SPLUNK_OTEL_COLLECTOR,
-}
-
-def _get_prompt(product: str, operation: str, mode: str, msg: Optional[str]) -> Optional[str]: # mode is now str
+# The registry discovers every OPERATION_PRODUCT constant in llm_prompt.py at import time,
+# so adding a specific prompt there is enough. Keys are cleaned (operation, product) tuples.
+# Map (OPERATION, PRODUCT) tuples to specific prompt text for 'execute' mode
+EXECUTE_PROMPT_MAP = {key: template.text for key, template in prompt_registry.EXECUTE_TEMPLATES.items()}
+
+def _get_prompt(product: str, operation: str, mode: str, msg: Optional[str],
+                target: Optional[str] = None) -> Optional[str]: # mode is now str
     """
-    Gets the final prompt string based on mode, product, and operation using dictionary mapping.
+    Gets the final prompt string based on mode, product, and operation using the prompt registry.
     1. Handles 'fix' and 'chat' modes directly using specific templates.
-    2. For 'execute' mode, looks up (operation, product) in EXECUTE_PROMPT_MAP.
+    2. For 'execute' mode, looks up (operation, product) in the registry (aliases resolved).
     3. Falls back to CHAT template if no specific mapping found for 'execute'.
-    4. Formats the chosen template with product, operation, mode, and msg.
+    4. Drops example sections for other operating systems and, if target is given,
+       trims msg to fit the target's prompt token budget (see prompt_budget).
+    5. Renders the chosen pre-compiled template with product, operation, mode, msg and
+       the request's OS (see prompt_budget.os_label).
     """
-    prompt_template: Optional[str] = None
+    template: Optional[prompt_registry.CompiledTemplate] = None
     prompt_name: str = "N/A" # For logging purposes
     msg_content = msg if msg else "N/A"
     product_display = product.strip()
     operation_display = operation.strip()
 
     # 1. Handle explicit modes 'fix' and 'chat'
-    if mode == 'fix':
-        prompt_template = llm_prompt.FIX
-        prompt_name = "FIX template"
-        print(f"Info: Using mode '{mode}'. Selected prompt: {prompt_name}")
-    elif mode == 'chat':
-        prompt_template = llm_prompt.CHAT
-        prompt_name = "CHAT template"
+    if mode in prompt_registry.MODE_TEMPLATES:
+        template = prompt_registry.MODE_TEMPLATES[mode]
+        prompt_name = f"{template.name} template"
         print(f"Info: Using mode '{mode}'. Selected prompt: {prompt_name}")
     # 2. Handle 'execute' mode
     else: # This block now only runs if mode is 'execute' (or unexpected, though Click prevents that)
@@ -80,42 +71,100 @@ def _get_prompt(product: str, operation: str, mode: str, msg: Optional[str]) ->
              print(f"Warning: Unexpected mode '{mode}' encountered despite Click choices. Processing as 'execute'.", file=sys.stderr)
              # No need to reassign mode = 'execute', just proceed
 
-        op_key = _clean_key_part(operation)
-        prod_key = _clean_key_part(product)
-        lookup_key = (op_key, prod_key)
-
-        # Get from map, default to CHAT if not found using .get()
-        prompt_template = EXECUTE_PROMPT_MAP.get(lookup_key, llm_prompt.CHAT)
+        template = prompt_registry.lookup_execute(operation, product)
 
-        # Update prompt_name for logging based on whether the key was found
-        if lookup_key in EXECUTE_PROMPT_MAP:
+        # Default to CHAT if not found; update prompt_name for logging accordingly
+        if template is not None:
              prompt_name = f"Mapped execute prompt for {operation}/{product}"
         else:
+             template = prompt_registry.MODE_TEMPLATES['chat']
              prompt_name = "CHAT template (fallback for execute)"
         # Log the mode being handled
         print(f"Info: Mode is '{mode}'. Selected prompt: {prompt_name}")
 
 
-    # 3. Format the chosen template
-    if prompt_template:
-        try:
-            # mode is now always 'execute', 'fix', or 'chat' string
-            final_prompt = prompt_template.format(
-                product=product_display,
-                operation=operation_display,
-                mode=mode, # Pass the mode string directly
-                msg=msg_content,
-            )
-            return final_prompt
-        except KeyError as e:
-            print(f"Error: Prompt template formatting failed for '{prompt_name}'. Missing key: {e}. Template snippet: '{prompt_template[:100]}...'", file=sys.stderr)
-            return None
-        except Exception as e:
-             print(f"Error: Unexpected error formatting prompt '{prompt_name}': {e}", file=sys.stderr)
-             return None
+    # 3. Compact and render the chosen template
+    try:
+        template = prompt_budget.select_sections(template, msg)
+        values = dict(
+            product=product_display,
+            operation=operation_display,
+            mode=mode, # Pass the mode string directly ('execute', 'fix' or 'chat')
+            msg=msg_content,
+            os=prompt_budget.os_label(template, msg),
+        )
+        budget = prompt_budget.budget_for(target)
+        model = prompt_budget.model_for(target)
+        values['msg'] = prompt_budget.fit_msg(template, values, budget, model)
+        prompt = template.render(**values)
+        _report_prompt_tokens(prompt, budget, model, trimmed=values['msg'] != msg_content)
+        return prompt
+    except KeyError as e:
+        print(f"Error: Prompt template formatting failed for '{prompt_name}'. Missing key: {e}. Template snippet: '{template.text[:100]}...'", file=sys.stderr)
+        return None
+    except Exception as e:
+         print(f"Error: Unexpected error formatting prompt '{prompt_name}': {e}", file=sys.stderr)
+         return None
+
+
+def _report_prompt_tokens(prompt: str, budget: Optional[int], model: Optional[str], trimmed: bool) -> None:
+    """Logs the prompt size (and records it in the request metrics)."""
+    tokens, exact = prompt_budget.count_tokens(prompt, model)
+    request_metrics = metrics.current()
+    if request_metrics:
+        request_metrics.prompt_tokens = tokens
+    size = f"{tokens}" if exact else f"~{tokens}"
+    if trimmed:
+        print(f"Info: Message trimmed to fit the prompt budget; prompt is {size} tokens (budget {budget}).")
+    elif budget is not None and tokens > budget:
+        print(f"Warning: Prompt is {size} tokens, over the budget of {budget}.", file=sys.stderr)
     else:
-        print(f"Error: Could not determine prompt template for {product}/{operation}/{mode}", file=sys.stderr)
+        print(f"Info: Prompt is {size} tokens.")
+
+
+def _find_artifact(template: prompt_registry.CompiledTemplate, msg: Optional[str],
+                   target: str) -> Optional[Tuple[str, str, artifact_store.Artifact]]:
+    """(target, model, artifact) of the first candidate target with a stored artifact (SQLite; run in a worker thread)."""
+    store = artifact_store.get_artifact_store()
+    if not store.exists():
         return None
+    candidates = target_router.router.rank() if target == target_router.AUTO_TARGET else [target]
+    for candidate in candidates:
+        model = llm_config.model_name(candidate)
+        artifact = store.get(template, msg, model) if model else None
+        if artifact is not None:
+            return candidate, model, artifact
+    return None
+
+
+async def _areplay_artifact(product: str, operation: str, msg: Optional[str], target: str,
+                            prompt: str, sink: Optional[OutputSink]) -> Optional[str]:
+    """Replays the stored artifact for a mapped execute request, if prewarm generated one."""
+    template = prompt_registry.lookup_execute(operation, product)
+    if template is None:
+        return None
+    with metrics.stage('artifact_lookup'):
+        found = await asyncio.to_thread(_find_artifact, template, msg, target)
+    if found is None:
+        return None
+    candidate, model, artifact = found
+    print(f"Info: Answered from the pre-generated artifact for {template.name} (target '{candidate}', Model: {model}).")
+    request_metrics = metrics.current()
+    if request_metrics:
+        request_metrics.cache_hit = True
+        request_metrics.artifact_hit = True
+        if target == target_router.AUTO_TARGET:
+            request_metrics.routed_target = candidate
+    return await chatsend.areplay_chunks(prompt, artifact.chunks, sink)
+
+
+def _config_for(target: str) -> Optional[Dict[str, Any]]:
+    """LLM configuration of a target (the local port comes from the server manager)."""
+    local_port = None
+    if target == 'local':
+        from local_server_manager import get_server_manager # Deferred: imports llama_man on first use
+        local_port = get_server_manager().get_port()
+    return llm_config.get_llm_config(target, local_port)
 
 
 # --- Main Workflow Logic ---
@@ -124,34 +173,196 @@ def handle_request(
     operation: str,
     target: str,
     mode: str,
-    msg: Optional[str] # Changed parameter name to msg
+    msg: Optional[str], # Changed parameter name to msg
+    use_cache: bool = True,
+    refresh: bool = False,
+    sink: Optional[OutputSink] = None,
+    hedge: bool = False
+) -> Optional[str]:
+    """Like run_request, but returns only the response (None on error)."""
+    return run_request(product, operation, target, mode, msg,
+                       use_cache=use_cache, refresh=refresh, sink=sink, hedge=hedge).response
+
+
+def run_request(
+    product: str,
+    operation: str,
+    target: str,
+    mode: str,
+    msg: Optional[str],
+    use_cache: bool = True,
+    refresh: bool = False,
+    sink: Optional[OutputSink] = None,
+    hedge: bool = False
+) -> RequestResult:
+    """
+    Synchronous wrapper around arun_request (see there for details).
+    Runs on the thread's long-lived event loop so pooled connections are reused across calls.
+    Must not be called from inside a running event loop; await arun_request instead.
+    """
+    return http_pool.run_sync(arun_request(product, operation, target, mode, msg,
+                                           use_cache=use_cache, refresh=refresh, sink=sink, hedge=hedge))
+
+
+async def ahandle_request(
+    product: str,
+    operation: str,
+    target: str,
+    mode: str,
+    msg: Optional[str],
+    use_cache: bool = True,
+    refresh: bool = False,
+    sink: Optional[OutputSink] = None,
+    hedge: bool = False
 ) -> Optional[str]:
+    """Like arun_request, but returns only the response (None on error)."""
+    result = await arun_request(product, operation, target, mode, msg,
+                                use_cache=use_cache, refresh=refresh, sink=sink, hedge=hedge)
+    return result.response
+
+
+async def arun_request(
+    product: str,
+    operation: str,
+    target: str,
+    mode: str,
+    msg: Optional[str],
+    use_cache: bool = True,
+    refresh: bool = False,
+    sink: Optional[OutputSink] = None,
+    hedge: bool = False
+) -> RequestResult:
     """
     Handles the user request: gets prompt, gets config, sends chat, formats result.
+    use_cache/refresh control the on-disk response cache and sink receives the prompt
+    and stream output (see chatsend.asend), then done() or error().
+    target 'auto' lets target_router pick (and fail over between) the configured targets;
+    hedge additionally races a second target when the first is slow to start streaming.
+    Stage timings are recorded through the metrics module.
+
+    Returns:
+        RequestResult: the full response (None on error) and the error class name.
     """
+    with metrics.track_request(product, operation, mode, target) as request_metrics:
+        result = await _ahandle_request(product, operation, target, mode, msg,
+                                        use_cache=use_cache, refresh=refresh, sink=sink, hedge=hedge)
+        if result.response is None:
+            request_metrics.error = result.error
+    if sink is not None:
+        if result.response is None:
+            sink.error(result.error or "RequestFailed")
+        else:
+            sink.done(result.response)
+    return result
+
+
+async def _ahandle_request(
+    product: str,
+    operation: str,
+    target: str,
+    mode: str,
+    msg: Optional[str],
+    use_cache: bool,
+    refresh: bool,
+    sink: Optional[OutputSink],
+    hedge: bool = False
+) -> RequestResult:
+    """Runs the request stages for arun_request."""
     # Use 'msg is not None' for logging clarity
     print(f"Info: Received request for product='{product}', operation='{operation}', target='{target}', mode='{mode}', msg='{msg is not None}'")
 
     # 1. Get Prompt (using revised logic above, passing msg)
-    selected_prompt = _get_prompt(product, operation, mode, msg) # Pass msg
+    with metrics.stage('prompt'):
+        selected_prompt = _get_prompt(product, operation, mode, msg, target) # Pass msg
     if selected_prompt is None:
-        return None
+        return RequestResult(None, "PromptError")
+
+    # Pre-generated answers of the execute catalog (see prewarm.py) need no LLM call at all
+    if use_cache and not refresh and mode == 'execute':
+        full_response = await _areplay_artifact(product, operation, msg, target, selected_prompt, sink)
+        if full_response is not None:
+            return RequestResult(full_response)
 
     # Prompt printing is now done in chatsend.py
+    # Normalizing and shingling a long message is CPU work; it runs off the event loop
+    similar = await asyncio.to_thread(semantic_cache.make_query, product, operation, mode, msg) if use_cache and msg else None
+
+    # 'auto': the router resolves each target's configuration itself
+    if target == target_router.AUTO_TARGET:
+        full_response, served_by, error = await target_router.router.aroute(
+            selected_prompt, _config_for, sink or ConsoleSink(), use_cache=use_cache, refresh=refresh, hedge=hedge,
+            similar=similar)
+        request_metrics = metrics.current()
+        if request_metrics:
+            request_metrics.routed_target = served_by
+        if full_response is None:
+            print("Error: Failed to get response from chat.", file=sys.stderr)
+            return RequestResult(None, error or "ChatError")
+        return RequestResult(full_response)
 
     # 2. Get Configuration
-    local_port = _server_manager.get_port()
-    config = llm_config.get_llm_config(target, local_port)
+    with metrics.stage('config'):
+        config = _config_for(target)
     if not config:
-        return None
+        return RequestResult(None, "ConfigError")
 
     # 3. Send Chat Request and get full response
     # Changed variable name from code_blocks to full_response
-    full_response = chatsend.send_and_process(selected_prompt, target, config)
+    result = await chatsend.asend(selected_prompt, target, config, use_cache=use_cache, refresh=refresh,
+                                  sink=sink, similar=similar)
+    full_response = result.response
     if full_response is None:
         # Error message already printed in chatsend
         print("Error: Failed to get response from chat.", file=sys.stderr)
-        return None # Propagate error
+        return RequestResult(None, result.error or "ChatError") # Propagate error
 
     # 4. Return Full Response (UI formatting removed)
-    return full_response # <<< Return the raw response string
\ No newline at end of file
+    return RequestResult(full_response) # <<< Return the raw response string
+
+# --- Prompt Cache Pre-warming ---
+def _warm_prompts() -> List[str]:
+    """One rendered prompt per distinct static prefix of the known templates (placeholders as 'N/A')."""
+    prompts: Dict[str, str] = {}
+    templates = [*prompt_registry.MODE_TEMPLATES.values(), *prompt_registry.EXECUTE_TEMPLATES.values()]
+    for template in templates:
+        template = prompt_budget.select_sections(template, None) # As sent when the msg states no OS
+        prompt = template.render(**{field: "N/A" for field in template.fields})
+        prefix, _ = prompt_registry.split_prompt(prompt)
+        if prefix:
+            prompts.setdefault(prefix, prompt)
+    return list(prompts.values())
+
+
+def prewarm_prompt_cache(target: str = 'local') -> int:
+    """Synchronous wrapper around aprewarm_prompt_cache."""
+    return http_pool.run_sync(aprewarm_prompt_cache(target))
+
+
+async def aprewarm_prompt_cache(target: str = 'local') -> int:
+    """
+    Prefills the static prefix of every known template on the target's server(s), so the
+    first real request for a template only prefills its <input_context>. Only targets with
+    'cache_prompt' enabled (llama-server) are warmed; every healthy local instance is.
+    The server must already be running. Best effort: failures are reported, not raised.
+
+    Returns:
+        The number of template prefixes warmed on all instances.
+    """
+    config = _config_for(target)
+    if not config or not config.get('cache_prompt'):
+        return 0
+    configs = [config]
+    if target == 'local':
+        from local_server_manager import get_server_manager
+        configs = [dict(config, api_base=llm_config.local_api_base(instance.port))
+                   for instance in get_server_manager().instances if not instance.down] or [config]
+    started = time.perf_counter()
+    prompts = _warm_prompts()
+    warmed = 0
+    for prompt in prompts: # One prefix at a time per server, like requests would arrive
+        results = await asyncio.gather(*(llm_interface.awarm_prompt_cache(prompt, instance_config, target)
+                                         for instance_config in configs))
+        warmed += all(results)
+    print(f"Info: Pre-warmed {warmed}/{len(prompts)} template prefix(es) on '{target}' "
+          f"({len(configs)} instance(s)) in {time.perf_counter() - started:.1f}s.")
+    return warmed
@@ -1,17 +1,73 @@
 # local_server_manager.py
 """
 Abstracts the interaction with the llama_man module for managing the local server.
+A verified-healthy state is cached for a short TTL; when it expires a cheap probe
+(PID liveness plus an HTTP health check) is tried before the full llama_man
+status/start path, and concurrent callers share a single in-flight startup.
+
+The local target can be served by a pool of instances on consecutive ports
+(llm_config.LOCAL_POOL_SIZE). Requests lease the healthy instance with the fewest
+outstanding requests; instances that fail are taken out of rotation and
+re-checked (and restarted through llama_man) on the next ensure_running().
 """
 import sys
 import os
-from typing import Optional
+import time
+import inspect
+import threading
+import urllib.error
+import urllib.request
+from typing import Optional, List
+
+import llm_config # Local pool settings
 
 _SERVER_MODULE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'helloworld-llama-server'))
+_PID_FILE_NAME = '.llama_server.pid'
+
+# How long a successful check is trusted before probing again
+HEALTH_TTL_SECONDS = float(os.environ.get("LLM_LOCAL_HEALTH_TTL_SECONDS", "10"))
+# Timeout of the HTTP health probe (a healthy local server answers in milliseconds)
+PROBE_TIMEOUT_SECONDS = 0.5
+# llama-server answers /health (503 while the model loads); other OpenAI-compatible servers /v1/models
+_PROBE_PATHS = ('/health', '/v1/models')
+
+
+class ServerInstance:
+    """One llama-server process of the local pool, with its dispatch and health state."""
+    __slots__ = ('port', 'primary', 'outstanding', 'checked_until', 'down', 'lock')
+
+    def __init__(self, port: int, primary: bool):
+        self.port = port
+        self.primary = primary # On llama_man.PORT: managed by llama_man's default (port-less) calls and PID file
+        self.outstanding = 0
+        self.checked_until = 0.0 # time.monotonic() until which the last check result is trusted
+        self.down = False # Out of rotation until a check succeeds again
+        self.lock = threading.Lock() # Serializes probing/starting this instance
+
+    def is_checked(self) -> bool:
+        """True while the last check (healthy or down) is recent enough to reuse."""
+        return time.monotonic() < self.checked_until
+
 
 class LocalServerManager:
-    """Manages the lifecycle and status checks for the local LLM server."""
-    def __init__(self):
+    """Manages the lifecycle and status checks for the local LLM server(s)."""
+    def __init__(self, pool_size: Optional[int] = None):
         self._llama_man = self._import_llama_man()
+        self._dispatch_lock = threading.Lock()
+        self._instances: List[ServerInstance] = []
+        self._config_error: Optional[str] = None # Set when llama_man cannot manage the configured pool
+        base_port = self._default_port()
+        if base_port is not None:
+            size = max(1, pool_size if pool_size is not None else llm_config.LOCAL_POOL_SIZE)
+            default_port = getattr(self._llama_man, 'PORT', None)
+            self._instances = [ServerInstance(base_port + i, primary=(base_port + i == default_port))
+                               for i in range(size)]
+            unmanaged = [instance.port for instance in self._instances if not instance.primary]
+            if self._llama_man and unmanaged and not self._supports_port_argument():
+                self._config_error = (
+                    f"llama_man.ensure_server_running_or_fail() does not accept a port, so it cannot manage "
+                    f"local server port(s) {', '.join(map(str, unmanaged))} (LLM_LOCAL_POOL_SIZE={size}, "
+                    f"LLM_LOCAL_POOL_BASE_PORT={base_port}, llama_man.PORT={default_port}).")
 
     def _import_llama_man(self):
         # ... (implementation unchanged from previous DI example) ...
@@ -26,14 +82,154 @@ class LocalServerManager:
             print(f"  Ensure '{_SERVER_MODULE_PATH}' exists and is correct relative to the client.", file=sys.stderr)
             return None
 
+    def _default_port(self) -> Optional[int]:
+        if llm_config.LOCAL_POOL_BASE_PORT:
+            return llm_config.LOCAL_POOL_BASE_PORT
+        if self._llama_man:
+            return getattr(self._llama_man, 'PORT', None)
+        return None
+
+    def _supports_port_argument(self) -> bool:
+        if not self._llama_man:
+            return False
+        try:
+            return 'port' in inspect.signature(self._llama_man.ensure_server_running_or_fail).parameters
+        except (TypeError, ValueError):
+            return False
+
+    @property
+    def instances(self) -> List[ServerInstance]:
+        return list(self._instances)
 
     def ensure_running(self) -> bool:
-        # ... (implementation unchanged from previous DI example) ...
+        """
+        Makes sure the local server pool is up, as cheaply as possible.
+        Per instance: cached healthy state, fast probe, then the full llama_man check (which may start it).
+        Only one caller at a time probes or starts an instance; the others wait and reuse its result.
+
+        Returns:
+            True if at least one instance is healthy.
+        """
+        if self._instances and all(instance.is_checked() for instance in self._instances):
+            return any(not instance.down for instance in self._instances)
         if not self._llama_man:
             print("Error: Cannot check local server status because 'llama_man' module is not available.", file=sys.stderr)
             return False
-        print("Target is 'local', checking server status...")
-        status_code, message = self._llama_man.ensure_server_running_or_fail()
+        if not self._instances:
+            print("Error: No local server port configured (llama_man.PORT or LLM_LOCAL_POOL_BASE_PORT).", file=sys.stderr)
+            return False
+        if self._config_error:
+            print(f"Error: {self._config_error}", file=sys.stderr)
+            return False
+        healthy = 0
+        for instance in self._instances:
+            if self._ensure_instance(instance):
+                healthy += 1
+        return healthy > 0
+
+    def _ensure_instance(self, instance: ServerInstance) -> bool:
+        if instance.is_checked():
+            return not instance.down
+        with instance.lock:
+            if instance.is_checked(): # Another caller verified or started it while we waited
+                return not instance.down
+            if self.probe(instance.port, check_pid=instance.primary):
+                if instance.down:
+                    print(f"Info: Local server on port {instance.port} is healthy again.")
+                self._mark_healthy(instance)
+                return True
+            # Extra instances must also answer the probe: llama_man only tracks the primary one closely
+            if self._full_check(instance) and (instance.primary or self.probe(instance.port, check_pid=False)):
+                self._mark_healthy(instance)
+                return True
+            # Dead instances are retried (and restarted) once the TTL expires, not on every request
+            print(f"Warning: Local server instance on port {instance.port} is down; retrying in {HEALTH_TTL_SECONDS:g}s.", file=sys.stderr)
+            instance.down = True
+            instance.checked_until = time.monotonic() + HEALTH_TTL_SECONDS
+            return False
+
+    def _mark_healthy(self, instance: ServerInstance) -> None:
+        instance.down = False
+        instance.checked_until = time.monotonic() + HEALTH_TTL_SECONDS
+
+    def invalidate(self, port: Optional[int] = None) -> None:
+        """
+        Forgets the cached healthy state of one instance (or all) and takes it out of
+        rotation, e.g. after a connection error; the next ensure_running() re-checks it.
+        """
+        for instance in self._instances:
+            if port is None or instance.port == port:
+                instance.checked_until = 0.0
+                instance.down = True
+
+    def acquire(self) -> Optional[int]:
+        """
+        Leases the healthy instance with the fewest outstanding requests.
+        Every successful acquire() must be paired with release().
+
+        Returns:
+            The port of the leased instance, or None if no instance is in rotation.
+        """
+        with self._dispatch_lock:
+            candidates = [instance for instance in self._instances if not instance.down]
+            if not candidates:
+                return None
+            chosen = min(candidates, key=lambda instance: instance.outstanding)
+            chosen.outstanding += 1
+            return chosen.port
+
+    def release(self, port: int, failed: bool = False) -> None:
+        """Ends a lease; failed=True takes the instance out of rotation until it is re-checked."""
+        with self._dispatch_lock:
+            for instance in self._instances:
+                if instance.port == port:
+                    instance.outstanding = max(0, instance.outstanding - 1)
+        if failed:
+            self.invalidate(port)
+
+    def probe(self, port: Optional[int] = None, check_pid: bool = True) -> bool:
+        """
+        Cheap liveness check: the recorded server PID (if any) must be alive and
+        the server must answer an HTTP health request on the port (default get_port()).
+        """
+        if check_pid:
+            pid = self._read_pid()
+            if pid is not None and not _pid_alive(pid):
+                return False
+        port = port or self.get_port()
+        if port is None:
+            return False
+        for path in _PROBE_PATHS:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=PROBE_TIMEOUT_SECONDS) as response:
+                    return response.status == 200
+            except urllib.error.HTTPError as e:
+                if e.code != 404: # e.g. 503 while llama-server is still loading the model
+                    return False
+            except (OSError, ValueError):
+                return False
+        return False
+
+    def _read_pid(self) -> Optional[int]:
+        """Reads the PID llama_man recorded for the server, if a PID file exists."""
+        # Never relative to the working directory: a stray PID file there would fail every probe
+        candidates = [getattr(self._llama_man, 'PID_FILE', None),
+                      os.path.join(_SERVER_MODULE_PATH, _PID_FILE_NAME)]
+        for path in candidates:
+            if path and os.path.isfile(path):
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        return int(f.read().strip())
+                except (OSError, ValueError):
+                    return None
+        return None
+
+    def _full_check(self, instance: ServerInstance) -> bool:
+        print(f"Target is 'local', checking server status (port {instance.port})...")
+        if instance.primary: # llama_man's own port
+            status_code, message = self._llama_man.ensure_server_running_or_fail()
+        else:
+            status_code, message = self._llama_man.ensure_server_running_or_fail(port=instance.port)
         if status_code == "RUNNING":
             print(f"Server check: {message}")
             print("Server confirmed running or auto-started.")
@@ -46,7 +242,31 @@ class LocalServerManager:
             return False
 
     def get_port(self) -> Optional[int]:
-        # ... (implementation unchanged from previous DI example) ...
-        if self._llama_man:
-            return getattr(self._llama_man, 'PORT', None)
-        return None
\ No newline at end of file
+        """Port of the first instance (used for the stable local api_base / cache key)."""
+        if self._instances:
+            return self._instances[0].port
+        return None
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0) # Signal 0 only checks that the process exists
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True # Exists but belongs to another user
+    except OSError:
+        return False
+    return True
+
+# Process-wide manager shared by every module (created on first use)
+_manager_instance: Optional[LocalServerManager] = None
+_manager_lock = threading.Lock()
+
+def get_server_manager() -> LocalServerManager:
+    """Gets or creates the singleton server manager instance."""
+    global _manager_instance
+    if _manager_instance is None:
+        with _manager_lock:
+            if _manager_instance is None:
+                _manager_instance = LocalServerManager()
+    return _manager_instance
@@ -1,10 +1,25 @@
 # main.py
 """
 Main entry point for the CLI application.
+`main.py batch MANIFEST ...` runs a manifest of requests, `main.py serve` starts the
+middleware daemon, `main.py prewarm` pre-generates the execute catalog; anything else
+is a single request.
 """
-# Import the exported command function from clitest_middleware.py (changed from cli_client)
-from clitest_middleware import cli
+import sys
+
+# Import the exported command functions from clitest_middleware.py (changed from cli_client)
+from clitest_middleware import cli, batch_cli, serve_cli, prewarm_cli
+
+# Subcommands selected by the first CLI argument
+_SUBCOMMANDS = {
+    'batch': batch_cli,
+    'serve': serve_cli,
+    'prewarm': prewarm_cli,
+}
 
 if __name__ == '__main__':
     # Execute the Click command function
-    cli()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] in _SUBCOMMANDS:
+        _SUBCOMMANDS[sys.argv[1]](args=sys.argv[2:], prog_name=f"main.py {sys.argv[1]}")
+    else:
+        cli()
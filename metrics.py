@@ -0,0 +1,410 @@
+# metrics.py
+"""
+Hot-path instrumentation for workflow requests.
+Each request gets a RequestMetrics record (carried in a context variable, so it
+follows the request through awaits and asyncio.to_thread) with per-stage
+durations, time-to-first-token, chunk counts, throughput and error class.
+Finished records are aggregated for Prometheus text exposition and can be
+appended to a JSON-lines file; both files are written by a background thread
+every LLM_METRICS_EXPORT_INTERVAL_SECONDS, off the request path. A span listener
+(set by profiling.py) additionally receives every stage and span with its start
+and end time.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import threading
+import contextlib
+import contextvars
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, List, Iterator, Tuple, Callable
+
+# Histogram buckets (seconds) shared by stage and time-to-first-token histograms
+_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# How often the export files are written (overridable via environment variable; 0 writes on every request)
+EXPORT_INTERVAL_SECONDS = float(os.environ.get("LLM_METRICS_EXPORT_INTERVAL_SECONDS", "1.0"))
+
+
+class RequestMetrics:
+    """Timings and counters for a single handle_request call."""
+    def __init__(self, product: str, operation: str, mode: str, target: str):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.product = product
+        self.operation = operation
+        self.mode = mode
+        self.target = target
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.cache_hit = False
+        self.semantic_hit = False # Cache hit through a near-duplicate chat/fix message
+        self.artifact_hit = False # Answered from a pre-generated artifact (see prewarm.py)
+        self.coalesced = False # Joined an identical in-flight request
+        self.retries = 0 # Retries after rate-limited/unavailable responses (llm_interface)
+        self.routed_target: Optional[str] = None # Target that served an 'auto' request
+        self.prompt_tokens: Optional[int] = None # Estimated unless litellm's tokenizer was loaded
+        self.chunks = 0
+        self.chars = 0
+        self.time_to_first_token: Optional[float] = None
+        self._first_chunk: Optional[float] = None
+        self._last_chunk: Optional[float] = None
+        self.total: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        """Adds time to a stage (stages entered repeatedly accumulate)."""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def record_chunk(self, text: str) -> None:
+        now = time.perf_counter()
+        if self._first_chunk is None:
+            self._first_chunk = now
+            self.time_to_first_token = now - self._start
+        self._last_chunk = now
+        self.chunks += 1
+        self.chars += len(text)
+
+    @property
+    def stream_seconds(self) -> float:
+        """Time between the first and the last streamed chunk."""
+        if self._first_chunk is None:
+            return 0.0
+        return self._last_chunk - self._first_chunk
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        # Streamed chunks are used as the token count (one token per delta for llama.cpp/OpenAI streams)
+        if self.chunks < 2 or self.stream_seconds <= 0:
+            return None
+        return (self.chunks - 1) / self.stream_seconds
+
+    def fork(self) -> 'RequestMetrics':
+        """
+        A fresh record for one attempt of this request (e.g. a hedged target): same request
+        id and start time, no stages or chunks yet. Only the winner is merged back.
+        """
+        attempt = RequestMetrics(self.product, self.operation, self.mode, self.target)
+        attempt.request_id = self.request_id
+        attempt.started_at = self.started_at
+        attempt._start = self._start
+        return attempt
+
+    def merge(self, attempt: 'RequestMetrics') -> None:
+        """Adds the stages, chunks, flags and retries of a forked attempt to this record."""
+        for name, seconds in attempt.stages.items():
+            self.add_stage(name, seconds)
+        self.cache_hit = self.cache_hit or attempt.cache_hit
+        self.semantic_hit = self.semantic_hit or attempt.semantic_hit
+        self.artifact_hit = self.artifact_hit or attempt.artifact_hit
+        self.coalesced = self.coalesced or attempt.coalesced
+        self.retries += attempt.retries
+        if self.prompt_tokens is None:
+            self.prompt_tokens = attempt.prompt_tokens
+        if attempt._first_chunk is not None:
+            if self._first_chunk is None or attempt._first_chunk < self._first_chunk:
+                self._first_chunk = attempt._first_chunk
+                self.time_to_first_token = self._first_chunk - self._start
+            self._last_chunk = max(self._last_chunk or attempt._last_chunk, attempt._last_chunk)
+        self.chunks += attempt.chunks
+        self.chars += attempt.chars
+
+    def finish(self, error: Optional[str] = None) -> None:
+        self.total = time.perf_counter() - self._start
+        self.error = error
+        if self._first_chunk is not None:
+            self.stages['stream'] = self.stream_seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        tps = self.tokens_per_second
+        return {
+            'request_id': self.request_id,
+            'timestamp': self.started_at,
+            'product': self.product,
+            'operation': self.operation,
+            'mode': self.mode,
+            'target': self.target,
+            'ok': self.error is None,
+            'error': self.error,
+            'cache_hit': self.cache_hit,
+            'semantic_hit': self.semantic_hit,
+            'artifact_hit': self.artifact_hit,
+            'coalesced': self.coalesced,
+            'retries': self.retries,
+            'routed_target': self.routed_target,
+            'total_seconds': _round(self.total),
+            'time_to_first_token_seconds': _round(self.time_to_first_token),
+            'stages_seconds': {name: _round(value) for name, value in self.stages.items()},
+            'prompt_tokens': self.prompt_tokens,
+            'chunks': self.chunks,
+            'chars': self.chars,
+            'tokens_per_second': _round(tps, 2),
+        }
+
+
+def _round(value: Optional[float], digits: int = 6) -> Optional[float]:
+    return None if value is None else round(value, digits)
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * len(_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRecorder:
+    """
+    Aggregates finished requests and exports them as JSON lines and Prometheus text.
+    record() only updates the aggregates and queues the JSON line; the files are
+    written by a background thread at most every export_interval seconds (and once
+    more at exit), outside the aggregation lock, so request paths never wait on disk.
+    """
+    def __init__(self, export_interval: float = EXPORT_INTERVAL_SECONDS):
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock() # Serializes file writes
+        self.export_interval = export_interval
+        self._pending_lines: List[str] = []
+        self._prometheus_dirty = False
+        self._exporter: Optional[threading.Thread] = None
+        self.jsonl_path: Optional[str] = os.environ.get("LLM_METRICS_JSONL")
+        self.prometheus_path: Optional[str] = os.environ.get("LLM_METRICS_PROM")
+        self._requests: Dict[Tuple[str, str], int] = {}
+        self._errors: Dict[Tuple[str, str], int] = {}
+        self._stages: Dict[Tuple[str, str], _Histogram] = {}
+        self._ttft: Dict[str, _Histogram] = {}
+        self._chunks: Dict[str, int] = {}
+        self._stream_seconds: Dict[str, float] = {}
+        self._cache_hits: Dict[str, int] = {}
+        self._semantic_hits: Dict[str, int] = {}
+        self._artifact_hits: Dict[str, int] = {}
+        self._coalesced: Dict[str, int] = {}
+        self._retries: Dict[str, int] = {}
+
+    def configure(self, jsonl_path: Optional[str] = None, prometheus_path: Optional[str] = None) -> None:
+        """Sets the export files (None keeps the current setting)."""
+        if jsonl_path is not None:
+            self.jsonl_path = jsonl_path
+        if prometheus_path is not None:
+            self.prometheus_path = prometheus_path
+
+    def record(self, request: RequestMetrics) -> None:
+        target = request.target
+        line = json.dumps(request.to_dict()) if self.jsonl_path else None
+        with self._lock:
+            outcome = 'ok' if request.error is None else 'error'
+            self._requests[(target, outcome)] = self._requests.get((target, outcome), 0) + 1
+            if request.error is not None:
+                self._errors[(target, request.error)] = self._errors.get((target, request.error), 0) + 1
+            for stage, seconds in request.stages.items():
+                self._stages.setdefault((target, stage), _Histogram()).observe(seconds)
+            if request.time_to_first_token is not None:
+                self._ttft.setdefault(target, _Histogram()).observe(request.time_to_first_token)
+            self._chunks[target] = self._chunks.get(target, 0) + request.chunks
+            self._stream_seconds[target] = self._stream_seconds.get(target, 0.0) + request.stream_seconds
+            if request.cache_hit:
+                self._cache_hits[target] = self._cache_hits.get(target, 0) + 1
+            if request.semantic_hit:
+                self._semantic_hits[target] = self._semantic_hits.get(target, 0) + 1
+            if request.artifact_hit:
+                self._artifact_hits[target] = self._artifact_hits.get(target, 0) + 1
+            if request.coalesced:
+                self._coalesced[target] = self._coalesced.get(target, 0) + 1
+            if request.retries:
+                self._retries[target] = self._retries.get(target, 0) + request.retries
+            if line is not None:
+                self._pending_lines.append(line)
+            if self.prometheus_path:
+                self._prometheus_dirty = True
+            exporting = line is not None or self._prometheus_dirty
+            start_exporter = exporting and self.export_interval > 0 and self._exporter is None
+            if start_exporter:
+                self._exporter = threading.Thread(target=self._export_loop, name='metrics-export', daemon=True)
+        if exporting and self.export_interval <= 0:
+            self.flush()
+        elif start_exporter:
+            atexit.register(self.flush) # The last interval's records
+            self._exporter.start()
+
+    def _export_loop(self) -> None:
+        while True:
+            time.sleep(self.export_interval)
+            self.flush()
+
+    def flush(self) -> None:
+        """Appends the queued JSON lines and rewrites the Prometheus file if anything changed."""
+        with self._export_lock:
+            with self._lock:
+                lines, self._pending_lines = self._pending_lines, []
+                jsonl_path = self.jsonl_path
+                prometheus_path = self.prometheus_path if self._prometheus_dirty else None
+                text = self._render_locked() if prometheus_path else None
+                self._prometheus_dirty = False
+            try:
+                if jsonl_path and lines:
+                    with open(jsonl_path, 'a', encoding='utf-8') as f:
+                        f.write("\n".join(lines) + "\n")
+                if prometheus_path:
+                    # Write-then-rename so textfile collectors never read a partial file
+                    tmp_path = f"{prometheus_path}.tmp"
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        f.write(text)
+                    os.replace(tmp_path, prometheus_path)
+            except OSError as e:
+                print(f"Warning: Could not export request metrics: {e}", file=sys.stderr)
+
+    def render_prometheus(self) -> str:
+        """Returns all aggregated metrics in the Prometheus text exposition format."""
+        with self._lock:
+            return self._render_locked()
+
+    def _render_locked(self) -> str:
+        lines: List[str] = []
+
+        def header(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histogram(name: str, labels: str, hist: _Histogram) -> None:
+            for bound, count in zip(_BUCKETS, hist.counts):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+            lines.append(f'{name}_sum{{{labels}}} {hist.sum:.6f}')
+            lines.append(f'{name}_count{{{labels}}} {hist.count}')
+
+        header('middleware_requests_total', 'counter', 'Requests handled, by target and outcome.')
+        for (target, outcome), count in sorted(self._requests.items()):
+            lines.append(f'middleware_requests_total{{target="{target}",outcome="{outcome}"}} {count}')
+        header('middleware_request_errors_total', 'counter', 'Failed requests, by target and error class.')
+        for (target, error), count in sorted(self._errors.items()):
+            lines.append(f'middleware_request_errors_total{{target="{target}",error="{error}"}} {count}')
+        header('middleware_cache_hits_total', 'counter', 'Requests answered from the response cache.')
+        for target, count in sorted(self._cache_hits.items()):
+            lines.append(f'middleware_cache_hits_total{{target="{target}"}} {count}')
+        header('middleware_semantic_cache_hits_total', 'counter', 'Cache hits served for a near-duplicate chat/fix message.')
+        for target, count in sorted(self._semantic_hits.items()):
+            lines.append(f'middleware_semantic_cache_hits_total{{target="{target}"}} {count}')
+        header('middleware_artifact_hits_total', 'counter', 'Execute requests answered from a pre-generated artifact.')
+        for target, count in sorted(self._artifact_hits.items()):
+            lines.append(f'middleware_artifact_hits_total{{target="{target}"}} {count}')
+        header('middleware_coalesced_requests_total', 'counter', 'Requests that joined an identical in-flight request.')
+        for target, count in sorted(self._coalesced.items()):
+            lines.append(f'middleware_coalesced_requests_total{{target="{target}"}} {count}')
+        header('middleware_llm_retries_total', 'counter', 'LLM calls retried after a rate-limited or unavailable response.')
+        for target, count in sorted(self._retries.items()):
+            lines.append(f'middleware_llm_retries_total{{target="{target}"}} {count}')
+        header('middleware_stage_seconds', 'histogram', 'Duration of each request stage.')
+        for (target, stage), hist in sorted(self._stages.items()):
+            histogram('middleware_stage_seconds', f'target="{target}",stage="{stage}"', hist)
+        header('middleware_time_to_first_token_seconds', 'histogram', 'Time from request start to the first streamed chunk.')
+        for target, hist in sorted(self._ttft.items()):
+            histogram('middleware_time_to_first_token_seconds', f'target="{target}"', hist)
+        header('middleware_stream_chunks_total', 'counter', 'Streamed response chunks (approximately tokens).')
+        for target, count in sorted(self._chunks.items()):
+            lines.append(f'middleware_stream_chunks_total{{target="{target}"}} {count}')
+        header('middleware_stream_seconds_total', 'counter', 'Time spent between first and last chunk; chunks_total / this = tokens/sec.')
+        for target, seconds in sorted(self._stream_seconds.items()):
+            lines.append(f'middleware_stream_seconds_total{{target="{target}"}} {seconds:.6f}')
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide recorder and the metrics of the request being handled in this context
+recorder = MetricsRecorder()
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar('current_request_metrics', default=None)
+# Receives (name, started, ended, request) of every stage/span while set (perf_counter times)
+_span_listener: Optional[Callable[[str, float, float, Optional[RequestMetrics]], None]] = None
+
+
+def set_span_listener(listener: Optional[Callable[[str, float, float, Optional[RequestMetrics]], None]]) -> None:
+    """Installs (or with None removes) the process-wide span listener."""
+    global _span_listener
+    _span_listener = listener
+
+
+def emit_span(name: str, started: float, ended: float) -> None:
+    """Reports a span timed by the caller to the span listener, if any (not a stage)."""
+    listener = _span_listener
+    if listener is not None:
+        listener(name, started, ended, _current.get())
+
+
+def current() -> Optional[RequestMetrics]:
+    """Returns the metrics of the request being handled in this context, if any."""
+    return _current.get()
+
+
+def fork_context() -> Tuple[contextvars.Context, Optional[RequestMetrics]]:
+    """
+    A copy of the current context in which the current request's metrics are a fresh
+    fork (RequestMetrics.fork), for running one of several concurrent attempts as a
+    task (asyncio.create_task(..., context=...)). Returns the context and the fork
+    (None outside a tracked request) for the caller to merge back if the attempt wins.
+    """
+    context = contextvars.copy_context()
+    request = _current.get()
+    attempt = request.fork() if request is not None else None
+    context.run(_current.set, attempt)
+    return context, attempt
+
+
+@contextlib.contextmanager
+def track_request(product: str, operation: str, mode: str, target: str) -> Iterator[RequestMetrics]:
+    """
+    Starts metrics for a request; the caller sets .error before leaving the block on failure.
+    The finished record is handed to the recorder.
+    """
+    request = RequestMetrics(product, operation, mode, target)
+    token = _current.set(request)
+    try:
+        yield request
+    except BaseException as e:
+        request.error = request.error or type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        request.finish(request.error)
+        recorder.record(request)
+        listener = _span_listener
+        if listener is not None:
+            listener('request', request._start, request._start + request.total, request)
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Times a stage of the current request (no-op outside a tracked request unless spans are listened to)."""
+    request = _current.get()
+    listener = _span_listener
+    if request is None and listener is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        ended = time.perf_counter()
+        if request is not None:
+            request.add_stage(name, ended - started)
+        if listener is not None:
+            listener(name, started, ended, request)
+
+
+@contextlib.contextmanager
+def span(name: str) -> Iterator[None]:
+    """Times a block for the span listener only (no-op without one; not recorded as a stage)."""
+    if _span_listener is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        emit_span(name, started, time.perf_counter())
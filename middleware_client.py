@@ -0,0 +1,163 @@
+# middleware_client.py
+"""
+Thin client for the long-lived middleware daemon (see middleware_daemon.py).
+Only uses the standard library so forwarding a request avoids importing litellm.
+Responses are streamed back as newline-delimited JSON events (see output_sinks.EventSink).
+"""
+import os
+import sys
+import json
+import socket
+import tempfile
+import http.client
+from typing import Optional, Dict, Any, Iterator
+
+from output_sinks import OutputSink, EventSink
+
+# Where the daemon listens by default; MIDDLEWARE_ADDRESS ("host:port") selects TCP instead
+DEFAULT_SOCKET_PATH = os.environ.get(
+    "MIDDLEWARE_SOCKET", os.path.join(tempfile.gettempdir(), 'helloworld-agentic-middleware.sock'))
+DEFAULT_ADDRESS = os.environ.get("MIDDLEWARE_ADDRESS")
+
+HANDLE_PATH = '/v1/handle'
+HEALTH_PATH = '/health'
+METRICS_PATH = '/metrics'
+CONNECT_TIMEOUT_SECONDS = 1.0
+
+class DaemonUnavailable(Exception): pass
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection speaking HTTP over a Unix-domain socket."""
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self._socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self._socket_path)
+        self.sock = sock
+
+
+def _open_connection(socket_path: Optional[str], address: Optional[str]) -> http.client.HTTPConnection:
+    """Connects to the daemon, raising DaemonUnavailable if nothing is listening."""
+    address = address or DEFAULT_ADDRESS
+    try:
+        if address:
+            host, _, port = address.rpartition(':')
+            conn = http.client.HTTPConnection(host or '127.0.0.1', int(port), timeout=CONNECT_TIMEOUT_SECONDS)
+        else:
+            path = socket_path or DEFAULT_SOCKET_PATH
+            if not os.path.exists(path):
+                raise DaemonUnavailable(f"No daemon socket at {path}")
+            conn = _UnixHTTPConnection(path, CONNECT_TIMEOUT_SECONDS)
+        conn.connect()
+    except (OSError, ValueError) as e:
+        raise DaemonUnavailable(f"Cannot connect to middleware daemon: {e}") from e
+    conn.sock.settimeout(None) # Generation can take arbitrarily long once connected
+    return conn
+
+
+def is_daemon_available(socket_path: Optional[str] = None, address: Optional[str] = None) -> bool:
+    """Returns True if a daemon answers the health check."""
+    try:
+        conn = _open_connection(socket_path, address)
+    except DaemonUnavailable:
+        return False
+    try:
+        conn.request('GET', HEALTH_PATH)
+        return conn.getresponse().status == 200
+    except OSError:
+        return False
+    finally:
+        conn.close()
+
+
+def iter_events(request: Dict[str, Any], socket_path: Optional[str] = None,
+                address: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Sends a request to the daemon and yields its streamed events.
+
+    Args:
+        request: Keyword arguments for llm_workflow.handle_request (product, operation, ...).
+        socket_path: Unix socket path of the daemon (defaults to DEFAULT_SOCKET_PATH).
+        address: "host:port" of a TCP daemon; takes precedence over socket_path.
+
+    A stream that breaks off after the request was accepted ends with an
+    {"event": "error", "error": "DaemonDisconnected"} event, like a failure on the daemon.
+
+    Raises:
+        DaemonUnavailable: If the daemon cannot be reached before any event was received.
+    """
+    conn = _open_connection(socket_path, address)
+    try:
+        try:
+            body = json.dumps(request).encode('utf-8')
+            conn.request('POST', HANDLE_PATH, body=body, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+        except OSError as e:
+            raise DaemonUnavailable(f"Middleware daemon did not accept the request: {e}") from e
+        if response.status != 200:
+            detail = response.read().decode('utf-8', errors='replace')
+            raise DaemonUnavailable(f"Middleware daemon returned HTTP {response.status}: {detail}")
+        try:
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+        except (http.client.IncompleteRead, OSError, ValueError) as e:
+            # The daemon went away mid-stream (crashed, killed, connection reset, truncated event)
+            yield {'event': 'error', 'error': 'DaemonDisconnected', 'detail': f"{type(e).__name__}: {e}"}
+    finally:
+        conn.close()
+
+
+def request_via_daemon(request: Dict[str, Any], sink: Optional[OutputSink] = None,
+                       socket_path: Optional[str] = None, address: Optional[str] = None) -> Optional[str]:
+    """
+    Runs a request on the daemon, replaying its streamed events into sink
+    (an EventSink receives the daemon's events unchanged).
+
+    Returns:
+        The full response string, or None if the request failed on the daemon side.
+
+    Raises:
+        DaemonUnavailable: If the daemon cannot be reached (callers fall back to in-process handling).
+    """
+    sink = sink or OutputSink()
+    relay = isinstance(sink, EventSink)
+    announced = False
+    stream_started = False
+    for event in iter_events(request, socket_path=socket_path, address=address):
+        kind = event.get('event')
+        if not announced and kind in ('prompt_selected', 'chunk', 'code_block'):
+            print("Info: Request handled by the middleware daemon.")
+            announced = True
+        if relay:
+            sink.relay(event)
+        elif kind == 'prompt_selected' and 'prompt' in event:
+            sink.prompt(event['prompt'])
+        elif kind in ('chunk', 'code_block'):
+            if not stream_started:
+                sink.stream_start()
+                stream_started = True
+            if kind == 'chunk':
+                sink.chunk(event['text'])
+            else:
+                sink.code_block(event['block'])
+        if kind == 'done':
+            if stream_started:
+                sink.stream_end()
+            if not relay:
+                sink.done(event.get('response'))
+            return event.get('response')
+        if kind == 'error':
+            sink.flush()
+            print(f"\nError from middleware daemon: {event.get('error')}", file=sys.stderr)
+            if not relay:
+                sink.error(event.get('error') or "RequestFailed")
+            return None
+    sink.flush()
+    print("\nError: Middleware daemon closed the stream without a result.", file=sys.stderr)
+    sink.error("DaemonDisconnected")
+    return None
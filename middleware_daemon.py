@@ -0,0 +1,282 @@
+# middleware_daemon.py
+"""
+Long-lived middleware daemon.
+Keeps litellm, the shared LocalServerManager and the response cache warm in one
+process and serves llm_workflow.ahandle_request over HTTP on a Unix-domain socket
+(or TCP), streaming each response back as the events of output_sinks.EventSink:
+{"event": "prompt_selected", ...}, {"event": "first_token", ...}, {"event": "chunk", "text": ...}
+and {"event": "code_block", "block": ...} as each block completes, then
+{"event": "done", "response": ...} or {"event": "error", "error": <error class>}.
+Events are newline-delimited JSON, or SSE messages if the request sends Accept: text/event-stream.
+GET /metrics returns the aggregated request metrics in Prometheus text format.
+With prewarm_artifacts, missing catalog artifacts (prewarm.py) are generated in the
+background whenever no request has been in flight for PREWARM_IDLE_SECONDS.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+from typing import Optional, Dict, Any
+
+import llm_workflow
+import llm_interface
+import metrics
+import http_pool
+from local_server_manager import get_server_manager
+from output_sinks import EventSink, NDJSON, SSE
+from middleware_client import DEFAULT_SOCKET_PATH, HANDLE_PATH, HEALTH_PATH, METRICS_PATH
+
+_REQUIRED_FIELDS = ('product', 'operation')
+_MAX_BODY_BYTES = 16 * 1024 * 1024
+_EVENT_CONTENT_TYPES = {NDJSON: 'application/x-ndjson', SSE: 'text/event-stream'}
+# Quiet period before background pre-generation may start its next artifact
+PREWARM_IDLE_SECONDS = float(os.environ.get("MIDDLEWARE_PREWARM_IDLE_SECONDS", "5"))
+# Event bytes a client may fall behind by before it is dropped as too slow (and its request cancelled)
+MAX_PENDING_EVENT_BYTES = int(os.environ.get("MIDDLEWARE_MAX_PENDING_EVENT_BYTES", str(8 * 1024 * 1024)))
+
+# Workflow requests in flight, and when the last one finished (for background pre-generation)
+_active_requests = 0
+_last_request_end = 0.0
+
+
+def _write_head(writer: asyncio.StreamWriter, status: str, content_type: str) -> None:
+    writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nConnection: close\r\n\r\n".encode('latin-1'))
+
+
+def _write_text(writer: asyncio.StreamWriter, status: str, content_type: str, text: str) -> None:
+    _write_head(writer, status, content_type)
+    writer.write(text.encode('utf-8'))
+
+
+def _write_json(writer: asyncio.StreamWriter, status: str, payload: Dict[str, Any]) -> None:
+    _write_head(writer, status, 'application/json')
+    writer.write(json.dumps(payload).encode('utf-8'))
+
+
+class _EventStream:
+    """
+    Events of one request on their way to the client. The sink only queues them;
+    run() writes them out and awaits drain(), so a slow client applies back-pressure
+    instead of growing the transport buffer, and a lost or too slow client sets lost.
+    """
+    def __init__(self, writer: asyncio.StreamWriter):
+        self._writer = writer
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._pending_bytes = 0
+        self.lost = asyncio.Event()
+
+    def write(self, text: str) -> None:
+        """EventSink callback: queues an encoded event (dropped once the client is lost)."""
+        if self.lost.is_set():
+            return
+        data = text.encode('utf-8')
+        self._pending_bytes += len(data)
+        if self._pending_bytes > MAX_PENDING_EVENT_BYTES:
+            print(f"Warning: Daemon client fell more than {MAX_PENDING_EVENT_BYTES} bytes behind; dropping it.",
+                  file=sys.stderr)
+            self.lost.set()
+            return
+        self._queue.put_nowait(data)
+
+    def close(self) -> None:
+        """No more events; run() returns once the queued ones are written."""
+        self._queue.put_nowait(None)
+
+    async def run(self) -> None:
+        try:
+            while True:
+                data = await self._queue.get()
+                batch = []
+                while data is not None:
+                    batch.append(data)
+                    if self._queue.empty():
+                        break
+                    data = self._queue.get_nowait()
+                if batch:
+                    self._pending_bytes -= sum(len(item) for item in batch)
+                    self._writer.write(b"".join(batch))
+                    await self._writer.drain()
+                if data is None:
+                    return
+        except ConnectionError:
+            self.lost.set()
+
+
+async def _wait_hangup(reader: asyncio.StreamReader) -> None:
+    """Returns when the client closes its side of the connection (it sends nothing after the request)."""
+    try:
+        while await reader.read(4096):
+            pass
+    except ConnectionError:
+        pass
+
+
+async def _handle_workflow_request(body: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                                   framing: str = NDJSON) -> None:
+    """
+    Runs one workflow request and streams its events to the client. The request is
+    cancelled if the client disconnects or falls too far behind, which releases its
+    admission slot and local server lease and stops the generation (unless an
+    identical request still reads it).
+    """
+    try:
+        request = json.loads(body or b'{}')
+        missing = [name for name in _REQUIRED_FIELDS if not request.get(name)]
+        if missing:
+            raise ValueError(f"missing field(s): {', '.join(missing)}")
+    except ValueError as e:
+        _write_json(writer, '400 Bad Request', {'error': f"Invalid request: {e}"})
+        return
+
+    _write_head(writer, '200 OK', _EVENT_CONTENT_TYPES[framing])
+    await writer.drain()
+    events = _EventStream(writer)
+    sink = EventSink(events.write, framing=framing)
+    global _active_requests, _last_request_end
+    _active_requests += 1
+    request_task = asyncio.create_task(llm_workflow.ahandle_request(
+        product=request['product'],
+        operation=request['operation'],
+        target=request.get('target', 'local'),
+        mode=request.get('mode', 'execute'),
+        msg=request.get('msg'),
+        use_cache=request.get('use_cache', True),
+        refresh=request.get('refresh', False),
+        hedge=request.get('hedge', False),
+        sink=sink, # Ends the stream with a done or error event
+    ))
+    writer_task = asyncio.create_task(events.run())
+    watchers = [asyncio.create_task(_wait_hangup(reader)), asyncio.create_task(events.lost.wait())]
+    try:
+        await asyncio.wait([request_task, *watchers], return_when=asyncio.FIRST_COMPLETED)
+        client_gone = not request_task.done()
+        if client_gone:
+            print("Info: Daemon client disconnected; cancelling its request.")
+            request_task.cancel()
+        try:
+            await request_task
+        except asyncio.CancelledError:
+            if not client_gone:
+                raise # The daemon itself is shutting down
+        except Exception as e: # Keep serving other clients
+            print(f"Error: Unexpected error handling daemon request: {type(e).__name__}: {e}", file=sys.stderr)
+            sink.error(type(e).__name__)
+        if not client_gone: # Otherwise nobody reads the rest; a pending drain() would never return
+            events.close()
+            await writer_task
+    finally:
+        for task in (request_task, writer_task, *watchers):
+            task.cancel()
+        await asyncio.gather(request_task, writer_task, *watchers, return_exceptions=True)
+        _active_requests -= 1
+        _last_request_end = time.monotonic()
+
+
+async def _wait_idle() -> None:
+    """Returns once no request has been in flight for PREWARM_IDLE_SECONDS."""
+    while True:
+        idle_for = time.monotonic() - _last_request_end
+        if not _active_requests and idle_for >= PREWARM_IDLE_SECONDS:
+            return
+        await asyncio.sleep(max(0.5, PREWARM_IDLE_SECONDS - idle_for))
+
+
+async def _background_prewarm() -> None:
+    import prewarm # Only needed with prewarm_artifacts
+    try:
+        await prewarm.aprewarm('local', concurrency=1, wait_idle=_wait_idle)
+    except Exception as e: # Never takes the daemon down
+        print(f"Warning: Background prewarm stopped: {type(e).__name__}: {e}", file=sys.stderr)
+
+
+async def _handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Parses a single HTTP/1.1 request and dispatches it."""
+    try:
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        method, path, _ = request_line.split(' ', 2)
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        if length > _MAX_BODY_BYTES:
+            _write_json(writer, '413 Payload Too Large', {'error': 'Request body too large.'})
+            return
+        body = await reader.readexactly(length) if length else b''
+
+        if method == 'GET' and path == HEALTH_PATH:
+            _write_json(writer, '200 OK', {'status': 'ok', 'pid': os.getpid()})
+        elif method == 'GET' and path == METRICS_PATH:
+            _write_text(writer, '200 OK', 'text/plain; version=0.0.4', metrics.recorder.render_prometheus())
+        elif method == 'POST' and path == HANDLE_PATH:
+            framing = SSE if 'text/event-stream' in headers.get('accept', '') else NDJSON
+            await _handle_workflow_request(body, reader, writer, framing)
+        else:
+            _write_json(writer, '404 Not Found', {'error': f"No route for {method} {path}"})
+    except (ValueError, asyncio.IncompleteReadError) as e:
+        _write_json(writer, '400 Bad Request', {'error': f"Malformed HTTP request: {e}"})
+    except ConnectionError:
+        pass # Client went away mid-stream
+    finally:
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def _serve(socket_path: Optional[str], host: Optional[str], port: Optional[int],
+                 prewarm_artifacts: bool = False) -> None:
+    if port is not None:
+        server = await asyncio.start_server(_handle_connection, host or '127.0.0.1', port)
+        location = f"http://{host or '127.0.0.1'}:{port}"
+    else:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path) # Stale socket from a previous run
+        server = await asyncio.start_unix_server(_handle_connection, path=socket_path)
+        os.chmod(socket_path, 0o600)
+        location = f"unix://{socket_path}"
+    print(f"Info: Middleware daemon listening on {location} (pid {os.getpid()}).")
+    prewarm_task = asyncio.create_task(_background_prewarm()) if prewarm_artifacts else None # Kept referenced while serving
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if prewarm_task is not None:
+            prewarm_task.cancel()
+        await http_pool.aclose_all() # Keep-alive connections of this loop's pooled clients
+
+
+def serve(socket_path: Optional[str] = None, host: Optional[str] = None, port: Optional[int] = None,
+          warm_local: bool = False, prewarm_artifacts: bool = False) -> None:
+    """
+    Runs the daemon until interrupted.
+
+    Args:
+        socket_path: Unix socket to listen on (default DEFAULT_SOCKET_PATH); ignored when port is set.
+        host: TCP host to bind when port is given (default 127.0.0.1).
+        port: TCP port to listen on instead of a Unix socket.
+        warm_local: Check (and if needed start) the local llama-server and pre-warm its prompt
+            cache with the template prefixes before accepting requests.
+        prewarm_artifacts: Generate missing catalog artifacts on the local target in the
+            background while the daemon is idle.
+    """
+    socket_path = socket_path or DEFAULT_SOCKET_PATH
+    llm_interface.load_litellm() # Paid once here instead of by the first request
+    if warm_local:
+        if not get_server_manager().ensure_running():
+            print("Warning: Local server is not running; local requests will retry the check.", file=sys.stderr)
+        else:
+            llm_workflow.prewarm_prompt_cache('local') # Template prefixes into llama-server's prompt cache
+    try:
+        asyncio.run(_serve(socket_path, host, port, prewarm_artifacts))
+    except KeyboardInterrupt:
+        print("\nInfo: Middleware daemon stopped.")
+    finally:
+        if port is None and os.path.exists(socket_path):
+            os.unlink(socket_path)
@@ -0,0 +1,122 @@
+# msg_source.py
+"""
+Reads a msg (typically a pasted install log for fix mode) from a file or stdin
+without holding all of it in memory.
+At most the target's prompt budget of a msg is ever sent (prompt_budget keeps its
+head and tail), so only a window of that size is read: a regular file is
+memory-mapped and just its head and tail are copied out, stdin is read in chunks
+keeping the head and a rolling tail. The omitted middle is replaced by
+prompt_budget's omission marker. Memory use follows the window, not the log size.
+"""
+import os
+import sys
+import mmap
+import stat
+from collections import deque
+from typing import Optional, Tuple, BinaryIO
+
+import prompt_budget # Budget-derived window and the omission marker
+
+# Most bytes kept from a msg file (also the window for targets without a prompt budget)
+MAX_MSG_BYTES = int(os.environ.get("LLM_MSG_FILE_MAX_BYTES", str(1024 * 1024)))
+# Bytes read per budget token: room for prompt_budget to collapse repeats and fit exactly afterwards
+WINDOW_BYTES_PER_TOKEN = prompt_budget.CHARS_PER_TOKEN * 2
+READ_CHUNK_BYTES = 256 * 1024
+
+
+def window_bytes(target: Optional[str]) -> int:
+    """How much of a msg file is read for a request to target."""
+    budget = prompt_budget.budget_for(target)
+    if budget is None:
+        return MAX_MSG_BYTES
+    return min(MAX_MSG_BYTES, budget * WINDOW_BYTES_PER_TOKEN)
+
+
+def _split_window(max_bytes: int) -> Tuple[int, int]:
+    head_bytes = int(max_bytes * prompt_budget.HEAD_SHARE)
+    return head_bytes, max_bytes - head_bytes
+
+
+def _join(head: bytes, tail: bytes, omitted_bytes: int, omitted_lines: Optional[int]) -> str:
+    """Decodes head and tail (cut back to whole lines where possible) around an omission marker."""
+    cut = head.rfind(b"\n")
+    if cut > len(head) // 2:
+        omitted_bytes += len(head) - cut
+        head = head[:cut]
+    cut = tail.find(b"\n")
+    if 0 <= cut < len(tail) // 2:
+        omitted_bytes += cut + 1
+        tail = tail[cut + 1:]
+        if omitted_lines is not None:
+            omitted_lines += 1 # The line ended by that newline is now omitted as well
+    marker = prompt_budget.omission_marker(omitted_bytes, omitted_lines)
+    return f"{head.decode('utf-8', 'replace')}{marker}{tail.decode('utf-8', 'replace')}"
+
+
+def _read_mapped(f: BinaryIO, size: int, max_bytes: int) -> str:
+    """Head and tail of a regular file, copied out of a memory map (the middle is never read)."""
+    head_bytes, tail_bytes = _split_window(max_bytes)
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        head = mapped[:head_bytes]
+        tail = mapped[size - tail_bytes:]
+    return _join(head, tail, size - head_bytes - tail_bytes, None)
+
+
+def _read_stream(stream: BinaryIO, max_bytes: int) -> str:
+    """Head and rolling tail of a stream read in chunks (the omitted lines are counted on the way)."""
+    head = bytearray()
+    head_bytes, tail_bytes = _split_window(max_bytes)
+    tail: deque = deque()
+    tail_size = 0
+    dropped_bytes = 0
+    dropped_lines = 0
+    while True:
+        data = stream.read(READ_CHUNK_BYTES)
+        if not data:
+            break
+        if len(head) < head_bytes:
+            take = head_bytes - len(head)
+            head += data[:take]
+            data = data[take:]
+        if data:
+            tail.append(data)
+            tail_size += len(data)
+            while tail and tail_size - len(tail[0]) >= tail_bytes:
+                chunk = tail.popleft()
+                tail_size -= len(chunk)
+                dropped_bytes += len(chunk)
+                dropped_lines += chunk.count(b"\n")
+    kept_tail = b"".join(tail)
+    if not dropped_bytes and tail_size <= tail_bytes:
+        return (bytes(head) + kept_tail).decode('utf-8', 'replace')
+    cut = len(kept_tail) - tail_bytes # Part of the oldest tail chunk that falls outside the window
+    dropped_bytes += cut
+    dropped_lines += kept_tail.count(b"\n", 0, cut)
+    return _join(bytes(head), kept_tail[cut:], dropped_bytes, dropped_lines)
+
+
+def read_msg(path: str, max_bytes: int = MAX_MSG_BYTES) -> str:
+    """
+    Reads a msg from path ('-' for stdin), keeping at most about max_bytes of it.
+
+    Args:
+        path: File to read, or '-' for standard input.
+        max_bytes: Window size; larger input keeps its head and tail around an omission marker.
+
+    Returns:
+        The (possibly windowed) msg text; invalid UTF-8 is replaced.
+
+    Raises:
+        OSError: If the file cannot be read.
+    """
+    if path == '-':
+        return _read_stream(sys.stdin.buffer, max_bytes)
+    with open(path, 'rb') as f:
+        info = os.fstat(f.fileno())
+        if not stat.S_ISREG(info.st_mode): # Pipe or device: no size, read it like stdin
+            return _read_stream(f, max_bytes)
+        size = info.st_size
+        if size <= max_bytes:
+            return f.read().decode('utf-8', 'replace')
+        print(f"Info: Reading the head and tail ({max_bytes} bytes) of the {size}-byte msg file '{path}'.", file=sys.stderr)
+        return _read_mapped(f, size, max_bytes)
@@ -0,0 +1,225 @@
+# output_sinks.py
+"""
+Output sinks receive the progress of a request (final prompt, streamed chunks,
+completed code blocks, the final result) instead of chatsend printing them directly.
+OutputSink itself discards everything (quiet mode for machine consumers).
+EventSink turns the progress into a machine-readable NDJSON or SSE event stream.
+"""
+import os
+import sys
+import json
+import time
+from typing import Optional, Callable, List, TextIO, Dict, Any
+
+import metrics # Prompt size of the current request
+
+DEFAULT_FLUSH_CHARS = 64
+DEFAULT_FLUSH_INTERVAL_SECONDS = 0.05
+# Longest prompt echoed in full by ConsoleSink; longer ones show their head and tail (e.g. a pasted log)
+PROMPT_PREVIEW_CHARS = int(os.environ.get("LLM_PROMPT_PREVIEW_CHARS", "8000"))
+
+
+class OutputSink:
+    """Base sink: ignores every event. Subclasses override the events they care about."""
+    # Set to True by sinks that want code blocks while the response streams
+    wants_code_blocks = False
+
+    def prompt(self, prompt: str) -> None:
+        pass
+
+    def stream_start(self) -> None:
+        pass
+
+    def chunk(self, text: str) -> None:
+        pass
+
+    def code_block(self, block: str) -> None:
+        pass
+
+    def stream_end(self) -> None:
+        pass
+
+    def flush(self) -> None:
+        """Writes out anything buffered (called before errors are reported)."""
+        pass
+
+    def done(self, response: str) -> None:
+        """The request succeeded with response (called once, after stream_end)."""
+        pass
+
+    def error(self, error: str) -> None:
+        """The request failed; error is the error class name (called once)."""
+        pass
+
+
+class ConsoleSink(OutputSink):
+    """
+    Echoes the prompt banner and the response stream to a text stream.
+    Chunks are buffered and written once `flush_chars` characters are pending
+    or `flush_interval` seconds have passed, instead of one write per token.
+    """
+    def __init__(self,
+                 stream: Optional[TextIO] = None,
+                 echo_prompt: bool = True,
+                 flush_chars: int = DEFAULT_FLUSH_CHARS,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL_SECONDS,
+                 collect_code_blocks: bool = False,
+                 prompt_preview_chars: int = PROMPT_PREVIEW_CHARS):
+        self._stream = stream
+        self.echo_prompt = echo_prompt
+        self.prompt_preview_chars = prompt_preview_chars
+        self.flush_chars = max(1, flush_chars)
+        self.flush_interval = flush_interval
+        self._pending: List[str] = []
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+        self.wants_code_blocks = collect_code_blocks
+        self.code_blocks: List[str] = []
+
+    @property
+    def stream(self) -> TextIO:
+        # Resolved lazily so redirected stdout (e.g. batch mode) is honoured
+        return self._stream or sys.stdout
+
+    def prompt(self, prompt: str) -> None:
+        if not self.echo_prompt:
+            return
+        stream = self.stream
+        stream.write("\n--- Start of Final Prompt for LLM ---\n")
+        if len(prompt) <= self.prompt_preview_chars:
+            stream.write(prompt)
+        else: # Written in slices: the banner never copies a huge prompt
+            half = self.prompt_preview_chars // 2
+            stream.write(prompt[:half])
+            stream.write(f"\n... [{len(prompt) - 2 * half} characters of the prompt not shown] ...\n")
+            stream.write(prompt[len(prompt) - half:])
+        stream.write("\n--- End of Final Prompt for LLM ---\n\n")
+
+    def stream_start(self) -> None:
+        self.stream.write("--- Start of Response Stream ---\n")
+        self.stream.flush()
+        self._last_flush = time.monotonic()
+
+    def chunk(self, text: str) -> None:
+        self._pending.append(text)
+        self._pending_chars += len(text)
+        if (self._pending_chars >= self.flush_chars
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def code_block(self, block: str) -> None:
+        self.code_blocks.append(block)
+
+    def flush(self) -> None:
+        if self._pending:
+            self.stream.write("".join(self._pending))
+            self._pending.clear()
+            self._pending_chars = 0
+        self.stream.flush()
+        self._last_flush = time.monotonic()
+
+    def stream_end(self) -> None:
+        self.flush()
+        self.stream.write("\n--- End of Response Stream ---\n")
+        self.stream.flush()
+
+
+class CallbackSink(OutputSink):
+    """Forwards chunks and completed code blocks to plain callbacks."""
+    def __init__(self,
+                 on_chunk: Optional[Callable[[str], None]] = None,
+                 on_code_block: Optional[Callable[[str], None]] = None):
+        self._on_chunk = on_chunk
+        self._on_code_block = on_code_block
+        self.wants_code_blocks = on_code_block is not None
+
+    def chunk(self, text: str) -> None:
+        if self._on_chunk:
+            self._on_chunk(text)
+
+    def code_block(self, block: str) -> None:
+        if self._on_code_block:
+            self._on_code_block(block)
+
+
+# Event stream framings supported by EventSink
+NDJSON = 'ndjson'
+SSE = 'sse'
+EVENT_FORMATS = (NDJSON, SSE)
+
+
+def encode_event(payload: Dict[str, Any], framing: str = NDJSON) -> str:
+    """One event as an NDJSON line or an SSE message (event name taken from payload['event'])."""
+    data = json.dumps(payload, ensure_ascii=False)
+    if framing == SSE:
+        return f"event: {payload['event']}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+class EventSink(OutputSink):
+    """
+    Writes each step of a request as an event, as soon as it happens:
+    prompt_selected, first_token, chunk, code_block, then done or error.
+    Every event is a JSON object with an "event" field, framed as NDJSON lines
+    or SSE messages and handed to write (which should not buffer).
+    """
+    def __init__(self, write: Callable[[str], None], framing: str = NDJSON, include_prompt: bool = True):
+        if framing not in EVENT_FORMATS:
+            raise ValueError(f"Unknown event framing '{framing}' (expected one of {', '.join(EVENT_FORMATS)}).")
+        self._write = write
+        self.framing = framing
+        self.include_prompt = include_prompt
+        self.wants_code_blocks = True
+        self._started = time.perf_counter()
+        self._first_token_sent = False
+        self._finished = False
+
+    @classmethod
+    def to_stream(cls, stream: TextIO, framing: str = NDJSON, include_prompt: bool = True) -> 'EventSink':
+        """EventSink writing to a text stream, flushing after every event."""
+        def write(text: str) -> None:
+            stream.write(text)
+            stream.flush()
+        return cls(write, framing=framing, include_prompt=include_prompt)
+
+    def emit(self, event: str, **fields: Any) -> None:
+        self._write(encode_event({"event": event, **fields}, self.framing))
+
+    def relay(self, payload: Dict[str, Any]) -> None:
+        """Writes an event produced elsewhere (e.g. by the daemon's EventSink) unchanged."""
+        if payload.get('event') in ('done', 'error'):
+            if self._finished:
+                return
+            self._finished = True
+        if payload.get('event') == 'prompt_selected' and not self.include_prompt:
+            payload = {name: value for name, value in payload.items() if name != 'prompt'}
+        self._write(encode_event(payload, self.framing))
+
+    def prompt(self, prompt: str) -> None:
+        request_metrics = metrics.current()
+        fields: Dict[str, Any] = {'chars': len(prompt)}
+        if request_metrics and request_metrics.prompt_tokens is not None:
+            fields['tokens'] = request_metrics.prompt_tokens
+        if self.include_prompt:
+            fields['prompt'] = prompt
+        self.emit('prompt_selected', **fields)
+
+    def chunk(self, text: str) -> None:
+        if not self._first_token_sent:
+            self._first_token_sent = True
+            self.emit('first_token', ttft_ms=round((time.perf_counter() - self._started) * 1000, 3))
+        self.emit('chunk', text=text)
+
+    def code_block(self, block: str) -> None:
+        self.emit('code_block', block=block)
+
+    def done(self, response: str) -> None:
+        if not self._finished:
+            self._finished = True
+            self.emit('done', response=response,
+                      elapsed_ms=round((time.perf_counter() - self._started) * 1000, 3))
+
+    def error(self, error: str) -> None:
+        if not self._finished:
+            self._finished = True
+            self.emit('error', error=error)
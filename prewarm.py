@@ -0,0 +1,177 @@
+# prewarm.py
+"""
+Speculative pre-generation of the execute-prompt catalog.
+Every mapped (operation, product) template in the prompt registry is rendered for the
+msg variants it can take (no msg, and each operating system for templates that render
+the OS a msg states), answered by the target through the regular workflow, and
+stored with its extracted code blocks in the artifact store (artifact_store.py).
+Matching execute requests are then answered without an LLM call.
+
+Run it off-hours (`main.py prewarm`, e.g. from cron) or let the daemon do it while
+no request is in flight (`main.py serve --prewarm`). Only missing artifacts are
+generated, and artifacts of templates that changed since are pruned first.
+"""
+import sys
+import time
+import asyncio
+import contextlib
+from typing import List, Optional, Tuple, Callable, Awaitable, Iterable, TextIO
+
+import llm_workflow
+import llm_config
+import http_pool
+import prompt_registry
+import prompt_budget # OS a template fixes or a msg states
+import artifact_store
+from output_sinks import CallbackSink
+
+# msg variants answered ahead of time: no message (MacOS for templates with {os}), and the other
+# operating systems the templates have examples for. Templates written for one OS take only the first
+# (see variant_applies), and variants rendering the same prompt are generated once.
+DEFAULT_MSG_VARIANTS: Tuple[Optional[str], ...] = (None, "OS: Linux", "OS: Windows")
+
+
+class PrewarmJob:
+    """One template/msg variant to generate."""
+    __slots__ = ('template', 'operation', 'product', 'msg')
+
+    def __init__(self, template: prompt_registry.CompiledTemplate, operation: str, product: str, msg: Optional[str]):
+        self.template = template
+        self.operation = operation
+        self.product = product
+        self.msg = msg
+
+    def describe(self) -> str:
+        return f"{self.template.name} (msg: {self.msg!r})"
+
+
+def catalog() -> List[Tuple[str, str, prompt_registry.CompiledTemplate]]:
+    """(operation, product, template) of every mapped execute prompt, with display-style names."""
+    return [(operation.lower(), product.lower().replace('_', '-'), template)
+            for (operation, product), template in sorted(prompt_registry.EXECUTE_TEMPLATES.items())]
+
+
+def variant_applies(template: prompt_registry.CompiledTemplate, msg: Optional[str]) -> bool:
+    """
+    False for a msg that states an OS when the template fixes its own: the prompt would
+    declare two operating systems, an answer nobody asks for.
+    """
+    return not (prompt_budget.template_os(template) and prompt_budget.stated_os(msg))
+
+
+def plan_jobs(target: str, msgs: Iterable[Optional[str]] = DEFAULT_MSG_VARIANTS, force: bool = False,
+              store: Optional[artifact_store.ArtifactStore] = None) -> List[PrewarmJob]:
+    """
+    The catalog entries still missing an artifact for target's model.
+
+    Args:
+        target: Target whose model generates the answers.
+        msgs: msg variants to generate per template (variants equal after normalization, or for
+            a template without {msg}, are merged; OS variants skip templates that fix their OS).
+        force: Regenerate artifacts that already exist.
+        store: Artifact store (default: the shared one).
+    """
+    store = store or artifact_store.get_artifact_store()
+    model = llm_config.model_name(target)
+    jobs = []
+    for operation, product, template in catalog():
+        seen = set()
+        for msg in msgs:
+            if not variant_applies(template, msg):
+                continue
+            variant = artifact_store.template_variant(template, msg)
+            if variant in seen:
+                continue
+            seen.add(variant)
+            if force or store.get(template, msg, model) is None:
+                jobs.append(PrewarmJob(template, operation, product, msg))
+    return jobs
+
+
+async def _agenerate(job: PrewarmJob, target: str, store: artifact_store.ArtifactStore) -> Optional[str]:
+    """Generates and stores one artifact; returns the error class name on failure."""
+    chunks: List[str] = []
+    code_blocks: List[str] = []
+    sink = CallbackSink(on_chunk=chunks.append, on_code_block=code_blocks.append)
+    # use_cache=False: neither an old artifact nor a cached response may stand in for a fresh answer
+    result = await llm_workflow.arun_request(job.product, job.operation, target, 'execute', job.msg,
+                                             use_cache=False, sink=sink)
+    if not result.response:
+        return result.error or "EmptyResponse"
+    await asyncio.to_thread(store.put, job.template, job.msg, llm_config.model_name(target), chunks, code_blocks)
+    return None
+
+
+async def arun_prewarm(jobs: List[PrewarmJob], target: str, concurrency: int = 2,
+                       wait_idle: Optional[Callable[[], Awaitable[None]]] = None,
+                       store: Optional[artifact_store.ArtifactStore] = None,
+                       log: TextIO = sys.stderr) -> Tuple[int, int]:
+    """
+    Generates the artifacts of jobs with bounded concurrency.
+
+    Args:
+        jobs: From plan_jobs.
+        target: Target generating the answers.
+        concurrency: Generations in flight at once (the target's admission limits apply too).
+        wait_idle: Awaited before each generation starts (the daemon waits until it has no requests).
+        store: Artifact store (default: the shared one).
+        log: Stream receiving one progress line per job.
+
+    Returns:
+        (artifacts stored, failures).
+    """
+    store = store or artifact_store.get_artifact_store()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    done = 0
+    failures = 0
+
+    async def run(job: PrewarmJob) -> None:
+        nonlocal done, failures
+        async with semaphore:
+            if wait_idle:
+                await wait_idle()
+            started = time.perf_counter()
+            try:
+                error = await _agenerate(job, target, store)
+            except Exception as e: # One failing entry must not stop the others
+                error = type(e).__name__
+            done += 1
+            if error:
+                failures += 1
+                print(f"Warning: [{done}/{len(jobs)}] {job.describe()} failed: {error}", file=log)
+            else:
+                print(f"Info: [{done}/{len(jobs)}] {job.describe()} stored in {time.perf_counter() - started:.1f}s.", file=log)
+
+    await asyncio.gather(*(run(job) for job in jobs))
+    return done - failures, failures
+
+
+async def aprewarm(target: str, msgs: Iterable[Optional[str]] = DEFAULT_MSG_VARIANTS, concurrency: int = 2,
+                   force: bool = False, wait_idle: Optional[Callable[[], Awaitable[None]]] = None,
+                   log: TextIO = sys.stderr) -> int:
+    """
+    Prunes stale artifacts, then generates the missing ones (see arun_prewarm).
+
+    Returns:
+        The number of failed generations.
+    """
+    store = artifact_store.get_artifact_store()
+    # SQLite scans; off the event loop, which may be serving daemon requests meanwhile
+    pruned = await asyncio.to_thread(store.prune, [template for _, _, template in catalog()])
+    if pruned:
+        print(f"Info: Removed {pruned} artifact(s) of changed templates.", file=log)
+    jobs = await asyncio.to_thread(plan_jobs, target, msgs, force=force, store=store)
+    if not jobs:
+        print(f"Info: Every catalog artifact for '{target}' is up to date.", file=log)
+        return 0
+    print(f"Info: Generating {len(jobs)} artifact(s) on '{target}' with concurrency {concurrency}.", file=log)
+    stored, failures = await arun_prewarm(jobs, target, concurrency, wait_idle=wait_idle, store=store, log=log)
+    print(f"Info: Prewarm finished: {stored} stored, {failures} failed.", file=log)
+    return failures
+
+
+def run_prewarm(target: str, msgs: Iterable[Optional[str]] = DEFAULT_MSG_VARIANTS, concurrency: int = 2,
+                force: bool = False, log: TextIO = sys.stderr) -> int:
+    """Synchronous aprewarm; progress chatter printed by the workflow is redirected to log."""
+    with contextlib.redirect_stdout(log):
+        return http_pool.run_sync(aprewarm(target, msgs, concurrency, force=force, log=log))
@@ -0,0 +1,212 @@
+# profiling.py
+"""
+Profile capture for a single CLI run (`main.py ... --profile DIR`).
+While active, the run is profiled with cProfile, allocations are traced with
+tracemalloc, modules imported for the first time are timed (like -X importtime,
+but only for imports after the profile started: litellm, openai, httpx and
+llama_man load lazily, so those are included), and every metrics stage and span
+(prompt, config, ensure_running, import_litellm, llm_setup, stream, extract,
+request) is captured with its start and end time.
+
+Written to DIR:
+  profile.pstats  cProfile statistics (python -m pstats, snakeviz, flameprof, ...)
+  trace.json      Chrome trace of the spans and imports (chrome://tracing, Perfetto, speedscope)
+  summary.txt     profiled time per package (litellm vs. this code), span totals,
+                  import breakdown, the tracemalloc peak and the largest allocation
+                  sites still held at the end
+
+Spans are captured on every thread; cProfile sees every thread from Python 3.12 on
+(before, only the one the profile started on). tracemalloc slows allocation-heavy
+code such as the litellm import about tenfold; set LLM_PROFILE_TRACEMALLOC=0 to
+profile timings without it (peak RSS is reported either way).
+"""
+import os
+import sys
+import json
+import time
+import builtins
+import cProfile
+import pstats
+import resource
+import sysconfig
+import threading
+import tracemalloc
+from typing import Optional, Dict, Any, List, Tuple
+
+import metrics # Span listener
+
+# Imports faster than this are left out of the trace (the summary still counts them)
+MIN_TRACED_IMPORT_SECONDS = 0.001
+# Allocation sites listed in the summary
+TOP_ALLOCATIONS = 15
+# Trace allocations (overridable via environment variable; costly, see above)
+TRACE_ALLOCATIONS = os.environ.get("LLM_PROFILE_TRACEMALLOC", "1") != "0"
+
+_REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+_STDLIB = sysconfig.get_paths()['stdlib']
+# Package groups of the per-package time breakdown, matched on path segments
+_PACKAGE_GROUPS = (
+    ('litellm', ('litellm',)),
+    ('openai', ('openai',)),
+    ('http', ('httpx', 'httpcore', 'h11', 'anyio', 'aiohttp')),
+    ('pydantic', ('pydantic', 'pydantic_core')),
+    ('tokenizers', ('tiktoken', 'tokenizers')),
+)
+
+
+def _package_group(filename: str, funcname: str) -> str:
+    """Which part of the process a profiled function belongs to."""
+    if filename == '~':
+        # Built-ins: the event loop's selector call is time spent waiting for the network/server
+        return 'io_wait' if 'poll' in funcname or 'select' in funcname else 'builtins'
+    if filename.startswith('<frozen'): # importlib machinery
+        return 'stdlib'
+    path = os.path.abspath(filename)
+    parts = path.split(os.sep)
+    for group, packages in _PACKAGE_GROUPS:
+        if any(package in parts for package in packages):
+            return group
+    if 'site-packages' in parts or 'dist-packages' in parts:
+        return 'other_packages'
+    if path.startswith(_STDLIB):
+        return 'asyncio' if 'asyncio' in parts else 'stdlib'
+    if path.startswith(_REPO_ROOT):
+        return 'middleware'
+    return 'other'
+
+
+class _ImportTimer:
+    """Times first-time module imports through builtins.__import__ (self and cumulative time)."""
+    def __init__(self, on_import):
+        self._on_import = on_import
+        self._original = None
+        self._local = threading.local()
+
+    def install(self) -> None:
+        self._original = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self) -> None:
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules: # Relative or already loaded: nothing to time
+            return self._original(name, globals, locals, fromlist, level)
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(0.0) # Time of nested imports
+        started = time.perf_counter()
+        try:
+            return self._original(name, globals, locals, fromlist, level)
+        finally:
+            ended = time.perf_counter()
+            nested = stack.pop()
+            if stack:
+                stack[-1] += ended - started
+            self._on_import(name, started, ended, ended - started - nested, len(stack))
+
+
+class Profiler:
+    """Captures a profile of everything between start() and stop() (see the module docstring)."""
+    def __init__(self, out_dir: str, trace_allocations: Optional[bool] = None):
+        self.out_dir = out_dir
+        self.trace_allocations = TRACE_ALLOCATIONS if trace_allocations is None else trace_allocations
+        self._lock = threading.Lock()
+        self._profile = cProfile.Profile()
+        self._imports = _ImportTimer(self._on_import)
+        self._events: List[Dict[str, Any]] = []
+        self._import_times: List[Tuple[str, float, float, int]] = [] # (module, self, cumulative, depth)
+        self._span_totals: Dict[str, List[float]] = {} # name -> [count, seconds]
+        self._started = 0.0
+        self._started_tracemalloc = False
+
+    def _event(self, name: str, category: str, started: float, ended: float, args: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return {
+            'name': name, 'cat': category, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+            'ts': round((started - self._started) * 1e6, 1), 'dur': round((ended - started) * 1e6, 1),
+            'args': args or {},
+        }
+
+    def _on_span(self, name: str, started: float, ended: float, request: Optional[metrics.RequestMetrics]) -> None:
+        args = {'request_id': request.request_id} if request is not None else None
+        event = self._event(name, 'stage', started, ended, args)
+        with self._lock:
+            self._events.append(event)
+            totals = self._span_totals.setdefault(name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += ended - started
+
+    def _on_import(self, module: str, started: float, ended: float, self_seconds: float, depth: int) -> None:
+        with self._lock:
+            self._import_times.append((module, self_seconds, ended - started, depth))
+            if ended - started >= MIN_TRACED_IMPORT_SECONDS:
+                self._events.append(self._event(f"import {module}", 'import', started, ended))
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        if self.trace_allocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            tracemalloc.reset_peak()
+        metrics.set_span_listener(self._on_span)
+        self._imports.install()
+        self._profile.enable()
+
+    def stop(self) -> None:
+        """Stops capturing, writes the profile files and prints a short summary to stderr."""
+        self._profile.disable()
+        self._imports.uninstall()
+        metrics.set_span_listener(None)
+        elapsed = time.perf_counter() - self._started
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        if self.trace_allocations:
+            current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            top_sites = tracemalloc.take_snapshot().statistics('lineno')[:TOP_ALLOCATIONS]
+            memory = f"tracemalloc peak {peak_bytes / 1e6:.1f} MB (current {current_bytes / 1e6:.1f} MB), "
+        else:
+            top_sites = []
+            memory = ""
+        memory += f"peak RSS {peak_rss / 1e6:.1f} MB"
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        self._profile.dump_stats(os.path.join(self.out_dir, 'profile.pstats'))
+        with open(os.path.join(self.out_dir, 'trace.json'), 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': self._events, 'displayTimeUnit': 'ms'}, f)
+
+        by_package = self._time_by_package()
+        lines = [f"Profiled {elapsed:.3f}s; {memory}.", ""]
+        lines.append("Profiled time by package (tottime):")
+        total = sum(by_package.values()) or 1.0
+        for group, seconds in sorted(by_package.items(), key=lambda item: -item[1]):
+            lines.append(f"  {group:<16} {seconds:9.4f}s  {100 * seconds / total:5.1f}%")
+        lines += ["", "Spans (count, total):"]
+        for name, (count, seconds) in sorted(self._span_totals.items(), key=lambda item: -item[1][1]):
+            lines.append(f"  {name:<16} {count:6d}  {seconds:9.4f}s")
+        lines += ["", "Imports after the profile started (cumulative, self):"]
+        for module, self_seconds, cumulative, depth in sorted(self._import_times, key=lambda item: -item[2])[:25]:
+            lines.append(f"  {'  ' * min(depth, 4)}{module:<40} {cumulative * 1000:9.1f} ms {self_seconds * 1000:9.1f} ms")
+        if top_sites:
+            lines += ["", f"Top {TOP_ALLOCATIONS} allocation sites still held at the end:"]
+        for stat in top_sites:
+            lines.append(f"  {stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {stat.traceback[0]}")
+        with open(os.path.join(self.out_dir, 'summary.txt'), 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+
+        shares = ", ".join(f"{group} {100 * seconds / total:.0f}%"
+                           for group, seconds in sorted(by_package.items(), key=lambda item: -item[1])[:5])
+        print(f"Info: Profile written to {self.out_dir} (profile.pstats, trace.json, summary.txt): "
+              f"{elapsed:.2f}s, {memory}; {shares}.", file=sys.stderr)
+
+    def _time_by_package(self) -> Dict[str, float]:
+        stats = pstats.Stats(self._profile)
+        by_package: Dict[str, float] = {}
+        for (filename, _, funcname), (_, _, tottime, cumtime, _) in stats.stats.items():
+            group = _package_group(filename, funcname)
+            # Frames interleaved across threads can leave an entry with more own time than total
+            # time (e.g. the loop runner while a worker thread imports); its total bounds it
+            by_package[group] = by_package.get(group, 0.0) + min(tottime, cumtime)
+        return by_package
@@ -0,0 +1,235 @@
+# prompt_budget.py
+"""
+Prompt compaction against a per-target token budget.
+Before a prompt is rendered, OS-specific example sections (<linux-examples>,
+<windows-examples>, ...) that do not apply to the request's operating system are
+removed from the template, and an oversized msg (typically a pasted log) is
+shrunk to fit what is left of the budget: repeated lines are collapsed and the
+head and tail are kept, since errors usually sit at the end of a log.
+
+The request's OS is the one a template fixes in its text ('Operating System: MacOS',
+for instructions written for one OS), else the one the msg states ('OS: Windows'),
+else DEFAULT_OS for templates with an {os} placeholder, which renders it (os_label).
+
+Tokens are counted with litellm's tokenizer for the target model when litellm is
+already loaded (daemon, batch); otherwise (a fresh CLI process, which may never
+need litellm if the response is cached) a characters-per-token estimate is used.
+"""
+import re
+import sys
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import llm_config # Per-target prompt budgets
+import prompt_registry # Compiled templates
+
+# Characters per token of the fallback estimate (close for English prose and shell commands)
+CHARS_PER_TOKEN = 4
+# Share of a trimmed msg kept from its beginning (the rest comes from its end)
+HEAD_SHARE = 0.35
+
+_EXAMPLES_SECTION_RE = re.compile(r'<(?P<os>[a-z]+)-examples>.*?</(?P=os)-examples>[ \t]*\n?', re.DOTALL | re.IGNORECASE)
+_DECLARED_OS_RE = re.compile(r'\b(?:operating system|os)\s*[:=]\s*([a-z]+)', re.IGNORECASE)
+_OS_NAMES = {
+    'macos': 'macos', 'mac': 'macos', 'osx': 'macos', 'darwin': 'macos',
+    'linux': 'linux', 'ubuntu': 'linux', 'debian': 'linux', 'centos': 'linux', 'rhel': 'linux',
+    'fedora': 'linux', 'amazon': 'linux', 'suse': 'linux',
+    'windows': 'windows', 'win': 'windows',
+}
+# OS of templates with an {os} placeholder when the msg states none
+DEFAULT_OS = 'macos'
+# How an OS is written into a template's {os} placeholder
+OS_LABELS = {'macos': 'MacOS', 'linux': 'Linux', 'windows': 'Windows'}
+# Example sections worth sending per OS (MacOS has none of its own; the Linux shell steps are closest)
+_RELEVANT_EXAMPLES = {
+    'macos': ('macos', 'linux'),
+    'linux': ('linux',),
+    'windows': ('windows',),
+}
+
+
+def _litellm_if_loaded():
+    """litellm if something in this process already imported it (never triggers the import)."""
+    return sys.modules.get('litellm')
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> Tuple[int, bool]:
+    """
+    Counts the tokens of text for model.
+
+    Returns:
+        (token count, True if exact) - the count is an estimate when litellm is not loaded.
+    """
+    litellm = _litellm_if_loaded()
+    if litellm is not None and model:
+        try:
+            return litellm.token_counter(model=model, text=text), True
+        except Exception:
+            pass # Unknown model/tokenizer: fall back to the estimate
+    return -(-len(text) // CHARS_PER_TOKEN), False
+
+
+@lru_cache(maxsize=256)
+def _declared_os(text: str) -> Optional[str]:
+    match = _DECLARED_OS_RE.search(text)
+    if match and match.group(1).lower() in _OS_NAMES:
+        return _OS_NAMES[match.group(1).lower()]
+    return None
+
+
+def stated_os(msg: Optional[str]) -> Optional[str]:
+    """The OS a msg states ('OS: Windows'), or None."""
+    if not msg:
+        return None
+    match = _DECLARED_OS_RE.search(msg)
+    if match and match.group(1).lower() in _OS_NAMES:
+        return _OS_NAMES[match.group(1).lower()]
+    return None
+
+
+def template_os(template: prompt_registry.CompiledTemplate) -> Optional[str]:
+    """The OS a template's own text declares ('Operating System: MacOS'), fixed for all its requests; or None."""
+    return _declared_os(template.text) # Templates are few and fixed: memoized
+
+
+def request_os(template: prompt_registry.CompiledTemplate, msg: Optional[str]) -> Optional[str]:
+    """
+    The OS a request to template is for: fixed by the template, else stated in msg,
+    else DEFAULT_OS if the template renders an {os} placeholder, else None (unknown).
+    """
+    fixed = template_os(template)
+    if fixed is not None:
+        return fixed
+    stated = stated_os(msg)
+    if stated is not None:
+        return stated
+    return DEFAULT_OS if 'os' in template.fields else None
+
+
+def os_label(template: prompt_registry.CompiledTemplate, msg: Optional[str]) -> str:
+    """The value of template's {os} placeholder for a request with msg."""
+    os_name = request_os(template, msg) or DEFAULT_OS
+    return OS_LABELS.get(os_name, os_name)
+
+
+@lru_cache(maxsize=256)
+def _without_foreign_examples(template: prompt_registry.CompiledTemplate, os_name: str) -> prompt_registry.CompiledTemplate:
+    relevant = _RELEVANT_EXAMPLES.get(os_name, (os_name,))
+    def keep(match: re.Match) -> str:
+        return match.group(0) if match.group('os').lower() in relevant else ""
+    text = _EXAMPLES_SECTION_RE.sub(keep, template.text)
+    if text == template.text:
+        return template
+    return prompt_registry.CompiledTemplate(template.name, text)
+
+
+def select_sections(template: prompt_registry.CompiledTemplate, msg: Optional[str]) -> prompt_registry.CompiledTemplate:
+    """The template without example sections for other operating systems (memoized per template and OS)."""
+    os_name = request_os(template, msg)
+    if os_name is None:
+        return template
+    return _without_foreign_examples(template, os_name)
+
+
+def _collapse_repeats(text: str) -> str:
+    """Replaces runs of identical consecutive lines with one line and a repeat count."""
+    lines = text.splitlines()
+    out = []
+    i = 0
+    while i < len(lines):
+        j = i
+        while j + 1 < len(lines) and lines[j + 1] == lines[i]:
+            j += 1
+        out.append(lines[i] if j == i else f"{lines[i]}  [repeated {j - i + 1} times]")
+        i = j + 1
+    return "\n".join(out)
+
+
+def _fits(text: str, max_tokens: int, model: Optional[str]) -> bool:
+    # Tokenizing a huge log exactly is slow; nothing packs 8x the estimate's characters into a token
+    if len(text) > max_tokens * CHARS_PER_TOKEN * 8:
+        return False
+    return count_tokens(text, model)[0] <= max_tokens
+
+
+def omission_marker(omitted_chars: int, omitted_lines: Optional[int] = None) -> str:
+    """The line standing in for the omitted middle of a trimmed msg."""
+    lines = f"{omitted_lines} lines / " if omitted_lines is not None else ""
+    return f"\n... [{lines}~{-(-omitted_chars // CHARS_PER_TOKEN)} tokens omitted] ...\n"
+
+
+def _head_and_tail(text: str, keep_chars: int) -> str:
+    """About keep_chars of text: its head and tail (whole lines where possible) around an omission marker."""
+    head_chars = int(keep_chars * HEAD_SHARE)
+    tail_chars = keep_chars - head_chars
+    head = text[:head_chars]
+    tail = text[len(text) - tail_chars:] if tail_chars else ""
+    # Prefer line boundaries unless that would drop most of the kept part
+    cut = head.rfind("\n")
+    if cut > head_chars // 2:
+        head = head[:cut]
+    cut = tail.find("\n")
+    if 0 <= cut < tail_chars // 2:
+        tail = tail[cut + 1:]
+    omitted = len(text) - len(head) - len(tail)
+    omitted_lines = text.count("\n", len(head), len(text) - len(tail))
+    return f"{head}{omission_marker(omitted, omitted_lines)}{tail}"
+
+
+def trim_text(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """
+    Shrinks text to at most max_tokens: collapses repeated lines, then keeps its head
+    and tail around an omission marker.
+    """
+    if _fits(text, max_tokens, model):
+        return text
+    text = _collapse_repeats(text)
+    if _fits(text, max_tokens, model):
+        return text
+    keep_chars = max_tokens * CHARS_PER_TOKEN - 64 # Room for the marker
+    trimmed = text
+    for _ in range(4): # Only the (small) trimmed text is tokenized; shrink until it fits
+        trimmed = _head_and_tail(text, max(0, keep_chars))
+        tokens, _ = count_tokens(trimmed, model)
+        if tokens <= max_tokens:
+            break
+        keep_chars = int(keep_chars * max_tokens / tokens * 0.95)
+    return trimmed
+
+
+def budget_for(target: Optional[str]) -> Optional[int]:
+    """Prompt token budget of a target ('auto': the smallest configured one); None if unlimited."""
+    if target is None:
+        return None
+    if target == 'auto':
+        budgets = [llm_config.prompt_token_budget(name) for name in llm_config.available_targets()
+                   if llm_config.is_target_configured(name)]
+        budgets = [budget for budget in budgets if budget]
+        return min(budgets) if budgets else None
+    return llm_config.prompt_token_budget(target)
+
+
+def model_for(target: Optional[str]) -> Optional[str]:
+    """Model whose tokenizer counts the prompt (None for 'auto' or unknown targets)."""
+    return llm_config.model_name(target) if target and target != 'auto' else None
+
+
+def fit_msg(template: prompt_registry.CompiledTemplate, values: dict, budget: Optional[int],
+            model: Optional[str]) -> Optional[str]:
+    """
+    The msg value trimmed so that the rendered prompt fits budget (unchanged if it already fits).
+
+    Args:
+        template: The template the prompt is rendered from.
+        values: The render values, including 'msg'.
+        budget: Prompt token budget (None: no limit).
+        model: Model whose tokenizer counts the tokens.
+    """
+    msg = values.get('msg')
+    if budget is None or not msg or 'msg' not in template.fields:
+        return msg
+    fixed, _ = count_tokens(template.render(**dict(values, msg="")), model)
+    msg_budget = budget - fixed
+    if msg_budget <= 0:
+        return msg # The template alone exceeds the budget; the caller reports it
+    return trim_text(msg, msg_budget, model)
@@ -0,0 +1,134 @@
+# prompt_registry.py
+"""
+Prompt registry compiled once at import time.
+Discovers the OPERATION_PRODUCT prompt constants in llm_prompt (convention over
+configuration), pre-splits every template into literal/placeholder parts for fast
+rendering, and normalizes lookup keys through a memoized cleaner with alias support.
+Rendered prompts are split at their <input_context> block into a static system part
+and the request-specific user part (split_prompt).
+"""
+import re
+import string
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import llm_prompt
+
+# Start of the request-specific part of every template (everything before it is static)
+CONTEXT_MARKER = '<input_context>'
+
+# Mode templates in llm_prompt (everything else uppercase is an OPERATION_PRODUCT prompt)
+MODE_TEMPLATE_NAMES = {'fix': 'FIX', 'chat': 'CHAT'}
+
+# Alternative spellings mapped to their canonical names (both sides are normalized at import)
+OPERATION_ALIASES = {
+    "setup": "install",
+    "add": "install",
+    "remove": "uninstall",
+    "delete": "uninstall",
+    "update": "upgrade",
+}
+PRODUCT_ALIASES = {
+    "otel collector": "splunk-otel-collector",
+    "otel-collector": "splunk-otel-collector",
+    "splunk otel": "splunk-otel-collector",
+    "splunk opentelemetry collector": "splunk-otel-collector",
+    "splunk-otel": "splunk-otel-collector",
+}
+
+_CONSTANT_NAME_RE = re.compile(r'^[A-Z][A-Z0-9_]*$')
+_NON_WORD_RE = re.compile(r'\W+')
+_UNDERSCORES_RE = re.compile(r'_+')
+
+
+class CompiledTemplate:
+    """A prompt template pre-split into literal text and placeholder names."""
+    __slots__ = ('name', 'text', '_parts', '_simple')
+
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.text = text
+        self._parts: List[Tuple[str, Optional[str]]] = []
+        self._simple = True
+        for literal, field, spec, conversion in string.Formatter().parse(text):
+            if field is not None and (spec or conversion or not field.isidentifier()):
+                self._simple = False # Needs the full str.format machinery
+            self._parts.append((literal, field))
+
+    @property
+    def fields(self) -> List[str]:
+        """Placeholder names used by the template, in order of appearance."""
+        return [field for _, field in self._parts if field is not None]
+
+    def render(self, **values: str) -> str:
+        """
+        Fills in the placeholders. Behaves like str.format (including KeyError on a missing key).
+        """
+        if not self._simple:
+            return self.text.format(**values)
+        out = []
+        for literal, field in self._parts:
+            out.append(literal)
+            if field is not None:
+                out.append(str(values[field]))
+        return "".join(out)
+
+
+@lru_cache(maxsize=4096)
+def _clean(part: str) -> str:
+    part = part.strip().upper()
+    part = _NON_WORD_RE.sub('_', part) # Replace one or more non-alphanumeric with _
+    part = _UNDERSCORES_RE.sub('_', part) # Collapse multiple underscores
+    return part.strip('_') # Remove leading/trailing underscores
+
+_OPERATION_ALIAS_KEYS = {_clean(alias): _clean(name) for alias, name in OPERATION_ALIASES.items()}
+_PRODUCT_ALIAS_KEYS = {_clean(alias): _clean(name) for alias, name in PRODUCT_ALIASES.items()}
+
+def clean_key_part(part: str) -> str:
+    """Cleans string for use in dictionary keys (uppercase, replace non-alphanum with _)."""
+    return _clean(part)
+
+@lru_cache(maxsize=4096)
+def normalize_operation(operation: str) -> str:
+    """Cleaned operation key with aliases resolved (e.g. 'setup' -> 'INSTALL')."""
+    key = _clean(operation)
+    return _OPERATION_ALIAS_KEYS.get(key, key)
+
+@lru_cache(maxsize=4096)
+def normalize_product(product: str) -> str:
+    """Cleaned product key with aliases resolved (e.g. 'otel collector' -> 'SPLUNK_OTEL_COLLECTOR')."""
+    key = _clean(product)
+    return _PRODUCT_ALIAS_KEYS.get(key, key)
+
+
+def _discover() -> Tuple[Dict[str, CompiledTemplate], Dict[Tuple[str, str], CompiledTemplate]]:
+    """Compiles the mode templates and every OPERATION_PRODUCT constant in llm_prompt."""
+    mode_names = set(MODE_TEMPLATE_NAMES.values())
+    mode_templates = {mode: CompiledTemplate(name, getattr(llm_prompt, name))
+                      for mode, name in MODE_TEMPLATE_NAMES.items()}
+    execute_templates = {}
+    for name, value in vars(llm_prompt).items():
+        if name in mode_names or not isinstance(value, str) or not _CONSTANT_NAME_RE.match(name):
+            continue
+        operation, _, product = name.partition('_')
+        if product:
+            execute_templates[(operation, product)] = CompiledTemplate(name, value)
+    return mode_templates, execute_templates
+
+MODE_TEMPLATES, EXECUTE_TEMPLATES = _discover()
+
+
+def lookup_execute(operation: str, product: str) -> Optional[CompiledTemplate]:
+    """Returns the specific execute-mode template for (operation, product), or None."""
+    return EXECUTE_TEMPLATES.get((normalize_operation(operation), normalize_product(product)))
+
+
+def split_prompt(prompt: str) -> Tuple[str, str]:
+    """
+    Splits a rendered prompt into (static instructions, request context) at its
+    <input_context> block. Returns ("", prompt) if there is no static part.
+    """
+    index = prompt.find(CONTEXT_MARKER)
+    if index < 0:
+        return "", prompt
+    return prompt[:index].strip(), prompt[index:].strip()
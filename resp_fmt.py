@@ -2,9 +2,165 @@
 """
 Formats the response from the chat model, extracting code blocks
 (both triple-backtick fenced blocks and single-backtick inline code).
+Blocks can be parsed from a full response into CodeBlock records
+(parse_code_blocks, deduplicated by dedupe_code_blocks), extracted as raw
+strings (extract_code_blocks) or incrementally while the response streams
+(StreamingCodeBlockExtractor).
 """
 import re
-from typing import List # <<< Ensure List is imported
+import json
+from typing import List, Iterable, Iterator, Optional, Dict, Any # <<< Ensure List is imported
+
+# Pattern for triple-backtick blocks (captures block in group 1)
+# Made final \n optional and added optional whitespace before closing ```
+_TRIPLE_TICK_PATTERN = r"(```(\w+)?\s*\n(.*?)\n?\s*```)"
+# Pattern for single-backtick inline code (captures span in group 4)
+# Looks for non-backtick, non-newline characters between single backticks
+# to target single-line commands primarily.
+_SINGLE_TICK_PATTERN = r"(`([^`\n]+?)`)" # Group 4 is the whole match, Group 5 is content
+# Combined pattern using alternation (|), compiled once.
+# It will try to match the triple_tick_pattern first, then the single_tick_pattern.
+_CODE_BLOCK_RE = re.compile(f"{_TRIPLE_TICK_PATTERN}|{_SINGLE_TICK_PATTERN}", re.DOTALL)
+
+# Parts of an opening fence header (```lang<ws>), scanned piecewise by _FenceHeader
+_WORD_RE = re.compile(r"\w*")
+_SPACE_RE = re.compile(r"\s*")
+
+class CodeBlock:
+    """One fenced block or inline span of a response, with its position in the response text."""
+    __slots__ = ('kind', 'language', 'body', 'start', 'end', 'raw')
+
+    FENCED = 'fenced'
+    INLINE = 'inline'
+
+    def __init__(self, kind: str, language: Optional[str], body: str, start: int, end: int, raw: str):
+        self.kind = kind # FENCED or INLINE
+        self.language = language # Fence info string (e.g. 'bash'); None for inline spans and bare fences
+        self.body = body # Content without backticks/language line
+        self.start = start # Offsets of raw in the response text (raw == text[start:end])
+        self.end = end
+        self.raw = raw # The matched text including backticks
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'kind': self.kind, 'language': self.language, 'body': self.body, 'start': self.start, 'end': self.end}
+
+    def __repr__(self) -> str:
+        return f"CodeBlock({self.kind}, {self.language!r}, {self.body!r}, {self.start}, {self.end})"
+
+
+class _FenceSearch:
+    """
+    Memo of the last search for a closing fence, so consecutive unclosed fences do not
+    each rescan the rest of the text. scan_from lets a caller skip text it already
+    knows contains no closing fence.
+    """
+    __slots__ = ('searched_from', 'found_at', 'scan_from')
+
+    def __init__(self, scan_from: int = 0):
+        self.searched_from = -1
+        self.found_at = -1
+        self.scan_from = scan_from
+
+    def next_fence(self, text: str, start: int) -> int:
+        """Position of the first ``` at or after start, or -1."""
+        if not (self.searched_from != -1 and self.searched_from <= start
+                and (self.found_at == -1 or start <= self.found_at)):
+            self.searched_from = start
+            self.found_at = text.find("```", max(start, self.scan_from))
+        return self.found_at
+
+
+class _FenceHeader:
+    """
+    Scan of an opening fence header: ```, the language (\\w*), then whitespace, whose
+    last newline starts the body. The streaming extractor keeps it for a fence whose
+    header is still arriving, so each feed only scans the text appended since the last.
+    """
+    __slots__ = ('start', 'language_end', 'end', 'newline', 'language_done')
+
+    def __init__(self, start: int):
+        self.start = start
+        self.language_end = start + 3
+        self.end = start + 3 # End of the whitespace after the language
+        self.newline = -1 # Last newline in that whitespace, or -1
+        self.language_done = False
+
+    def scan(self, text: str) -> '_FenceHeader':
+        """Extends the scan over the text appended since the previous call."""
+        if not self.language_done:
+            self.language_end = self.end = _WORD_RE.match(text, self.language_end).end()
+            if self.language_end == len(text):
+                return self # The language may go on in the next chunk
+            self.language_done = True
+        end = _SPACE_RE.match(text, self.end).end()
+        newline = text.rfind("\n", self.end, end)
+        if newline != -1:
+            self.newline = newline
+        self.end = end
+        return self
+
+    def shift(self, offset: int) -> None:
+        """Moves the scanned positions by offset (the text before the fence was dropped)."""
+        self.start += offset
+        self.language_end += offset
+        self.end += offset
+        if self.newline != -1:
+            self.newline += offset
+
+
+def _block_at(text: str, pos: int, fences: _FenceSearch, header: Optional[_FenceHeader] = None,
+              inline_from: int = 0) -> Optional[CodeBlock]:
+    """
+    The block _CODE_BLOCK_RE would match at the backtick at pos, or None.
+    header continues an earlier scan of a fence header at pos; inline_from is a position
+    before which text after pos is known to hold no backtick or newline.
+    """
+    if text.startswith("```", pos):
+        header = (header or _FenceHeader(pos)).scan(text)
+        if header.newline == -1:
+            return None
+        body_start = header.newline + 1
+        fence_at = fences.next_fence(text, body_start)
+        if fence_at == -1:
+            return None
+        body_end = fence_at
+        while body_end > body_start and text[body_end - 1].isspace():
+            body_end -= 1
+        end = fence_at + 3
+        language = text[pos + 3:header.language_end] or None
+        return CodeBlock(CodeBlock.FENCED, language, text[body_start:body_end], pos, end, text[pos:end])
+    scan_from = max(pos + 1, inline_from)
+    close = text.find("`", scan_from)
+    if close > pos + 1 and text.find("\n", scan_from, close) == -1:
+        return CodeBlock(CodeBlock.INLINE, None, text[pos + 1:close], pos, close + 1, text[pos:close + 1])
+    return None
+
+
+def parse_code_blocks(response_text: str) -> List[CodeBlock]:
+    """
+    Parses fenced blocks and inline spans in one left-to-right pass.
+    Matches exactly what _CODE_BLOCK_RE.finditer would, but each character is looked
+    at a bounded number of times, so unclosed fences or long whitespace runs cannot
+    make it quadratic (as they can with the regex's lazy body).
+
+    Args:
+        response_text: The raw text response from the chat model.
+
+    Returns:
+        The blocks in order of appearance (empty if there are none).
+    """
+    blocks: List[CodeBlock] = []
+    fences = _FenceSearch()
+    pos = response_text.find("`")
+    while pos != -1:
+        block = _block_at(response_text, pos, fences)
+        if block is not None:
+            blocks.append(block)
+            pos = response_text.find("`", block.end)
+        else:
+            pos = response_text.find("`", pos + 1)
+    return blocks
+
 
 def extract_code_blocks(response_text: str) -> list[str]:
     """
@@ -18,33 +174,157 @@ def extract_code_blocks(response_text: str) -> list[str]:
         A list of strings, where each string is a matched code block/span
         (including the backticks). Returns an empty list if none found.
     """
-    # Pattern for triple-backtick blocks (captures block in group 1)
-    # Made final \n optional and added optional whitespace before closing ```
-    triple_tick_pattern = r"(```(\w+)?\s*\n(.*?)\n?\s*```)"
+    return [block.raw for block in parse_code_blocks(response_text)]
+
+
+def _command_key(text: str) -> str:
+    """Comparison form of a command: whitespace collapsed and a leading shell prompt removed."""
+    text = " ".join(text.split())
+    return text[2:] if text.startswith("$ ") else text
+
+
+def dedupe_code_blocks(blocks: List[CodeBlock]) -> List[CodeBlock]:
+    """
+    Drops repeated blocks, keeping the first occurrence: fenced blocks with the same
+    language and body, and inline spans that repeat another span or a fenced block
+    (or one of its lines), e.g. `brew install curl` after a fence containing it.
+    """
+    fenced_commands = set()
+    for block in blocks:
+        if block.kind == CodeBlock.FENCED:
+            fenced_commands.add(_command_key(block.body))
+            fenced_commands.update(_command_key(line) for line in block.body.splitlines())
+    seen = set()
+    unique: List[CodeBlock] = []
+    for block in blocks:
+        command = _command_key(block.body)
+        if block.kind == CodeBlock.FENCED:
+            key = (block.kind, block.language, command)
+        else:
+            if command in fenced_commands:
+                continue
+            key = (block.kind, command)
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(block)
+    return unique
+
+
+def from_raw_blocks(raw_blocks: Iterable[str]) -> List[CodeBlock]:
+    """
+    Lifts blocks that were extracted as strings (e.g. while streaming) into CodeBlock records.
+    Offsets are relative to each block, since the surrounding text is not known.
+    """
+    blocks: List[CodeBlock] = []
+    for raw in raw_blocks:
+        blocks.extend(parse_code_blocks(raw)[:1])
+    return blocks
+
+
+def code_blocks_to_json(blocks: List[CodeBlock], **extra: Any) -> str:
+    """Serializes blocks (plus any extra top-level fields) as one JSON document."""
+    return json.dumps({**extra, 'count': len(blocks), 'blocks': [block.to_dict() for block in blocks]},
+                      ensure_ascii=False)
+
+class StreamingCodeBlockExtractor:
+    """
+    Incremental counterpart of extract_code_blocks for streamed responses.
+
+    Feed response chunks as they arrive; each fenced block or inline span is
+    returned as soon as its closing backticks have been received. Only the
+    unfinished tail of the text (from the earliest backtick that could still
+    open a block) is kept in memory. Concatenating the results of all feed()
+    calls and close() gives exactly extract_code_blocks(full_response).
+    """
+    def __init__(self):
+        self._buffer = ""
+        self._fence_scan_from = 0 # The buffer holds no closing fence before this position
+        # What earlier feeds learned about the unfinished block at the start of the buffer, so
+        # a long fence header or inline span is scanned once instead of again on every feed
+        self._header: Optional[_FenceHeader] = None # Scan of its fence header
+        self._inline_scan_from = 0 # Its inline span holds no backtick or newline before this position
+
+    @staticmethod
+    def _may_still_match(text: str, pos: int, header: Optional[_FenceHeader], inline_from: int) -> bool:
+        """
+        True if a block starting at the backtick at `pos` could still be completed by more text
+        (header: the fence header at pos as scanned by _block_at; inline_from as for _block_at).
+        """
+        tail = text[pos:pos + 3]
+        if len(tail) < 3 and "```".startswith(tail):
+            return True # Could still become a fence
+        if header is not None:
+            if header.end == len(text) or header.newline != -1:
+                return True # Header still streaming, or fence opened and awaiting its close
+        # Inline span: open as long as no newline or backtick has ended it
+        scan_from = max(pos + 1, inline_from)
+        return text.find("`", scan_from) == -1 and text.find("\n", scan_from) == -1
 
-    # Pattern for single-backtick inline code (captures span in group 4)
-    # Looks for non-backtick, non-newline characters between single backticks
-    # to target single-line commands primarily.
-    single_tick_pattern = r"(`([^`\n]+?)`)" # Group 4 is the whole match, Group 5 is content
+    def feed(self, chunk: str) -> List[str]:
+        """
+        Consumes the next response chunk.
 
-    # Combined pattern using alternation (|)
-    # It will try to match the triple_tick_pattern first, then the single_tick_pattern.
-    combined_pattern = f"{triple_tick_pattern}|{single_tick_pattern}"
+        Returns:
+            The code blocks/spans (including backticks) completed by this chunk, in order.
+        """
+        buffer, self._buffer = self._buffer, ""
+        buffer += chunk # Local and unshared, so CPython can usually extend it in place
+        self._buffer = buffer
+        completed = []
+        # Only a block left open at the start of the buffer by the previous chunk has known scan results
+        fences = _FenceSearch(self._fence_scan_from)
+        pending_header, self._header = self._header, None
+        inline_from, self._inline_scan_from = self._inline_scan_from, 0
+        header: Optional[_FenceHeader] = None
+        held = False
+        pos = self._buffer.find("`")
+        while pos != -1:
+            if pos > 0:
+                fences.scan_from = 0
+                pending_header = None
+                inline_from = 0
+            header = None
+            if self._buffer.startswith("```", pos):
+                header = pending_header or _FenceHeader(pos)
+            block = _block_at(self._buffer, pos, fences, header, inline_from)
+            if block is not None:
+                completed.append(block.raw)
+                pos = self._buffer.find("`", block.end)
+            elif self._may_still_match(self._buffer, pos, header, inline_from):
+                held = True
+                break # An earlier block is still open and would take precedence; wait for more text
+            else:
+                pos = self._buffer.find("`", pos + 1)
+        if pos == -1:
+            pos = len(self._buffer)
+        self._buffer = self._buffer[pos:] # Keep only the unfinished tail
+        # A closing fence may straddle the next chunk, so its first two characters are rescanned
+        self._fence_scan_from = max(0, len(self._buffer) - 2)
+        if held and header is not None:
+            header.shift(-pos)
+            self._header = header
+        elif held and not "```".startswith(self._buffer[:3]):
+            self._inline_scan_from = len(self._buffer) # Open inline span: nothing has ended it yet
+        return completed
 
-    formatted_blocks = []
-    # Use finditer with the combined pattern and DOTALL for the triple-tick part
-    for match_obj in re.finditer(combined_pattern, response_text, re.DOTALL):
-        # Add the entire matched string (group 0), whether it was triple or single ticks
-        formatted_blocks.append(match_obj.group(0))
+    def close(self) -> List[str]:
+        """Flushes the stream end; returns blocks that could only be resolved once no more text follows."""
+        remaining = extract_code_blocks(self._buffer)
+        self._buffer = ""
+        self._fence_scan_from = 0
+        self._header = None
+        self._inline_scan_from = 0
+        return remaining
 
-    # Debugging print (optional: remove after confirming fix)
-    # if not formatted_blocks and ("```" in response_text or "`" in response_text):
-    #    print(f"Debug: No blocks found by combined regex. Raw text contained backticks:\n---\n{response_text}\n---", file=sys.stderr)
-    # elif formatted_blocks:
-    #    print(f"Debug: Found blocks/spans: {formatted_blocks}", file=sys.stderr)
 
+def iter_code_blocks(chunks: Iterable[str]) -> Iterator[str]:
+    """Yields code blocks from a chunk stream as soon as each one is complete."""
+    extractor = StreamingCodeBlockExtractor()
+    for chunk in chunks:
+        yield from extractor.feed(chunk)
+    yield from extractor.close()
 
-    return formatted_blocks
 
 def format_code_blocks_for_display(code_blocks: List[str]) -> str:
     """
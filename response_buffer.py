@@ -0,0 +1,119 @@
+# response_buffer.py
+"""
+Memory-bounded accumulation of a streamed response.
+Responses are streamed token by token; keeping every chunk as its own string costs
+many times the text's size, and a multi-megabyte answer held that way by each of
+many concurrent requests dominates the process's memory. A ResponseBuffer keeps
+the chunks in memory up to SPILL_CHARS characters, then moves the text to an
+anonymous temporary file and appends further chunks there, so memory use stays
+flat however large the answer grows until the full text is requested once.
+Readers (late single-flight subscribers, the response cache) iterate the buffer
+piece by piece instead of copying it.
+"""
+import os
+import codecs
+import tempfile
+import threading
+from typing import Generator, List, Optional, BinaryIO
+
+# Characters kept in memory before a response spills to a temporary file (overridable via environment variable)
+SPILL_CHARS = int(os.environ.get("LLM_RESPONSE_SPILL_CHARS", str(256 * 1024)))
+# Size of the pieces a spilled response is read back in (cache writes, late subscribers)
+PIECE_BYTES = 64 * 1024
+
+
+class ResponseBuffer:
+    """
+    Append-only response text: a chunk list while small, a temporary file past spill_chars.
+    Iterating it yields the text so far without copying it, and may happen on other
+    threads while chunks are appended (single-flight subscribers read the backlog so).
+    """
+    def __init__(self, spill_chars: Optional[int] = None):
+        self.spill_chars = SPILL_CHARS if spill_chars is None else spill_chars
+        self._lock = threading.Lock() # Appends and reads of the file move its position
+        self._chunks: List[str] = []
+        self._chars = 0
+        self._file: Optional[BinaryIO] = None
+        self._file_bytes = 0
+        self._readers = 0 # Iterations in progress; close() leaves the file to the last one
+        self._closing = False
+
+    def __len__(self) -> int:
+        return self._chars
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    def append(self, chunk: str) -> None:
+        with self._lock:
+            self._chars += len(chunk)
+            if self._file is not None:
+                self._write_locked(chunk)
+                return
+            self._chunks.append(chunk)
+            if self._chars > self.spill_chars:
+                self._file = tempfile.TemporaryFile(prefix='llm-response-') # Unlinked at once; removed when closed
+                self._write_locked("".join(self._chunks))
+                self._chunks = [] # A new list: iterations in progress keep reading the old one
+
+    def _write_locked(self, text: str) -> None:
+        data = text.encode('utf-8')
+        self._file.seek(0, os.SEEK_END) # Readers move the position
+        self._file.write(data)
+        self._file_bytes += len(data)
+
+    def __iter__(self) -> Generator[str, None, None]:
+        """
+        Yields the text appended up to now (later appends are not included): the
+        original chunks while in memory, otherwise pieces of about PIECE_BYTES read
+        back from the file one at a time.
+        """
+        with self._lock:
+            if self._file is None:
+                chunks, count = self._chunks, len(self._chunks) # Appends only extend this list past count
+                return (chunks[i] for i in range(count))
+            self._readers += 1
+            end = self._file_bytes
+        return self._iter_file(end)
+
+    def _iter_file(self, end: int) -> Generator[str, None, None]:
+        try:
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            offset = 0
+            while offset < end:
+                with self._lock:
+                    self._file.seek(offset)
+                    data = self._file.read(min(PIECE_BYTES, end - offset))
+                offset += len(data)
+                piece = decoder.decode(data, final=offset >= end)
+                if piece:
+                    yield piece
+        finally:
+            with self._lock:
+                self._readers -= 1
+                if self._closing and not self._readers:
+                    self._release_locked()
+
+    def chunks(self) -> List[str]:
+        """The response as a list of strings (see __iter__)."""
+        return list(self)
+
+    def text(self) -> str:
+        """The full response (materialized once, by the caller that needs it)."""
+        return "".join(self)
+
+    def close(self) -> None:
+        """Releases the temporary file once iterations in progress end (the buffer is empty afterwards)."""
+        with self._lock:
+            self._closing = True
+            if not self._readers:
+                self._release_locked()
+
+    def _release_locked(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._file_bytes = 0
+        self._chunks = []
+        self._chars = 0
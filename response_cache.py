@@ -0,0 +1,203 @@
+# response_cache.py
+"""
+Persistent on-disk cache for LLM responses.
+Entries are keyed by the final prompt plus the target model and api_base,
+expire after a TTL, and are evicted least-recently-used first once the
+cache grows beyond its entry or size bounds.
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional, List, Dict, Any, AsyncIterator, Iterable, Iterator
+
+_DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.llm_cache')
+
+# Defaults can be overridden via environment variables
+DEFAULT_CACHE_PATH = os.path.join(os.environ.get("LLM_CACHE_DIR", _DEFAULT_CACHE_DIR), 'responses.sqlite3')
+DEFAULT_TTL_SECONDS = int(os.environ.get("LLM_CACHE_TTL_SECONDS", 7 * 24 * 60 * 60))
+DEFAULT_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 5000))
+DEFAULT_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# Size of the pieces a response is written into its row in
+_WRITE_BYTES = 64 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    chunks TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL
+)
+"""
+
+
+def make_cache_key(prompt: str, config: Dict[str, Any]) -> str:
+    """
+    Builds the cache key for a prompt sent to a given target configuration.
+
+    Args:
+        prompt: The final rendered prompt string.
+        config: The LLM configuration dictionary for the target.
+
+    Returns:
+        A hex digest identifying the (prompt, model, api_base) combination.
+    """
+    material = json.dumps([prompt, config.get('model'), config.get('api_base')], ensure_ascii=False)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def _json_pieces(chunks: Iterable[str]) -> Iterator[bytes]:
+    """chunks encoded as the JSON list json.dumps(chunks, ensure_ascii=False) would give, piece by piece."""
+    pending = bytearray(b"[")
+    for i, chunk in enumerate(chunks):
+        if i:
+            pending += b", "
+        pending += json.dumps(chunk, ensure_ascii=False).encode('utf-8')
+        if len(pending) >= _WRITE_BYTES:
+            yield bytes(pending)
+            pending.clear()
+    pending += b"]"
+    yield bytes(pending)
+
+
+async def areplay(chunks: List[str]) -> AsyncIterator[str]:
+    """Yields cached chunks one by one, mirroring llm_interface.astream_litellm_response."""
+    for chunk in chunks:
+        yield chunk
+
+
+class ResponseCache:
+    """SQLite-backed response cache with TTL expiry and LRU/size-bounded eviction."""
+    def __init__(self,
+                 path: str = DEFAULT_CACHE_PATH,
+                 ttl_seconds: int = DEFAULT_TTL_SECONDS,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        if not self._initialized:
+            with self._lock:
+                conn.execute(_SCHEMA)
+                conn.commit()
+                self._initialized = True
+        return conn
+
+    def _ensure_dir(self) -> None:
+        cache_dir = os.path.dirname(self.path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """
+        Looks up a cached response.
+
+        Args:
+            key: The cache key from make_cache_key.
+
+        Returns:
+            The list of cached response chunks, or None on a miss or expired entry.
+        """
+        if not os.path.exists(self.path):
+            return None
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT chunks, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                chunks_json, created = row
+                if self.ttl_seconds > 0 and now - created > self.ttl_seconds:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    conn.commit()
+                    return None
+                conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                conn.commit()
+                return json.loads(chunks_json)
+            finally:
+                conn.close()
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Warning: Response cache lookup failed: {e}", file=sys.stderr)
+            return None
+
+    def put(self, key: str, chunks: Iterable[str]) -> None:
+        """
+        Stores a response and evicts expired or least recently used entries.
+
+        Args:
+            key: The cache key from make_cache_key.
+            chunks: The response chunks in the order they were streamed. Iterated twice, to size
+                the row and then to write it piece by piece, so a spilled ResponseBuffer is
+                stored without being read into memory whole.
+        """
+        size = sum(len(piece) for piece in _json_pieces(chunks))
+        if size > self.max_bytes:
+            return # Never cache a single response larger than the whole cache
+        now = time.time()
+        try:
+            self._ensure_dir()
+            conn = self._connect()
+            try:
+                cursor = conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, chunks, size, created, last_access) "
+                    "VALUES (?, zeroblob(?), ?, ?, ?)",
+                    (key, size, size, now, now),
+                )
+                with conn.blobopen('responses', 'chunks', cursor.lastrowid) as blob:
+                    for piece in _json_pieces(chunks):
+                        blob.write(piece)
+                self._evict(conn, now)
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Warning: Response cache store failed: {e}", file=sys.stderr)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        if self.ttl_seconds > 0:
+            conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        # Walk entries from least to most recently used until within bounds
+        to_delete = []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC"):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            to_delete.append((key,))
+            count -= 1
+            total -= size
+        conn.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+
+    def clear(self) -> None:
+        """Removes every cached response."""
+        if not os.path.exists(self.path):
+            return
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+        finally:
+            conn.close()
+
+
+# Lazily instantiated cache (shared by all callers in the process)
+_cache_instance: Optional[ResponseCache] = None
+
+def get_response_cache() -> ResponseCache:
+    """Gets or creates the singleton response cache instance."""
+    global _cache_instance
+    if _cache_instance is None:
+        _cache_instance = ResponseCache()
+    return _cache_instance
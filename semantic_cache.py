@@ -0,0 +1,286 @@
+# semantic_cache.py
+"""
+Second-tier response cache for free-text 'chat' and 'fix' requests.
+The exact cache (response_cache) is keyed on the whole prompt, so two pasted
+errors that differ only in a timestamp, PID or path never share an entry. Here
+the message is normalized (volatile tokens replaced by placeholders, case and
+whitespace folded) and indexed by a MinHash signature of its word shingles;
+locality-sensitive hashing bands find candidate entries and the exact shingle
+Jaccard similarity decides whether a candidate is close enough.
+
+Entries only point at a response_cache key, so the response itself is stored
+once and expires/evicts with the exact cache.
+"""
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import random
+import threading
+from typing import Optional, Dict, Any, List, Tuple, Set
+
+import response_cache # Holds the responses the index points at
+
+# Modes whose msg is free text worth matching approximately
+SEMANTIC_MODES = ('chat', 'fix')
+
+# Defaults can be overridden via environment variables
+ENABLED = os.environ.get("LLM_SEMANTIC_CACHE", "1").lower() not in ('0', 'false', 'no', 'off')
+DEFAULT_THRESHOLD = float(os.environ.get("LLM_SEMANTIC_CACHE_THRESHOLD", "0.8"))
+DEFAULT_PATH = os.path.join(os.path.dirname(response_cache.DEFAULT_CACHE_PATH), 'semantic.sqlite3')
+DEFAULT_MAX_ENTRIES = response_cache.DEFAULT_MAX_ENTRIES
+
+SHINGLE_SIZE = 3 # Words per shingle
+NUM_PERMUTATIONS = 64
+BANDS = 16 # LSH bands of NUM_PERMUTATIONS // BANDS rows each
+_ROWS = NUM_PERMUTATIONS // BANDS
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 64) - 1
+# Fixed seed: signatures must be comparable across processes
+_rng = random.Random(0x5EED)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+_MONTHS = r'(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*'
+# Applied in order to the lower-cased message; earlier patterns win
+_VOLATILE_PATTERNS: List[Tuple[re.Pattern, str]] = [
+    (re.compile(r'\d{4}-\d{2}-\d{2}[t ]\d{1,2}:\d{2}(?::\d{2})?(?:[.,]\d+)?(?:z|[+-]\d{2}:?\d{2})?'), ' <ts> '),
+    (re.compile(_MONTHS + r'\s+\d{1,2}(?:\s+\d{4})?\s+\d{1,2}:\d{2}:\d{2}(?:[.,]\d+)?'), ' <ts> '),
+    (re.compile(r'\b\d{4}[-/]\d{2}[-/]\d{2}\b'), ' <ts> '),
+    (re.compile(r'\b\d{1,2}:\d{2}:\d{2}(?:[.,]\d+)?\b'), ' <ts> '),
+    (re.compile(r'\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b'), ' <id> '),
+    (re.compile(r'\b0x[0-9a-f]+\b'), ' <hex> '),
+    (re.compile(r'\b(?=[0-9a-f]*\d)[0-9a-f]{8,}\b'), ' <hex> '),
+    (re.compile(r'\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b'), ' <ip> '),
+    (re.compile(r'(?<![\w/])(?:~|\.{1,2})?/[\w.@+-]+(?:/[\w.@+-]*)*'), ' <path> '),
+    (re.compile(r'\b[a-z]:\\[^\s"\']*'), ' <path> '),
+    (re.compile(r'\b(pid|process|tid)\b[\s:=#]*\d+'), r' \1 <n> '),
+    (re.compile(r'\[\d+\]'), ' <n> '),
+    (re.compile(r'\b\d{4,}\b'), ' <n> '),
+]
+_TOKEN_RE = re.compile(r'<\w+>|[a-z0-9_]+(?:[.-][a-z0-9_]+)*')
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS semantic_entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        scope TEXT NOT NULL,
+        normalized TEXT NOT NULL,
+        response_key TEXT NOT NULL,
+        created REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS semantic_bands (
+        scope TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        entry_id INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS semantic_bands_lookup ON semantic_bands (scope, bucket)",
+)
+
+
+def normalize_message(msg: str) -> str:
+    """
+    Folds away the parts of a message that differ between otherwise identical requests:
+    case, whitespace, timestamps, hex ids/UUIDs, IP addresses, paths, PIDs and long numbers.
+    """
+    text = msg.lower()
+    for pattern, placeholder in _VOLATILE_PATTERNS:
+        text = pattern.sub(placeholder, text)
+    return " ".join(_TOKEN_RE.findall(text))
+
+
+def shingles(normalized: str) -> Set[str]:
+    """Word SHINGLE_SIZE-grams of a normalized message (the whole message if it is shorter)."""
+    words = normalized.split()
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def minhash(shingle_set: Set[str]) -> List[int]:
+    """MinHash signature (NUM_PERMUTATIONS values) of a shingle set."""
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big') for s in shingle_set]
+    if not hashes:
+        return [_MAX_HASH] * NUM_PERMUTATIONS
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def _band_buckets(signature: List[int]) -> List[str]:
+    """One bucket id per LSH band; messages sharing any bucket are candidates."""
+    buckets = []
+    for band in range(BANDS):
+        rows = signature[band * _ROWS:(band + 1) * _ROWS]
+        digest = hashlib.blake2b(repr(rows).encode('ascii'), digest_size=8).hexdigest()
+        buckets.append(f"{band}:{digest}")
+    return buckets
+
+
+class SemanticQuery:
+    """The parts of a request the semantic cache matches on."""
+    __slots__ = ('product', 'operation', 'mode', 'normalized', 'shingles')
+
+    def __init__(self, product: str, operation: str, mode: str, msg: str):
+        self.product = product.strip().lower()
+        self.operation = operation.strip().lower()
+        self.mode = mode
+        self.normalized = normalize_message(msg)
+        self.shingles = shingles(self.normalized)
+
+    def scope(self, config: Dict[str, Any]) -> str:
+        """Only requests for the same product/operation/mode and model are ever matched."""
+        material = json.dumps([self.product, self.operation, self.mode, config.get('model'), config.get('api_base')])
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def make_query(product: str, operation: str, mode: str, msg: Optional[str]) -> Optional[SemanticQuery]:
+    """Builds the semantic lookup for a request, or None if it is not a chat/fix request with a message."""
+    if not ENABLED or mode not in SEMANTIC_MODES or not msg or not msg.strip():
+        return None
+    query = SemanticQuery(product, operation, mode, msg)
+    return query if query.shingles else None
+
+
+class SemanticIndex:
+    """SQLite-backed MinHash/LSH index from normalized messages to response_cache keys."""
+    def __init__(self,
+                 path: str = DEFAULT_PATH,
+                 threshold: float = DEFAULT_THRESHOLD,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        if not self._initialized:
+            with self._lock:
+                for statement in _SCHEMA:
+                    conn.execute(statement)
+                conn.commit()
+                self._initialized = True
+        return conn
+
+    def lookup(self, query: SemanticQuery, config: Dict[str, Any]) -> Optional[Tuple[str, float]]:
+        """
+        Finds the most similar indexed message in the query's scope.
+
+        Args:
+            query: The request to match (see make_query).
+            config: The LLM configuration dictionary for the target.
+
+        Returns:
+            (response_cache key, similarity) of the best match at or above the threshold, or None.
+        """
+        if not os.path.exists(self.path):
+            return None
+        scope = query.scope(config)
+        buckets = _band_buckets(minhash(query.shingles))
+        try:
+            conn = self._connect()
+            try:
+                placeholders = ",".join("?" * len(buckets))
+                rows = conn.execute(
+                    f"SELECT e.id, e.normalized, e.response_key FROM semantic_entries e WHERE e.id IN "
+                    f"(SELECT entry_id FROM semantic_bands WHERE scope = ? AND bucket IN ({placeholders}))",
+                    (scope, *buckets)).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Warning: Semantic cache lookup failed: {e}", file=sys.stderr)
+            return None
+        best: Optional[Tuple[str, float]] = None
+        for _, normalized, response_key in rows:
+            # Bands only nominate candidates; the exact similarity decides
+            similarity = 1.0 if normalized == query.normalized else jaccard(query.shingles, shingles(normalized))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (response_key, similarity)
+        return best
+
+    def add(self, query: SemanticQuery, config: Dict[str, Any], response_key: str) -> None:
+        """
+        Indexes a request whose response was stored in the response cache under response_key.
+
+        Args:
+            query: The request (see make_query).
+            config: The LLM configuration dictionary for the target.
+            response_key: The response_cache key of the stored response.
+        """
+        scope = query.scope(config)
+        buckets = _band_buckets(minhash(query.shingles))
+        try:
+            cache_dir = os.path.dirname(self.path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            conn = self._connect()
+            try:
+                # One entry per normalized message: a newer response replaces the old pointer
+                self._delete(conn, "scope = ? AND normalized = ?", (scope, query.normalized))
+                entry_id = conn.execute(
+                    "INSERT INTO semantic_entries (scope, normalized, response_key, created) VALUES (?, ?, ?, ?)",
+                    (scope, query.normalized, response_key, time.time())).lastrowid
+                conn.executemany("INSERT INTO semantic_bands (scope, bucket, entry_id) VALUES (?, ?, ?)",
+                                 [(scope, bucket, entry_id) for bucket in buckets])
+                count = conn.execute("SELECT COUNT(*) FROM semantic_entries").fetchone()[0]
+                if count > self.max_entries:
+                    self._delete(conn, "id IN (SELECT id FROM semantic_entries ORDER BY created ASC LIMIT ?)",
+                                 (count - self.max_entries,))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Warning: Semantic cache store failed: {e}", file=sys.stderr)
+
+    def forget(self, response_key: str) -> None:
+        """Drops entries pointing at a response that is no longer cached."""
+        if not os.path.exists(self.path):
+            return
+        try:
+            conn = self._connect()
+            try:
+                self._delete(conn, "response_key = ?", (response_key,))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Warning: Semantic cache cleanup failed: {e}", file=sys.stderr)
+
+    def _delete(self, conn: sqlite3.Connection, where: str, params: Tuple[Any, ...]) -> None:
+        ids = [(row[0],) for row in conn.execute(f"SELECT id FROM semantic_entries WHERE {where}", params)]
+        conn.executemany("DELETE FROM semantic_bands WHERE entry_id = ?", ids)
+        conn.executemany("DELETE FROM semantic_entries WHERE id = ?", ids)
+
+    def clear(self) -> None:
+        """Removes every index entry."""
+        if not os.path.exists(self.path):
+            return
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM semantic_bands")
+            conn.execute("DELETE FROM semantic_entries")
+            conn.commit()
+        finally:
+            conn.close()
+
+
+# Lazily instantiated index (shared by all callers in the process)
+_index_instance: Optional[SemanticIndex] = None
+
+def get_semantic_index() -> SemanticIndex:
+    """Gets or creates the singleton semantic index instance."""
+    global _index_instance
+    if _index_instance is None:
+        _index_instance = SemanticIndex()
+    return _index_instance
@@ -0,0 +1,215 @@
+# single_flight.py
+"""
+Request coalescing for identical in-flight LLM calls.
+The first caller for a key (the leader) starts the real stream; callers arriving
+while it is in flight attach to it, receive the chunks produced so far and then
+every new chunk as it arrives. Subscribers may live on other threads and event
+loops (batch workers, the daemon), so chunks are handed over with
+loop.call_soon_threadsafe.
+
+The upstream stream runs in its own task (the pump) on the leader's event loop
+and the leader reads from the flight like every other subscriber, so a leader
+that goes away (a hedge loser, a disconnected daemon client) does not take the
+generation down with it: the pump keeps publishing while subscribers remain and
+is cancelled when the last one leaves. If the only subscribers left live on
+other event loops, the leader's loop may stop running once its caller returns;
+then, as long as nothing was published yet, the flight is handed to one of them,
+which restarts the request on its own loop. Subscribers fail with
+FlightAbandoned only when a flight that already streamed loses every subscriber
+on its loop.
+"""
+import asyncio
+import threading
+import contextlib
+import contextvars
+from typing import Any, AsyncIterator, Callable, Dict, Generator, List, Optional, Tuple
+
+from response_buffer import ResponseBuffer # Backlog of very large responses is kept on disk
+
+_END = object() # Queue sentinel marking the end of a flight
+
+class FlightAbandoned(Exception): pass
+
+
+class _Subscriber:
+    """One caller reading a flight, with what it needs to take over the generation."""
+    __slots__ = ('loop', 'queue', 'start', 'context')
+
+    def __init__(self, start: Callable[[], AsyncIterator[str]]):
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.start = start
+        self.context = contextvars.copy_context() # The pump runs in the context of the caller that starts it
+
+
+class _Flight:
+    """One in-flight generation: the chunks so far, the pump producing them and the subscribers waiting for more."""
+    def __init__(self, on_end: Callable[['_Flight'], None]):
+        self._lock = threading.Lock()
+        self._on_end = on_end
+        self.chunks = ResponseBuffer() # Replayed to late subscribers
+        self.finished = False
+        self.error: Optional[Exception] = None
+        self._subscribers: List[_Subscriber] = []
+        # (loop, task, token) of the current pump; the token tells a superseded pump's late calls apart
+        self._pump: Optional[Tuple[asyncio.AbstractEventLoop, Optional[asyncio.Task], object]] = None
+
+    def _notify_locked(self, item: Any) -> None:
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.queue.put_nowait, item)
+            except RuntimeError: # Subscriber's loop is closed
+                self._subscribers.remove(subscriber)
+
+    def attach(self, subscriber: _Subscriber) -> Tuple[Generator[str, None, None], bool]:
+        """
+        Registers subscriber; returns an iterator over the chunks published so far
+        (read from the backlog as it is consumed, not copied) and whether the flight already ended.
+        """
+        with self._lock:
+            if not self.finished:
+                self._subscribers.append(subscriber)
+            return iter(self.chunks), self.finished
+
+    def start_pump(self, subscriber: _Subscriber, token: Optional[object] = None) -> None:
+        """Starts the upstream stream of subscriber as the flight's pump (on the running loop)."""
+        with self._lock:
+            if self.finished or (token is not None and (self._pump is None or self._pump[2] is not token)):
+                return # Ended or superseded while the hand-over was scheduled
+            token = token or object()
+            task = subscriber.loop.create_task(self._run_pump(subscriber.start, token), context=subscriber.context)
+            self._pump = (subscriber.loop, task, token)
+        task.add_done_callback(lambda done: self._pump_done(token, done))
+
+    async def _run_pump(self, start: Callable[[], AsyncIterator[str]], token: object) -> None:
+        async with contextlib.aclosing(start()) as stream:
+            async for chunk in stream:
+                with self._lock:
+                    if self._pump is None or self._pump[2] is not token:
+                        return # Superseded: the new pump publishes from here on
+                    self.chunks.append(chunk)
+                    self._notify_locked(chunk)
+
+    def _pump_done(self, token: object, task: asyncio.Task) -> None:
+        if task.cancelled():
+            error: Optional[BaseException] = FlightAbandoned("The request this one was coalesced with was abandoned.")
+        else:
+            error = task.exception()
+        self._end(token, error)
+
+    def _end(self, token: object, error: Optional[BaseException]) -> None:
+        """Ends the flight if token is still its pump's (first call wins); subscribers re-raise error, if any."""
+        with self._lock:
+            if self.finished or self._pump is None or self._pump[2] is not token:
+                return
+            self.finished = True
+            self.error = error
+            self._notify_locked(_END)
+            self._subscribers = []
+        # Later identical requests start a new flight (or hit the response cache). attach()
+        # runs under the coalescer's lock, so nobody can attach after this.
+        self._on_end(self)
+        with self._lock:
+            self.chunks.close() # A spilled backlog holds a temporary file (kept until its readers finish)
+
+    def detach(self, subscriber: _Subscriber) -> None:
+        """Removes subscriber; cancels or hands over the pump if the flight is left without readers on its loop."""
+        cancel: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Task]] = None
+        successor: Optional[_Subscriber] = None
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+            if self.finished or self._pump is None:
+                return
+            loop, task, token = self._pump
+            if task is not None:
+                cancel = (loop, task)
+            if not self._subscribers:
+                end_token = token # Nobody is listening: stop generating
+            elif any(other.loop is loop for other in self._subscribers):
+                return # Still read on the pump's loop, which keeps it running
+            elif len(self.chunks):
+                end_token = token # Already streamed: a restart could not continue the same text
+            else:
+                successor = self._subscribers[0]
+                self._pump = (successor.loop, None, object())
+                end_token = None
+        if cancel is not None:
+            try:
+                cancel[0].call_soon_threadsafe(cancel[1].cancel)
+            except RuntimeError: # The pump's loop is closed
+                pass
+        if end_token is not None:
+            self._end(end_token, FlightAbandoned("The request this one was coalesced with was abandoned."))
+            return
+        token = self._pump[2]
+        try:
+            successor.loop.call_soon_threadsafe(self.start_pump, successor, token)
+        except RuntimeError: # The successor's loop is closed
+            self._end(token, FlightAbandoned("The request this one was coalesced with was abandoned."))
+
+    async def receive(self, subscriber: _Subscriber, backlog: Generator[str, None, None], finished: bool) -> AsyncIterator[str]:
+        """Yields every chunk of the flight, starting with the backlog returned by attach()."""
+        try:
+            for chunk in backlog:
+                yield chunk
+            if not finished:
+                while True:
+                    item = await subscriber.queue.get()
+                    if item is _END:
+                        break
+                    yield item
+            if self.error is not None:
+                raise self.error
+        finally:
+            backlog.close() # Lets a spilled backlog release its file if this reader left part-way
+            self.detach(subscriber)
+
+
+class SingleFlight:
+    """Coalesces concurrent streams that share a key (one generation, many subscribers)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def _release(self, key: str, flight: _Flight) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    async def stream(self, key: str, start: Callable[[], AsyncIterator[str]],
+                     on_join: Optional[Callable[[], None]] = None) -> AsyncIterator[str]:
+        """
+        Streams the response for key, starting it only if no identical request is in flight.
+
+        Args:
+            key: Identity of the request (callers with equal keys share one generation).
+            start: Opens the real chunk stream; called by the leader, or by a caller the
+                flight is handed to when the leader left before anything was streamed.
+            on_join: Called when this caller attaches to an existing flight instead of leading.
+
+        Raises:
+            Whatever the upstream stream raised (for every subscriber), or FlightAbandoned
+            if the flight lost its generation part-way (see the module docstring).
+        """
+        subscriber = _Subscriber(start)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(lambda ended: self._release(key, ended))
+            backlog, finished = flight.attach(subscriber)
+        if leader:
+            flight.start_pump(subscriber)
+        elif on_join:
+            on_join()
+        async for chunk in flight.receive(subscriber, backlog, finished):
+            yield chunk
+
+
+# Process-wide coalescer for LLM streams (keyed like the response cache)
+llm_flights = SingleFlight()
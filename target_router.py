@@ -0,0 +1,313 @@
+# target_router.py
+"""
+Latency-aware routing for the 'auto' target.
+Keeps rolling time-to-first-token and error statistics per configured target,
+sends each request to the fastest healthy one, fails over to the next target
+when a request fails before any output reached the caller, and can hedge: if
+the first target has not streamed a token within its p95-based deadline, a
+second target is started and whichever streams first wins.
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Optional, Dict, Any, List, Callable, Tuple
+
+import llm_config # Configured targets
+import chatsend   # Runs each attempt
+import llm_interface # litellm is loaded before timing attempts
+import metrics    # Per-attempt request metrics
+import semantic_cache # Near-duplicate lookup passed through to chatsend
+from output_sinks import OutputSink
+
+AUTO_TARGET = 'auto'
+
+# Defaults can be overridden via environment variables
+EWMA_ALPHA = 0.3 # Weight of the newest sample in the latency averages
+WINDOW_SIZE = 50 # Samples kept per target for the p95 hedge deadline
+MIN_HEDGE_SAMPLES = 5 # Below this the default hedge delay is used
+DEFAULT_HEDGE_DELAY_SECONDS = float(os.environ.get("LLM_HEDGE_DEFAULT_DELAY_SECONDS", "2.0"))
+MIN_HEDGE_DELAY_SECONDS = float(os.environ.get("LLM_HEDGE_MIN_DELAY_SECONDS", "0.25"))
+FAILURE_COOLDOWN_SECONDS = float(os.environ.get("LLM_AUTO_COOLDOWN_SECONDS", "30"))
+
+
+class TargetStats:
+    """Rolling latency/error statistics of one target."""
+    def __init__(self, name: str):
+        self.name = name
+        self.ewma_ttft: Optional[float] = None
+        self.ewma_total: Optional[float] = None
+        self.ttfts: deque = deque(maxlen=WINDOW_SIZE)
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.down_until = 0.0 # time.monotonic() until which the target is skipped (unless nothing else is left)
+
+    def is_healthy(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def p95_ttft(self) -> Optional[float]:
+        if len(self.ttfts) < MIN_HEDGE_SAMPLES:
+            return None
+        ordered = sorted(self.ttfts)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'ewma_ttft_seconds': self.ewma_ttft,
+            'ewma_total_seconds': self.ewma_total,
+            'p95_ttft_seconds': self.p95_ttft(),
+            'successes': self.successes,
+            'failures': self.failures,
+            'healthy': self.is_healthy(),
+        }
+
+
+def _ewma(current: Optional[float], sample: float) -> float:
+    return sample if current is None else EWMA_ALPHA * sample + (1 - EWMA_ALPHA) * current
+
+
+class _Attempt:
+    """One try of a request against one target."""
+    def __init__(self, target: str):
+        self.target = target
+        self.started = time.perf_counter()
+        self.ttft: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.metrics: Optional[metrics.RequestMetrics] = None # Own record; merged into the request's if it wins
+
+
+class _GatedSink(OutputSink):
+    """
+    Per-attempt view of the caller's sink: the first attempt to stream a chunk
+    claims the real sink (and cancels the other attempts); output of every other
+    attempt is discarded, so hedged and failed-over attempts never mix.
+    """
+    def __init__(self, router_state: '_RouteState', attempt: _Attempt):
+        self._state = router_state
+        self._attempt = attempt
+        self.wants_code_blocks = router_state.sink.wants_code_blocks
+
+    def _owns(self) -> bool:
+        return self._state.owner is self._attempt
+
+    def prompt(self, prompt: str) -> None:
+        if not self._state.prompt_shown:
+            self._state.prompt_shown = True
+            self._state.sink.prompt(prompt)
+
+    def chunk(self, text: str) -> None:
+        if self._attempt.ttft is None:
+            self._attempt.ttft = time.perf_counter() - self._attempt.started
+        if self._state.owner is None:
+            self._state.claim(self._attempt)
+        if self._owns():
+            self._state.sink.chunk(text)
+
+    def code_block(self, block: str) -> None:
+        if self._owns():
+            self._state.sink.code_block(block)
+
+    def stream_end(self) -> None:
+        if self._owns():
+            self._state.sink.stream_end()
+
+    def flush(self) -> None:
+        if self._owns():
+            self._state.sink.flush()
+
+
+class _RouteState:
+    """Shared state of one routed request: the caller's sink and the attempts in flight."""
+    def __init__(self, sink: OutputSink):
+        self.sink = sink
+        self.owner: Optional[_Attempt] = None
+        self.prompt_shown = False
+        self.attempts: List[_Attempt] = []
+
+    def claim(self, attempt: _Attempt) -> None:
+        self.owner = attempt
+        self.sink.stream_start()
+        for other in self.attempts:
+            if other is not attempt and other.task is not None and not other.task.done():
+                other.task.cancel() # The loser of a hedge stops generating
+
+
+class TargetRouter:
+    """Chooses targets for 'auto' requests from their observed latency and errors."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, TargetStats] = {}
+
+    def stats(self, target: str) -> TargetStats:
+        with self._lock:
+            if target not in self._stats:
+                self._stats[target] = TargetStats(target)
+            return self._stats[target]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: stats.to_dict() for name, stats in self._stats.items()}
+
+    def rank(self) -> List[str]:
+        """
+        Configured targets, fastest healthy first. Targets without samples rank first so
+        they get measured; targets in their failure cooldown come last (failover only).
+        """
+        targets = [target for target in llm_config.available_targets() if llm_config.is_target_configured(target)]
+        def score(target: str) -> Tuple[int, float]:
+            stats = self.stats(target)
+            return (0 if stats.is_healthy() else 1, stats.ewma_ttft or 0.0)
+        return sorted(targets, key=score) # Stable: config order breaks ties
+
+    def hedge_delay(self, target: str) -> float:
+        """How long to wait for a first token from target before hedging."""
+        p95 = self.stats(target).p95_ttft()
+        if p95 is None:
+            return DEFAULT_HEDGE_DELAY_SECONDS
+        return max(MIN_HEDGE_DELAY_SECONDS, p95)
+
+    def record_success(self, target: str, ttft: Optional[float], total: float) -> None:
+        stats = self.stats(target)
+        with self._lock:
+            stats.successes += 1
+            stats.consecutive_failures = 0
+            stats.down_until = 0.0
+            stats.ewma_total = _ewma(stats.ewma_total, total)
+            if ttft is not None:
+                stats.ewma_ttft = _ewma(stats.ewma_ttft, ttft)
+                stats.ttfts.append(ttft)
+
+    def record_lost_hedge(self, target: str, waited: float) -> None:
+        """A hedge loser produced no token within waited seconds; that is a lower bound of its TTFT."""
+        stats = self.stats(target)
+        with self._lock:
+            stats.ewma_ttft = _ewma(stats.ewma_ttft, max(waited, stats.ewma_ttft or 0.0))
+
+    def record_failure(self, target: str) -> None:
+        stats = self.stats(target)
+        with self._lock:
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            stats.down_until = time.monotonic() + FAILURE_COOLDOWN_SECONDS
+
+    async def _run_attempt(self, attempt: _Attempt, prompt: str, config: Dict[str, Any], sink: OutputSink,
+                           use_cache: bool, refresh: bool,
+                           similar: Optional[semantic_cache.SemanticQuery]) -> Tuple[Optional[str], Optional[str], bool]:
+        result = await chatsend.asend(prompt, attempt.target, config, use_cache=use_cache,
+                                      refresh=refresh, sink=sink, similar=similar)
+        return result.response, result.error, result.cache_hit
+
+    async def aroute(self,
+                     prompt: str,
+                     config_for: Callable[[str], Optional[Dict[str, Any]]],
+                     sink: OutputSink,
+                     use_cache: bool = True,
+                     refresh: bool = False,
+                     hedge: bool = False,
+                     similar: Optional[semantic_cache.SemanticQuery] = None) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        """
+        Sends prompt to the best target, failing over (and optionally hedging) as needed.
+
+        Args:
+            prompt: The final prompt.
+            config_for: Returns the LLM configuration of a target (None if unusable).
+            sink: The caller's sink; receives the output of exactly one attempt.
+            use_cache/refresh: Passed to chatsend.asend.
+            hedge: Start the next target if the first has not streamed a token by its deadline.
+            similar: Passed to chatsend.asend.
+
+        Returns:
+            (response or None, target that served it, error class name of the last failure).
+        """
+        candidates = self.rank()
+        if not candidates:
+            print("Error: No target is configured for 'auto' routing.", file=sys.stderr)
+            return None, None, "ConfigError"
+        # The one-time litellm import must not count as the first target's latency
+        await llm_interface.aload_litellm()
+        state = _RouteState(sink)
+        running: List[_Attempt] = []
+        last_error: Optional[str] = None
+        request_metrics = metrics.current()
+
+        def settle(attempt: _Attempt) -> None:
+            """Merges the metrics of the attempt whose outcome is the request's."""
+            if request_metrics and attempt.metrics:
+                request_metrics.merge(attempt.metrics)
+
+        def launch() -> bool:
+            while candidates:
+                target = candidates.pop(0)
+                config = config_for(target)
+                if config is None:
+                    continue
+                attempt = _Attempt(target)
+                # Each attempt streams into its own metrics record, so a hedge loser's chunks,
+                # retries and cache flag never mix into the request's
+                context, attempt.metrics = metrics.fork_context()
+                attempt.task = asyncio.create_task(
+                    self._run_attempt(attempt, prompt, config, _GatedSink(state, attempt), use_cache, refresh, similar),
+                    context=context)
+                state.attempts.append(attempt)
+                running.append(attempt)
+                return True
+            return False
+
+        if not launch():
+            return None, None, "ConfigError"
+        print(f"Info: Routing 'auto' request to '{running[0].target}'.")
+        try:
+            while running:
+                timeout = None
+                if hedge and candidates and len(running) == 1 and state.owner is None:
+                    first = running[0]
+                    timeout = max(0.0, first.started + self.hedge_delay(first.target) - time.perf_counter())
+                done, _ = await asyncio.wait([attempt.task for attempt in running], timeout=timeout,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done: # Hedge deadline passed without a first token
+                    slow_target = running[0].target
+                    if launch():
+                        print(f"Info: No first token from '{slow_target}' in time; hedging with '{running[-1].target}'.")
+                    continue
+                for attempt in [attempt for attempt in running if attempt.task in done]:
+                    running.remove(attempt)
+                    if attempt.task.cancelled():
+                        continue
+                    response, error, cache_hit = attempt.task.result()
+                    if response is not None and state.owner in (None, attempt):
+                        if state.owner is None: # Empty response: nothing was streamed
+                            state.claim(attempt)
+                            sink.stream_end()
+                        if not cache_hit: # Cache replays say nothing about the target's latency
+                            self.record_success(attempt.target, attempt.ttft, time.perf_counter() - attempt.started)
+                        for other in state.attempts:
+                            if other is not attempt and other.ttft is None and (other.task.cancelled() or not other.task.done()):
+                                # Lost the hedge race without a token
+                                self.record_lost_hedge(other.target, time.perf_counter() - other.started)
+                        settle(attempt)
+                        return response, attempt.target, None
+                    if response is None:
+                        last_error = error or "ChatError"
+                        self.record_failure(attempt.target)
+                        if state.owner is attempt: # Output already reached the caller: cannot fail over
+                            settle(attempt)
+                            return None, attempt.target, last_error
+                if not running and candidates:
+                    failed_target = state.attempts[-1].target
+                    if launch():
+                        print(f"Warning: Target '{failed_target}' failed ({last_error}); failing over to '{running[0].target}'.",
+                              file=sys.stderr)
+            return None, None, last_error
+        finally:
+            pending = [attempt.task for attempt in running if not attempt.task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+
+# Process-wide router (statistics are shared by every 'auto' request in the process)
+router = TargetRouter()
@@ -0,0 +1,21 @@
+# tests/conftest.py
+"""
+Shared fixtures: a fake OpenAI-compatible server standing in for the local target
+(benchmarks/fake_server.py) with private caches, so tests run offline and deterministically.
+"""
+import os
+
+# litellm would otherwise fetch its model cost map from the network on import
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+import pytest
+
+from benchmarks import harness
+from benchmarks.fake_server import FakeOpenAIServer
+
+
+@pytest.fixture
+def fake_server():
+    """The 'local' target served by a fresh fake server (unthrottled), with empty caches."""
+    with FakeOpenAIServer() as server, harness.local_target(server):
+        yield server
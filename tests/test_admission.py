@@ -0,0 +1,120 @@
+# tests/test_admission.py
+"""Per-target admission: concurrency limit, bounded queue, queue deadline and request rate."""
+import time
+import asyncio
+from typing import Optional
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+async def _hold(controller: AdmissionController, seconds: float, active: list, peak: list,
+                timeout: Optional[float] = None) -> None:
+    async with controller.admit(timeout=timeout):
+        active.append(1)
+        peak[0] = max(peak[0], len(active))
+        await asyncio.sleep(seconds)
+        active.pop()
+
+
+def test_concurrency_limit_is_never_exceeded():
+    async def main():
+        controller = AdmissionController('t', max_concurrency=2, max_queue=10, queue_timeout=5)
+        active, peak = [], [0]
+        await asyncio.gather(*(_hold(controller, 0.02, active, peak) for _ in range(8)))
+        return controller, peak[0]
+
+    controller, peak = asyncio.run(main())
+    assert peak == 2
+    assert controller.snapshot() == {'active': 0, 'queued': 0, 'rejected': 0}
+
+
+def test_full_queue_rejects_at_once():
+    async def main():
+        controller = AdmissionController('t', max_concurrency=1, max_queue=1, queue_timeout=5)
+        active, peak = [], [0]
+        started = time.monotonic()
+        results = await asyncio.gather(*(_hold(controller, 0.1, active, peak) for _ in range(3)),
+                                       return_exceptions=True)
+        return controller, results, time.monotonic() - started
+
+    controller, results, elapsed = asyncio.run(main())
+    rejected = [result for result in results if isinstance(result, AdmissionRejected)]
+    assert len(rejected) == 1 and "already queued" in str(rejected[0])
+    assert controller.rejected == 1
+    assert elapsed < 0.5 # The two admitted requests ran back to back
+
+
+def test_queue_deadline_rejects_waiter():
+    async def main():
+        controller = AdmissionController('t', max_concurrency=1, max_queue=5, queue_timeout=5)
+        active, peak = [], [0]
+        holder = asyncio.create_task(_hold(controller, 0.3, active, peak))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected, match="no stream slot"):
+            await _hold(controller, 0.0, active, peak, timeout=0.05)
+        await holder
+        return controller
+
+    assert asyncio.run(main()).snapshot()['queued'] == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def main():
+        controller = AdmissionController('t', max_concurrency=1, max_queue=5, queue_timeout=5)
+        active, peak = [], [0]
+        holder = asyncio.create_task(_hold(controller, 0.1, active, peak))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(_hold(controller, 0.0, active, peak))
+        await asyncio.sleep(0.01)
+        assert controller.snapshot()['queued'] == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        await holder
+        # The slot is free again: a new request is admitted without waiting
+        await asyncio.wait_for(_hold(controller, 0.0, active, peak), 0.05)
+        return controller
+
+    assert asyncio.run(main()).snapshot() == {'active': 0, 'queued': 0, 'rejected': 0}
+
+
+def test_request_rate_spaces_starts_after_the_burst():
+    async def main():
+        controller = AdmissionController('t', requests_per_minute=600, burst=2, queue_timeout=5) # 10/s
+        starts = []
+
+        async def one():
+            async with controller.admit():
+                starts.append(time.monotonic())
+
+        began = time.monotonic()
+        await asyncio.gather(*(one() for _ in range(4)))
+        return [start - began for start in sorted(starts)]
+
+    offsets = asyncio.run(main())
+    assert offsets[1] < 0.05 # The burst starts back to back
+    assert offsets[2] >= 0.09 and offsets[3] >= 0.19
+
+
+def test_rate_limit_past_deadline_rejects():
+    async def main():
+        controller = AdmissionController('t', requests_per_minute=60, burst=1, queue_timeout=5) # 1/s
+        async with controller.admit():
+            pass
+        with pytest.raises(AdmissionRejected, match="rate limit"):
+            async with controller.admit(timeout=0.1):
+                pass
+
+    asyncio.run(main())
+
+
+def test_pause_holds_back_new_requests():
+    async def main():
+        controller = AdmissionController('t', queue_timeout=5)
+        controller.pause(0.1)
+        began = time.monotonic()
+        async with controller.admit():
+            return time.monotonic() - began
+
+    assert asyncio.run(main()) >= 0.09
@@ -0,0 +1,99 @@
+# tests/test_batch.py
+"""Batch mode: concurrent manifest entries, each reported with its own outcome."""
+import io
+import json
+
+import pytest
+from click.testing import CliRunner
+
+import batch
+import clitest_middleware
+import llm_config
+import llm_workflow
+
+
+@pytest.fixture
+def no_openrouter_key(monkeypatch):
+    monkeypatch.delenv("OPENROUTER_API_KEY", raising=False)
+    monkeypatch.setitem(llm_config._LLM_CONFIGS_TEMPLATE['openrouter'], 'api_key', None)
+
+
+@pytest.fixture
+def broken_prompt(monkeypatch):
+    """Requests for the product 'broken' find no prompt."""
+    get_prompt = llm_workflow._get_prompt
+    monkeypatch.setattr(llm_workflow, '_get_prompt',
+                        lambda product, *args: None if product == 'broken' else get_prompt(product, *args))
+
+
+def _run(requests, workers: int = 4):
+    output, log = io.StringIO(), io.StringIO()
+    failures = batch.run_batch(requests, output, max_workers=workers, use_cache=False, log=log)
+    results = sorted((json.loads(line) for line in output.getvalue().splitlines()), key=lambda result: result['index'])
+    return failures, results
+
+
+def _request(product='curl', target='local', mode='execute', msg=None):
+    return {'product': product, 'operation': 'install', 'target': target, 'mode': mode, 'msg': msg}
+
+
+def test_concurrent_requests_report_their_own_errors(fake_server, no_openrouter_key, broken_prompt):
+    fake_server.token_rate = 2000 # Successful requests still stream while the others fail
+    kinds = ['ok', 'config', 'prompt', 'ok', 'prompt', 'config', 'ok', 'config']
+    requests = [{'ok': _request(msg=f"host {i}", mode='chat'),
+                 'config': _request(target='openrouter'),
+                 'prompt': _request(product='broken')}[kind] for i, kind in enumerate(kinds)]
+    failures, results = _run(requests)
+    expected_errors = {'ok': None, 'config': 'ConfigError', 'prompt': 'PromptError'}
+    assert [result['error'] for result in results] == [expected_errors[kind] for kind in kinds]
+    assert [result['ok'] for result in results] == [kind == 'ok' for kind in kinds]
+    assert failures == kinds.count('config') + kinds.count('prompt')
+    assert fake_server.requests_served == kinds.count('ok')
+
+
+def test_run_request_returns_the_error(no_openrouter_key, broken_prompt):
+    assert llm_workflow.run_request('curl', 'install', 'openrouter', 'execute', None) == (None, "ConfigError")
+    assert llm_workflow.run_request('broken', 'install', 'local', 'execute', None) == (None, "PromptError")
+    assert llm_workflow.handle_request('broken', 'install', 'local', 'execute', None) is None
+
+
+def test_batch_command_writes_one_jsonl_result_per_entry(fake_server, no_openrouter_key, broken_prompt, tmp_path):
+    fake_server.corpus = ["Run:\n```bash\nbrew install curl\n```\nDone"]
+    manifest, output = tmp_path / 'manifest.jsonl', tmp_path / 'results.jsonl'
+    entries = [
+        {'product': 'curl', 'operation': 'install'},
+        {'product': 'curl', 'operation': 'install', 'target': 'openrouter'},
+        {'product': 'broken', 'operation': 'install', 'mode': 'chat', 'msg': "help"},
+        {'product': 'wget', 'operation': 'install', 'mode': 'chat', 'msg': "which flags? — ✓"},
+    ]
+    manifest.write_text("".join(json.dumps(entry) + "\n" for entry in entries), encoding='utf-8')
+    result = CliRunner().invoke(clitest_middleware.batch_command,
+                                [str(manifest), '--output', str(output), '--no-cache', '-j', '2'])
+    assert result.exit_code == 1 # Some entries failed
+    assert "2 succeeded, 2 failed" in result.stderr
+
+    lines = output.read_text(encoding='utf-8').splitlines()
+    assert len(lines) == len(entries)
+    assert "— ✓" in output.read_text(encoding='utf-8') # Not \u-escaped
+    results = sorted((json.loads(line) for line in lines), key=lambda result: result['index'])
+    for entry, result in zip(entries, results):
+        assert set(result) == {'index', 'product', 'operation', 'target', 'mode', 'msg',
+                               'ok', 'code_blocks', 'elapsed_seconds', 'error'}
+        assert result['product'] == entry['product'] and result['elapsed_seconds'] >= 0
+    assert [result['error'] for result in results] == [None, 'ConfigError', 'PromptError', None]
+    assert [result['ok'] for result in results] == [True, False, False, True]
+    assert [result['target'] for result in results] == ['local', 'openrouter', 'local', 'local']
+    assert results[0]['code_blocks'] and "brew install curl" in results[0]['code_blocks'][0]
+    assert results[1]['code_blocks'] == results[2]['code_blocks'] == []
+
+
+def test_read_csv_manifest_with_defaults(tmp_path):
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text("product,operation,mode,msg\ncurl,install,,\nwget, install ,CHAT,which flags?\n", encoding='utf-8')
+    assert batch.read_manifest(str(manifest), default_target='auto') == [
+        {'product': 'curl', 'operation': 'install', 'target': 'auto', 'mode': 'execute', 'msg': None},
+        {'product': 'wget', 'operation': 'install', 'target': 'auto', 'mode': 'chat', 'msg': "which flags?"},
+    ]
+    manifest.write_text("product,operation,mode\ncurl,install,explain\n", encoding='utf-8')
+    with pytest.raises(ValueError):
+        batch.read_manifest(str(manifest))
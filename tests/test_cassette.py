@@ -0,0 +1,100 @@
+# tests/test_cassette.py
+"""Cassettes recorded from astream_litellm_response replay the same chunks, at the recorded pace or instantly."""
+import gzip
+import json
+import time
+import asyncio
+
+import pytest
+
+import cassette
+import llm_interface
+
+_TARGET = 'cassette-test' # Own admission controller
+_CONFIG = {'model': 'openai/test-model'}
+_ARGS = {'model': 'openai/test-model', 'messages': [{'role': 'user', 'content': "install curl"}],
+         'api_base': 'http://127.0.0.1:8012/v1', 'stream': True}
+_CHUNKS = ["To install ", "curl run:\n", "```bash\nbrew install curl\n```", " — done ✓"]
+_DELAY = 0.05
+
+
+class _FakeStream:
+    """Stands in for llm_interface._astream_once: the chunks with a delay before each."""
+    def __init__(self, fail_after=None):
+        self.calls = 0
+        self.fail_after = fail_after
+
+    async def __call__(self, litellm, litellm_args, config, target):
+        self.calls += 1
+        for i, chunk in enumerate(_CHUNKS):
+            if i == self.fail_after:
+                raise llm_interface.LLMConnectionError("stream broke")
+            await asyncio.sleep(_DELAY)
+            yield chunk
+
+
+@pytest.fixture
+def fake_stream(monkeypatch):
+    stream = _FakeStream()
+
+    async def no_litellm():
+        return None
+
+    monkeypatch.setattr(llm_interface, '_astream_once', stream)
+    monkeypatch.setattr(llm_interface, 'aload_litellm', no_litellm)
+    # The process-wide deck's counters are left as other tests expect them
+    monkeypatch.setattr(cassette.deck, 'recorded', cassette.deck.recorded)
+    monkeypatch.setattr(cassette.deck, 'replayed', cassette.deck.replayed)
+    yield stream
+    cassette.deck.configure() # Neither recording nor replaying
+
+
+def _collect(args=_ARGS):
+    async def main():
+        started = time.perf_counter()
+        chunks = [chunk async for chunk in llm_interface.astream_litellm_response(args, _CONFIG, _TARGET)]
+        return chunks, time.perf_counter() - started
+    return asyncio.run(main())
+
+
+def test_record_then_replay(fake_stream, tmp_path):
+    cassette.deck.configure(record_dir=str(tmp_path))
+    recorded, _ = _collect()
+    assert recorded == _CHUNKS
+    path = tmp_path / f"{cassette.request_key(_ARGS)}.json.gz"
+    document = json.loads(gzip.decompress(path.read_bytes()))
+    assert document['version'] == cassette.FORMAT_VERSION and document['target'] == _TARGET
+    assert [text for _, text in document['chunks']] == _CHUNKS
+    assert all(delay >= _DELAY * 0.8 for delay, _ in document['chunks'])
+
+    cassette.deck.configure(replay_dir=str(tmp_path), speed=0)
+    replayed, instant = _collect(dict(_ARGS, api_base='http://127.0.0.1:9999/v1')) # Endpoint is not part of the key
+    assert replayed == _CHUNKS and fake_stream.calls == 1
+    assert instant < _DELAY
+
+    cassette.deck.configure(replay_dir=str(tmp_path), speed=1.0)
+    paced, elapsed = _collect()
+    assert paced == _CHUNKS and fake_stream.calls == 1
+    assert elapsed >= len(_CHUNKS) * _DELAY * 0.8 # At the recorded pace
+
+
+def test_replay_without_cassette_fails(fake_stream, tmp_path):
+    cassette.deck.configure(replay_dir=str(tmp_path))
+    with pytest.raises(llm_interface.LLMReplayMissError):
+        _collect()
+    assert fake_stream.calls == 0
+
+
+def test_broken_stream_is_not_recorded(fake_stream, tmp_path):
+    fake_stream.fail_after = 2
+    cassette.deck.configure(record_dir=str(tmp_path))
+    with pytest.raises(llm_interface.LLMConnectionError):
+        _collect()
+    assert not list(tmp_path.glob('*.json.gz'))
+
+
+def test_key_covers_what_determines_the_response():
+    key = cassette.request_key(_ARGS)
+    assert key == cassette.request_key(dict(_ARGS, api_base=None, api_key='secret', client=object()))
+    assert key != cassette.request_key(dict(_ARGS, temperature=0.2))
+    assert key != cassette.request_key(dict(_ARGS, messages=[{'role': 'user', 'content': "install wget"}]))
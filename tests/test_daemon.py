@@ -0,0 +1,170 @@
+# tests/test_daemon.py
+"""
+Daemon round-trips over its Unix socket: NDJSON and SSE event streams of requests
+served by the fake server or replayed from cassettes, and clients that hang up.
+"""
+import json
+import time
+import shutil
+import asyncio
+import tempfile
+import threading
+
+import pytest
+
+import cassette
+import resp_fmt
+import middleware_client
+import middleware_daemon
+from benchmarks import harness
+
+_REQUEST = {'product': 'curl', 'operation': 'install', 'target': 'local', 'mode': 'execute'}
+
+
+class _Daemon:
+    """middleware_daemon._serve on its own thread and event loop, listening on a temporary socket."""
+    def __init__(self):
+        # Short directory: Unix socket paths are limited to about 100 bytes
+        self._dir = tempfile.mkdtemp(prefix='mwd-')
+        self.socket_path = f"{self._dir}/daemon.sock"
+        self._loop = asyncio.new_event_loop()
+        self._task = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        self._task = self._loop.create_task(middleware_daemon._serve(self.socket_path, None, None))
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+
+    def start(self) -> '_Daemon':
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not middleware_client.is_daemon_available(socket_path=self.socket_path):
+            assert time.monotonic() < deadline, "daemon did not come up"
+            time.sleep(0.02)
+        return self
+
+    def stop(self) -> None:
+        self._loop.call_soon_threadsafe(self._task.cancel)
+        self._thread.join(10)
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def connection(self) -> middleware_client._UnixHTTPConnection:
+        return middleware_client._UnixHTTPConnection(self.socket_path, timeout=30)
+
+
+@pytest.fixture
+def daemon(fake_server):
+    running = _Daemon().start()
+    try:
+        yield running
+    finally:
+        running.stop()
+
+
+def _events(daemon: _Daemon, **request):
+    with harness.quiet():
+        return list(middleware_client.iter_events(dict(_REQUEST, **request), socket_path=daemon.socket_path))
+
+
+def _check_stream(events, expected: str) -> None:
+    """A complete request: prompt first, done last, chunks and code blocks consistent with the response."""
+    kinds = [event['event'] for event in events]
+    assert kinds[0] == 'prompt_selected' and kinds[-1] == 'done'
+    assert kinds.index('first_token') < kinds.index('chunk')
+    assert events[-1]['response'] == expected
+    assert "".join(event['text'] for event in events if event['event'] == 'chunk') == expected
+    blocks = [event['block'] for event in events if event['event'] == 'code_block']
+    assert blocks == resp_fmt.extract_code_blocks(expected)
+
+
+def _read_sse(response) -> list:
+    """Parses SSE messages (event name plus JSON data) from a response."""
+    events = []
+    for message in response.read().decode('utf-8').split("\n\n"):
+        if not message.strip():
+            continue
+        fields = dict(line.split(": ", 1) for line in message.split("\n"))
+        payload = json.loads(fields['data'])
+        assert payload['event'] == fields['event']
+        events.append(payload)
+    return events
+
+
+def test_ndjson_round_trip(daemon, fake_server):
+    events = _events(daemon, use_cache=False)
+    expected = events[-1]['response']
+    assert expected in fake_server.corpus
+    _check_stream(events, expected)
+    assert fake_server.requests_served == 1
+
+
+def test_sse_round_trip(daemon, fake_server):
+    conn = daemon.connection()
+    try:
+        conn.request('POST', middleware_client.HANDLE_PATH, body=json.dumps(dict(_REQUEST, use_cache=False)),
+                     headers={'Content-Type': 'application/json', 'Accept': 'text/event-stream'})
+        response = conn.getresponse()
+        assert response.status == 200
+        assert response.getheader('Content-Type') == 'text/event-stream'
+        with harness.quiet():
+            events = _read_sse(response)
+    finally:
+        conn.close()
+    _check_stream(events, events[-1]['response'])
+    assert events[-1]['response'] in fake_server.corpus
+
+
+def test_cached_response_is_replayed_without_the_server(daemon, fake_server):
+    first = _events(daemon)
+    second = _events(daemon)
+    assert fake_server.requests_served == 1
+    _check_stream(second, first[-1]['response'])
+
+
+def test_invalid_request_is_rejected(daemon):
+    conn = daemon.connection()
+    try:
+        conn.request('POST', middleware_client.HANDLE_PATH, body=json.dumps({'product': 'curl'}))
+        response = conn.getresponse()
+        assert response.status == 400
+        assert "operation" in json.loads(response.read())['error']
+    finally:
+        conn.close()
+
+
+def test_cassette_replay_round_trip(daemon, fake_server, tmp_path):
+    try:
+        cassette.deck.configure(record_dir=str(tmp_path))
+        recorded = _events(daemon, use_cache=False)
+        assert cassette.deck.recorded == 1 and list(tmp_path.glob('*.json.gz'))
+        cassette.deck.configure(replay_dir=str(tmp_path), speed=0)
+        replayed = _events(daemon, use_cache=False)
+    finally:
+        cassette.deck.configure() # Neither recording nor replaying
+    assert fake_server.requests_served == 1 # The replay never reached the server
+    _check_stream(replayed, recorded[-1]['response'])
+
+
+def test_client_hangup_cancels_its_request(daemon, fake_server):
+    fake_server.token_rate = 50 # About a second per response: still streaming when the client leaves
+    conn = daemon.connection()
+    with harness.quiet():
+        conn.request('POST', middleware_client.HANDLE_PATH, body=json.dumps(dict(_REQUEST, use_cache=False)))
+        response = conn.getresponse()
+        assert json.loads(response.readline())['event'] == 'prompt_selected'
+        while json.loads(response.readline())['event'] != 'chunk':
+            pass
+        conn.close()
+        deadline = time.monotonic() + 5
+        while middleware_daemon._active_requests:
+            assert time.monotonic() < deadline, "request still running after the client left"
+            time.sleep(0.02)
+        # The daemon keeps serving
+        fake_server.token_rate = 0
+        events = _events(daemon, use_cache=False)
+    _check_stream(events, events[-1]['response'])
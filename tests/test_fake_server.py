@@ -0,0 +1,67 @@
+# tests/test_fake_server.py
+"""The benchmark fake server: deterministic responses, OpenAI-style streaming and simulated failures."""
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from benchmarks.fake_server import FakeOpenAIServer, load_corpus
+
+_CORPUS = ["first answer ✓", "second answer", "third answer"]
+
+
+def _post(server: FakeOpenAIServer, messages: list, stream: bool):
+    body = json.dumps({'model': 'test-model', 'messages': messages, 'stream': stream}).encode('utf-8')
+    request = urllib.request.Request(f"{server.api_base}/chat/completions", data=body,
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return response.read().decode('utf-8')
+
+
+def _streamed_text(body: str) -> str:
+    events = [line[len("data: "):] for line in body.split("\n\n") if line.startswith("data: ")]
+    assert events[-1] == "[DONE]"
+    chunks = [json.loads(event)['choices'][0] for event in events[:-1]]
+    assert chunks[-1]['finish_reason'] == 'stop'
+    return "".join(chunk['delta'].get('content', "") for chunk in chunks)
+
+
+def test_response_is_deterministic_per_conversation():
+    messages = [{'role': 'user', 'content': "install curl"}]
+    first, second = FakeOpenAIServer(corpus=_CORPUS), FakeOpenAIServer(corpus=_CORPUS)
+    try:
+        assert first.response_for(messages) == second.response_for(messages)
+        assert first.response_for(messages) in _CORPUS
+        picked = {first.response_for([{'role': 'user', 'content': f"install tool {i}"}]) for i in range(50)}
+        assert picked == set(_CORPUS) # Different prompts spread over the corpus
+    finally:
+        first.stop()
+        second.stop()
+
+
+def test_streamed_and_plain_completions_carry_the_same_text():
+    messages = [{'role': 'user', 'content': "install curl"}]
+    with FakeOpenAIServer(corpus=_CORPUS, chunk_size=3) as server:
+        expected = server.response_for(messages)
+        assert _streamed_text(_post(server, messages, stream=True)) == expected
+        plain = json.loads(_post(server, messages, stream=False))
+        assert plain['choices'][0]['message']['content'] == expected
+        assert server.requests_served == 2
+
+
+def test_first_requests_fail_with_the_configured_status():
+    messages = [{'role': 'user', 'content': "install curl"}]
+    with FakeOpenAIServer(corpus=_CORPUS, fail_requests=2, fail_status=503, retry_after=1.5) as server:
+        for _ in range(2):
+            with pytest.raises(urllib.error.HTTPError) as failure:
+                _post(server, messages, stream=True)
+            assert failure.value.code == 503 and failure.value.headers['Retry-After'] == "1.5"
+        assert _streamed_text(_post(server, messages, stream=True)) == server.response_for(messages)
+        assert server.requests_served == 3
+
+
+def test_load_corpus(tmp_path):
+    path = tmp_path / 'corpus.jsonl'
+    path.write_text('"plain"\n\n{"text": "from object"}\n', encoding='utf-8')
+    assert load_corpus(str(path)) == ["plain", "from object"]
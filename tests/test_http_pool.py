@@ -0,0 +1,31 @@
+# tests/test_http_pool.py
+"""Release of the response bodies a request opened on pooled clients."""
+import asyncio
+
+import http_pool
+
+
+class _Stream:
+    def __init__(self, error=None):
+        self.error = error
+        self.closed = False
+
+    async def aclose(self):
+        self.closed = True
+        if self.error:
+            raise self.error
+
+
+def test_streams_opened_in_the_block_are_recorded():
+    stream = _Stream()
+    http_pool.record_stream(_Stream()) # Outside any block: ignored
+    with http_pool.collect_streams() as opened:
+        http_pool.record_stream(stream)
+    assert opened == [stream]
+
+
+def test_a_stream_failing_to_close_does_not_stop_the_others(capsys):
+    streams = [_Stream(), _Stream(OSError("connection reset")), _Stream()]
+    asyncio.run(http_pool.close_streams(streams))
+    assert all(stream.closed for stream in streams)
+    assert "OSError: connection reset" in capsys.readouterr().err
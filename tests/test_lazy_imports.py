@@ -0,0 +1,17 @@
+# tests/test_lazy_imports.py
+"""Startup paths leave litellm, openai, httpx and llama_man unimported until they are needed."""
+import pytest
+
+from benchmarks import bench_import
+
+
+@pytest.mark.parametrize('module', [*bench_import._STARTUP_IMPORTS, 'clitest_middleware', 'chatsend'])
+def test_startup_imports_defer_heavy_modules(module):
+    assert bench_import.eagerly_loaded(module) == []
+
+
+def test_check_reports_eager_imports_and_slow_help():
+    results = {'eager_imports': {'main': '-', 'batch': ['httpx']}, 'main_help': {'p50_ms': 450.0}}
+    assert bench_import.check(results) == ["'import batch' loads httpx"]
+    assert bench_import.check(results, max_help_ms=300) == [
+        "'import batch' loads httpx", "'main.py --help' p50 450.0ms exceeds 300ms"]
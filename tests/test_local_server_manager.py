@@ -0,0 +1,230 @@
+# tests/test_local_server_manager.py
+"""Local server pool: health probe, cached health, least-outstanding dispatch and llama_man calls."""
+import os
+import sys
+import json
+import types
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional
+
+import pytest
+
+import llm_config
+import local_server_manager
+from local_server_manager import LocalServerManager
+
+
+class _HealthServer:
+    """Answers GET requests with a status per path (default 404) and counts them."""
+    def __init__(self, statuses: Optional[Dict[str, int]] = None):
+        self.statuses = dict(statuses if statuses is not None else {'/health': 200})
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server.requests += 1
+                body = json.dumps({'status': 'ok'}).encode('utf-8')
+                self.send_response(server.statuses.get(self.path, 404))
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def _fake_llama_man(port: int, pid_file: Optional[str] = None, takes_port: bool = True,
+                    status: str = "RUNNING") -> types.ModuleType:
+    """A stand-in llama_man recording the ports it was asked to check (None: its default port)."""
+    module = types.ModuleType('llama_man')
+    module.PORT = port
+    module.PID_FILE = pid_file
+    module.calls: List[Optional[int]] = []
+    if takes_port:
+        def ensure_server_running_or_fail(port: Optional[int] = None):
+            module.calls.append(port)
+            return status, f"checked {port or module.PORT}"
+    else:
+        def ensure_server_running_or_fail():
+            module.calls.append(None)
+            return status, f"checked {module.PORT}"
+    module.ensure_server_running_or_fail = ensure_server_running_or_fail
+    return module
+
+
+def _dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch, tmp_path):
+    """No real llama_man, no PID file next to it or here, and the pool based at llama_man.PORT unless a test says so."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(local_server_manager, '_SERVER_MODULE_PATH', str(tmp_path / 'no-server'))
+    monkeypatch.setattr(llm_config, 'LOCAL_POOL_BASE_PORT', None)
+
+
+def _manager(monkeypatch, llama_man, pool_size: int = 1) -> LocalServerManager:
+    monkeypatch.setattr(LocalServerManager, '_import_llama_man', lambda self: llama_man)
+    return LocalServerManager(pool_size=pool_size)
+
+
+def _write_pid(tmp_path, pid: int) -> str:
+    path = str(tmp_path / 'llama.pid')
+    with open(path, 'w') as f:
+        f.write(str(pid))
+    return path
+
+
+@pytest.fixture
+def health():
+    server = _HealthServer()
+    yield server
+    server.stop()
+
+
+@pytest.mark.parametrize('statuses, expected', [
+    ({'/health': 200}, True),
+    ({'/health': 503}, False), # llama-server still loading its model
+    ({'/v1/models': 200}, True), # /health answers 404: another OpenAI-compatible server
+    ({}, False),
+])
+def test_probe_follows_the_health_response(monkeypatch, statuses, expected):
+    server = _HealthServer(statuses)
+    try:
+        manager = _manager(monkeypatch, _fake_llama_man(server.port))
+        assert manager.probe(server.port) is expected
+    finally:
+        server.stop()
+
+
+def test_probe_requires_a_live_recorded_pid(monkeypatch, tmp_path, health):
+    manager = _manager(monkeypatch, _fake_llama_man(health.port, pid_file=_write_pid(tmp_path, os.getpid())))
+    assert manager.probe(health.port)
+    manager = _manager(monkeypatch, _fake_llama_man(health.port, pid_file=_write_pid(tmp_path, _dead_pid())))
+    assert not manager.probe(health.port)
+    assert manager.probe(health.port, check_pid=False)
+
+
+def test_pid_file_in_the_working_directory_is_ignored(monkeypatch, tmp_path, health):
+    (tmp_path / local_server_manager._PID_FILE_NAME).write_text(str(_dead_pid()))
+    manager = _manager(monkeypatch, _fake_llama_man(health.port))
+    assert manager._read_pid() is None
+    assert manager.probe(health.port)
+
+
+def test_probe_without_server_fails(monkeypatch):
+    server = _HealthServer()
+    port = server.port
+    server.stop()
+    assert not _manager(monkeypatch, _fake_llama_man(port)).probe(port)
+
+
+def test_healthy_state_is_cached_for_the_ttl(monkeypatch, health):
+    llama_man = _fake_llama_man(health.port)
+    manager = _manager(monkeypatch, llama_man)
+    assert manager.ensure_running() and manager.ensure_running()
+    assert health.requests == 1 and llama_man.calls == [] # One probe, no full check
+    manager.instances[0].checked_until = 0.0 # TTL expired
+    assert manager.ensure_running()
+    assert health.requests == 2
+
+
+def test_failed_probe_falls_back_to_llama_man(monkeypatch, health):
+    health.statuses = {'/health': 503}
+    llama_man = _fake_llama_man(health.port)
+    manager = _manager(monkeypatch, llama_man)
+    assert manager.ensure_running() # llama_man reports it running
+    assert llama_man.calls == [None] # Its own port: the default call
+
+
+def test_down_instance_is_retried_only_after_the_ttl(monkeypatch, health):
+    health.statuses = {}
+    llama_man = _fake_llama_man(health.port, status="FAILED_START")
+    manager = _manager(monkeypatch, llama_man)
+    assert not manager.ensure_running()
+    assert not manager.ensure_running()
+    assert llama_man.calls == [None]
+    assert manager.acquire() is None
+
+
+def test_pool_checks_every_port_through_llama_man(monkeypatch, health):
+    health.statuses = {}
+    llama_man = _fake_llama_man(8100)
+    monkeypatch.setattr(llm_config, 'LOCAL_POOL_BASE_PORT', 8099)
+    manager = _manager(monkeypatch, llama_man, pool_size=3)
+    monkeypatch.setattr(manager, 'probe', lambda port=None, check_pid=True: False)
+    manager.ensure_running()
+    assert llama_man.calls == [8099, None, 8101] # 8100 is llama_man's own port
+    assert [instance.primary for instance in manager.instances] == [False, True, False]
+
+
+def test_base_port_other_than_llama_mans_is_passed_on(monkeypatch):
+    llama_man = _fake_llama_man(8099)
+    monkeypatch.setattr(llm_config, 'LOCAL_POOL_BASE_PORT', 9000)
+    manager = _manager(monkeypatch, llama_man)
+    monkeypatch.setattr(manager, 'probe', lambda port=None, check_pid=True: True if llama_man.calls else False)
+    assert manager.ensure_running()
+    assert llama_man.calls == [9000]
+    assert manager.get_port() == 9000
+
+
+@pytest.mark.parametrize('pool_size, base_port', [(2, None), (1, 9000)])
+def test_llama_man_without_port_argument_fails_clearly(monkeypatch, capsys, pool_size, base_port):
+    llama_man = _fake_llama_man(8099, takes_port=False)
+    monkeypatch.setattr(llm_config, 'LOCAL_POOL_BASE_PORT', base_port)
+    manager = _manager(monkeypatch, llama_man, pool_size=pool_size)
+    assert not manager.ensure_running()
+    assert "does not accept a port" in capsys.readouterr().err
+    assert llama_man.calls == []
+
+
+def test_single_instance_on_llama_mans_port_needs_no_port_argument(monkeypatch, health):
+    llama_man = _fake_llama_man(health.port, takes_port=False)
+    manager = _manager(monkeypatch, llama_man)
+    assert manager.ensure_running()
+
+
+def test_acquire_leases_the_least_outstanding_instance(monkeypatch):
+    manager = _manager(monkeypatch, _fake_llama_man(8099), pool_size=3)
+    leased = [manager.acquire() for _ in range(3)]
+    assert sorted(leased) == [8099, 8100, 8101]
+    manager.release(8100)
+    assert manager.acquire() == 8100
+    assert [instance.outstanding for instance in manager.instances] == [1, 1, 1]
+
+
+def test_failed_release_takes_the_instance_out_of_rotation(monkeypatch, health):
+    manager = _manager(monkeypatch, _fake_llama_man(8099), pool_size=2)
+    assert manager.acquire() == 8099
+    manager.release(8099, failed=True)
+    assert [manager.acquire() for _ in range(3)] == [8100] * 3
+    assert manager.instances[0].down and not manager.instances[0].is_checked()
+    # The next ensure_running() re-checks it and puts it back
+    monkeypatch.setattr(manager, 'probe', lambda port=None, check_pid=True: True)
+    assert manager.ensure_running()
+    assert not manager.instances[0].down
+    assert manager.acquire() == 8099
+
+
+def test_invalidate_all(monkeypatch):
+    manager = _manager(monkeypatch, _fake_llama_man(8099), pool_size=2)
+    manager.invalidate()
+    assert manager.acquire() is None
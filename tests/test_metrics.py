@@ -0,0 +1,126 @@
+# tests/test_metrics.py
+"""Request metrics: aggregation into Prometheus text, JSON-lines export and tracked stages."""
+import json
+import time
+
+import pytest
+
+import metrics
+from metrics import MetricsRecorder, RequestMetrics
+
+
+def _request(target: str = 'local', error=None, chunks: int = 0, stages=None, **flags) -> RequestMetrics:
+    request = RequestMetrics('curl', 'install', 'execute', target)
+    for name, seconds in (stages or {}).items():
+        request.add_stage(name, seconds)
+    for i in range(chunks):
+        request.record_chunk(f"chunk {i}")
+    for name, value in flags.items():
+        setattr(request, name, value)
+    request.finish(error)
+    return request
+
+
+def _samples(text: str) -> dict:
+    """Sample lines of a Prometheus text exposition as {'name{labels}': value}."""
+    samples = {}
+    for line in text.splitlines():
+        if not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_prometheus_text_output():
+    recorder = MetricsRecorder(export_interval=0)
+    recorder.record(_request(stages={'prompt': 0.003}, chunks=3, cache_hit=True))
+    recorder.record(_request(stages={'prompt': 0.2}, retries=2))
+    recorder.record(_request(target='openrouter', error='LLMConnectionError'))
+    text = recorder.render_prometheus()
+    assert text.endswith("\n")
+
+    # Every metric family is declared once, before its samples
+    lines = text.splitlines()
+    families = [line.split()[2] for line in lines if line.startswith('# TYPE')]
+    assert len(families) == len(set(families)) and 'middleware_stage_seconds' in families
+    for line in lines:
+        if not line.startswith('#'):
+            family = line.split('{')[0]
+            assert any(family == name or family.startswith(name + '_') for name in families)
+
+    samples = _samples(text)
+    assert samples['middleware_requests_total{target="local",outcome="ok"}'] == 2
+    assert samples['middleware_requests_total{target="openrouter",outcome="error"}'] == 1
+    assert samples['middleware_request_errors_total{target="openrouter",error="LLMConnectionError"}'] == 1
+    assert samples['middleware_cache_hits_total{target="local"}'] == 1
+    assert samples['middleware_llm_retries_total{target="local"}'] == 2
+    assert samples['middleware_stream_chunks_total{target="local"}'] == 3
+
+    # Cumulative histogram buckets
+    assert samples['middleware_stage_seconds_bucket{target="local",stage="prompt",le="0.001"}'] == 0
+    assert samples['middleware_stage_seconds_bucket{target="local",stage="prompt",le="0.005"}'] == 1
+    assert samples['middleware_stage_seconds_bucket{target="local",stage="prompt",le="0.25"}'] == 2
+    assert samples['middleware_stage_seconds_bucket{target="local",stage="prompt",le="+Inf"}'] == 2
+    assert samples['middleware_stage_seconds_count{target="local",stage="prompt"}'] == 2
+    assert samples['middleware_stage_seconds_sum{target="local",stage="prompt"}'] == pytest.approx(0.203)
+    assert samples['middleware_time_to_first_token_seconds_count{target="local"}'] == 1
+
+
+def test_export_files(tmp_path):
+    jsonl_path, prometheus_path = tmp_path / 'requests.jsonl', tmp_path / 'metrics.prom'
+    recorder = MetricsRecorder(export_interval=0) # Written on every request
+    recorder.configure(jsonl_path=str(jsonl_path), prometheus_path=str(prometheus_path))
+    first, second = _request(chunks=2), _request(error='LLMAPIError')
+    recorder.record(first)
+    recorder.record(second)
+    records = [json.loads(line) for line in jsonl_path.read_text().splitlines()]
+    assert [record['request_id'] for record in records] == [first.request_id, second.request_id]
+    assert records[0]['ok'] and records[0]['chunks'] == 2 and records[0]['product'] == 'curl'
+    assert not records[1]['ok'] and records[1]['error'] == 'LLMAPIError'
+    assert prometheus_path.read_text() == recorder.render_prometheus()
+    assert not (tmp_path / 'metrics.prom.tmp').exists()
+
+
+def test_background_export(tmp_path):
+    jsonl_path = tmp_path / 'requests.jsonl'
+    recorder = MetricsRecorder(export_interval=0.05)
+    recorder.configure(jsonl_path=str(jsonl_path))
+    recorder.record(_request())
+    assert not jsonl_path.exists() # Not written on the request path
+    deadline = time.monotonic() + 5
+    while not jsonl_path.exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(jsonl_path.read_text().splitlines()) == 1
+
+
+def test_tracked_request_records_stages_and_errors(monkeypatch):
+    recorder = MetricsRecorder(export_interval=0)
+    monkeypatch.setattr(metrics, 'recorder', recorder)
+    with metrics.track_request('curl', 'install', 'execute', 'local') as request:
+        assert metrics.current() is request
+        with metrics.stage('prompt'):
+            pass
+        with metrics.stage('prompt'): # Accumulates
+            pass
+    with pytest.raises(ValueError):
+        with metrics.track_request('curl', 'install', 'execute', 'local'):
+            raise ValueError("boom")
+    assert metrics.current() is None
+    assert set(request.stages) == {'prompt'} and request.total >= request.stages['prompt']
+    samples = _samples(recorder.render_prometheus())
+    assert samples['middleware_requests_total{target="local",outcome="ok"}'] == 1
+    assert samples['middleware_request_errors_total{target="local",error="ValueError"}'] == 1
+
+
+def test_merged_fork_keeps_the_earliest_first_token():
+    request = RequestMetrics('curl', 'install', 'execute', 'auto')
+    loser, winner = request.fork(), request.fork()
+    assert winner.request_id == request.request_id
+    winner.add_stage('llm', 0.5)
+    winner.record_chunk("a")
+    winner.record_chunk("b")
+    winner.retries = 1
+    request.merge(winner)
+    assert request.chunks == 2 and request.retries == 1 and request.stages == {'llm': 0.5}
+    assert request.time_to_first_token == winner.time_to_first_token
+    assert loser.chunks == 0
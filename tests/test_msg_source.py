@@ -0,0 +1,81 @@
+# tests/test_msg_source.py
+"""Windowed reading of large msg files and stdin: head and tail around an omission marker."""
+import io
+import os
+
+import pytest
+
+import msg_source
+import prompt_budget
+
+
+def _log(lines: int) -> bytes:
+    return b"".join(b"line %06d: some install output\n" % i for i in range(lines))
+
+
+def _write(tmp_path, data: bytes) -> str:
+    path = os.path.join(tmp_path, 'install.log')
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def test_small_file_is_read_whole(tmp_path):
+    data = _log(10)
+    assert msg_source.read_msg(_write(tmp_path, data), max_bytes=4096) == data.decode()
+
+
+def test_large_file_keeps_head_and_tail(tmp_path):
+    data = _log(20000)
+    text = msg_source.read_msg(_write(tmp_path, data), max_bytes=4096)
+    head, marker, tail = text.partition("\n... [")
+    assert marker
+    assert len(text) <= 4096 + 100
+    assert data.decode().startswith(head)
+    assert data.decode().endswith(tail.split("] ...\n", 1)[1])
+    assert head.endswith("output") # Cut back to whole lines
+    assert tail.split("] ...\n", 1)[1].startswith("line ")
+    assert "line 019999" in text and "line 000000" in text
+
+
+def test_head_share_follows_prompt_budget(tmp_path):
+    text = msg_source.read_msg(_write(tmp_path, _log(20000)), max_bytes=10000)
+    head = text.partition("\n... [")[0]
+    assert abs(len(head) - 10000 * prompt_budget.HEAD_SHARE) < 100
+
+
+@pytest.mark.parametrize('lines', [10, 200, 20000])
+def test_stream_window_matches_file_window(tmp_path, monkeypatch, lines):
+    data = _log(lines)
+    from_file = msg_source.read_msg(_write(tmp_path, data), max_bytes=4096)
+    monkeypatch.setattr(msg_source, 'READ_CHUNK_BYTES', 1000) # Many chunks through the rolling tail
+    from_stream = msg_source._read_stream(io.BytesIO(data), 4096)
+    if len(data) <= 4096:
+        assert from_stream == from_file == data.decode()
+        return
+    # The stream also counts the omitted lines; otherwise both windows agree
+    file_head, _, file_rest = from_file.partition("\n... [")
+    stream_head, _, stream_rest = from_stream.partition("\n... [")
+    assert stream_head == file_head
+    assert stream_rest.split("] ...\n", 1)[1] == file_rest.split("] ...\n", 1)[1]
+    kept_lines = from_stream.count("line ")
+    assert f"{lines - kept_lines} lines / " in stream_rest
+
+
+def test_stdin_is_read_as_a_stream(monkeypatch):
+    data = _log(5000)
+    monkeypatch.setattr(msg_source.sys, 'stdin', io.TextIOWrapper(io.BytesIO(data)))
+    text = msg_source.read_msg('-', max_bytes=2048)
+    assert " lines / ~" in text
+    assert text.endswith(data.decode()[-100:])
+
+
+def test_invalid_utf8_is_replaced(tmp_path):
+    assert msg_source.read_msg(_write(tmp_path, b"ok \xff\xfe end\n"), max_bytes=4096) == "ok �� end\n"
+
+
+def test_window_follows_target_budget():
+    budget = prompt_budget.budget_for('local')
+    assert budget
+    assert msg_source.window_bytes('local') == min(msg_source.MAX_MSG_BYTES, budget * msg_source.WINDOW_BYTES_PER_TOKEN)
+    assert msg_source.window_bytes(None) == msg_source.MAX_MSG_BYTES
@@ -0,0 +1,107 @@
+# tests/test_output_sinks.py
+"""Output sinks: buffered console output and NDJSON / SSE event framing."""
+import io
+import json
+
+import pytest
+
+import output_sinks
+from output_sinks import ConsoleSink, EventSink
+
+
+def _drive(sink) -> None:
+    """One request's events, as chatsend and the workflow send them."""
+    sink.prompt("Install curl.\n<input_context>N/A</input_context>")
+    sink.stream_start()
+    for text in ["Run ", "`brew install curl`", " — ✓\n"]:
+        sink.chunk(text)
+    sink.code_block("`brew install curl`")
+    sink.stream_end()
+    sink.done("Run `brew install curl` — ✓\n")
+    sink.error("Ignored") # A request ends once
+
+
+def _parse_sse(text: str) -> list:
+    events = []
+    for message in text.split("\n\n")[:-1]:
+        event_line, data_line = message.split("\n")
+        assert event_line.startswith("event: ") and data_line.startswith("data: ")
+        payload = json.loads(data_line[len("data: "):])
+        assert payload['event'] == event_line[len("event: "):]
+        events.append(payload)
+    assert text.endswith("\n\n")
+    return events
+
+
+def _check(events: list) -> None:
+    assert [event['event'] for event in events] == [
+        'prompt_selected', 'first_token', 'chunk', 'chunk', 'chunk', 'code_block', 'done']
+    assert events[0]['chars'] == len(events[0]['prompt'])
+    assert "".join(event['text'] for event in events if event['event'] == 'chunk') == events[-1]['response']
+    assert events[1]['ttft_ms'] >= 0 and events[-1]['elapsed_ms'] >= events[1]['ttft_ms']
+
+
+def test_ndjson_framing():
+    stream = io.StringIO()
+    _drive(EventSink.to_stream(stream))
+    lines = stream.getvalue().split("\n")
+    assert lines[-1] == "" # Every event is one newline-terminated line
+    events = [json.loads(line) for line in lines[:-1]]
+    _check(events)
+    assert "— ✓" in stream.getvalue() # Not \u-escaped
+
+
+def test_sse_framing():
+    stream = io.StringIO()
+    _drive(EventSink.to_stream(stream, framing=output_sinks.SSE))
+    _check(_parse_sse(stream.getvalue()))
+
+
+def test_multiline_text_stays_in_one_sse_data_line():
+    text = output_sinks.encode_event({'event': 'chunk', 'text': "a\n\nb"}, output_sinks.SSE)
+    assert text.count("\n") == 3 and _parse_sse(text) == [{'event': 'chunk', 'text': "a\n\nb"}]
+
+
+def test_prompt_can_be_left_out():
+    written = []
+    sink = EventSink(written.append, include_prompt=False)
+    sink.prompt("secret prompt")
+    sink.relay({'event': 'prompt_selected', 'chars': 13, 'prompt': "secret prompt"})
+    assert [json.loads(line) for line in written] == [{'event': 'prompt_selected', 'chars': 13}] * 2
+
+
+def test_relay_ends_the_stream_once():
+    written = []
+    sink = EventSink(written.append)
+    sink.relay({'event': 'error', 'error': 'LLMConnectionError'})
+    sink.relay({'event': 'done', 'response': ""})
+    sink.error("LocalServerError")
+    assert [json.loads(line)['event'] for line in written] == ['error']
+
+
+def test_unknown_framing_is_rejected():
+    with pytest.raises(ValueError):
+        EventSink(print, framing='xml')
+
+
+def test_console_sink_buffers_chunks():
+    stream = io.StringIO()
+    sink = ConsoleSink(stream=stream, flush_chars=10, flush_interval=3600, echo_prompt=False)
+    sink.stream_start()
+    start = len(stream.getvalue())
+    sink.chunk("abc")
+    sink.chunk("def")
+    assert len(stream.getvalue()) == start # Below flush_chars: nothing written yet
+    sink.chunk("ghij")
+    assert stream.getvalue()[start:] == "abcdefghij"
+    sink.chunk("k")
+    sink.stream_end()
+    assert stream.getvalue()[start:] == "abcdefghijk\n--- End of Response Stream ---\n"
+
+
+def test_console_sink_shortens_long_prompts():
+    stream = io.StringIO()
+    ConsoleSink(stream=stream, prompt_preview_chars=20).prompt("h" * 10 + "x" * 1000 + "t" * 10)
+    output = stream.getvalue()
+    assert "h" * 10 + "\n... [1000 characters of the prompt not shown] ...\n" + "t" * 10 in output
+    assert "x" not in output
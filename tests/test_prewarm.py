@@ -0,0 +1,108 @@
+# tests/test_prewarm.py
+"""Artifact store keys (template version, msg variant, model) and prewarm planning and pruning."""
+import os
+
+import pytest
+
+import prewarm
+import llm_config
+import artifact_store
+import prompt_registry
+from artifact_store import ArtifactStore
+from prompt_registry import CompiledTemplate
+
+_MODEL = 'openai/test-model'
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(path=os.path.join(tmp_path, 'artifacts.sqlite3'))
+
+
+def _put(store: ArtifactStore, template: CompiledTemplate, msg=None, model: str = _MODEL, text: str = "answer") -> None:
+    store.put(template, msg, model, [text], [f"`{text}`"])
+
+
+def test_round_trip(store):
+    template = CompiledTemplate('INSTALL_X', "Install x.\n<input_context>{msg}</input_context>")
+    assert store.get(template, None, _MODEL) is None
+    _put(store, template, text="brew install x")
+    artifact = store.get(template, None, _MODEL)
+    assert artifact.chunks == ["brew install x"] and artifact.code_blocks == ["`brew install x`"]
+
+
+def test_changed_template_text_invalidates_the_artifact(store):
+    _put(store, CompiledTemplate('INSTALL_X', "Install x.\n{msg}"))
+    edited = CompiledTemplate('INSTALL_X', "Install x with Homebrew.\n{msg}")
+    assert store.get(edited, None, _MODEL) is None
+    assert store.prune([edited]) == 1
+    assert store.summary() == {}
+
+
+def test_model_is_part_of_the_key(store):
+    template = CompiledTemplate('INSTALL_X', "Install x.\n{msg}")
+    _put(store, template, model='openai/a')
+    assert store.get(template, None, 'openai/b') is None
+    assert store.get(template, None, 'openai/a') is not None
+
+
+def test_msg_counts_only_for_templates_with_msg(store):
+    with_msg = CompiledTemplate('INSTALL_X', "Install x.\n{msg}")
+    _put(store, with_msg, msg="OS: Linux")
+    assert store.get(with_msg, "  os:   LINUX ", _MODEL) is not None # Case and whitespace are normalized
+    assert store.get(with_msg, "OS: Windows", _MODEL) is None
+    assert artifact_store.template_variant(with_msg, "N/A") == artifact_store.template_variant(with_msg, None) == ""
+
+    without_msg = CompiledTemplate('INSTALL_Y', "Install y.\n{product}")
+    _put(store, without_msg)
+    assert store.get(without_msg, "anything at all", _MODEL) is not None
+
+
+def test_os_selects_the_variant_of_templates_with_os(store):
+    template = CompiledTemplate('INSTALL_Z', "Install z.\nOperating System: {os}")
+    _put(store, template, text="mac answer")
+    assert store.get(template, "OS: MacOS", _MODEL).chunks == ["mac answer"] # The default OS
+    assert store.get(template, "OS: Windows", _MODEL) is None
+    _put(store, template, msg="windows 11 host, OS: Windows", text="windows answer")
+    assert store.get(template, "OS: Windows", _MODEL).chunks == ["windows answer"]
+
+
+def test_prune_keeps_current_templates_and_drops_removed_ones(store):
+    current = CompiledTemplate('INSTALL_X', "Install x.\n{msg}")
+    removed = CompiledTemplate('REMOVED_PRODUCT', "Gone.\n{msg}")
+    _put(store, current)
+    _put(store, current, msg="OS: Linux")
+    _put(store, removed)
+    assert store.prune([current]) == 1
+    assert store.summary() == {'INSTALL_X': 2}
+    assert store.prune([current]) == 0
+
+
+def test_plan_covers_the_variants_each_template_can_take(store):
+    jobs = prewarm.plan_jobs('local', store=store)
+    planned = {(job.template.name, job.msg) for job in jobs}
+    # Written for MacOS/Homebrew: only the msg-less answer
+    assert {msg for name, msg in planned if name == 'INSTALL_CURL'} == {None}
+    # Render the OS a msg states: one answer per OS
+    for name in ('INSTALL_SPLUNK_OTEL_COLLECTOR', 'UNINSTALL_SPLUNK_OTEL_COLLECTOR'):
+        assert {msg for template, msg in planned if template == name} == set(prewarm.DEFAULT_MSG_VARIANTS)
+    assert len(jobs) == len(planned) == len(prompt_registry.EXECUTE_TEMPLATES) * 3 - 2
+
+
+def test_plan_skips_stored_artifacts_unless_forced(store):
+    model = llm_config.model_name('local')
+    first = prewarm.plan_jobs('local', store=store)
+    stored = first[0]
+    store.put(stored.template, stored.msg, model, ["a"], [])
+    again = prewarm.plan_jobs('local', store=store)
+    assert len(again) == len(first) - 1
+    assert all((job.template.name, job.msg) != (stored.template.name, stored.msg) for job in again)
+    assert len(prewarm.plan_jobs('local', force=True, store=store)) == len(first)
+    # Another model has none of them
+    assert store.get(stored.template, stored.msg, model + '-other') is None
+
+
+def test_plan_merges_variants_that_render_the_same_prompt(store):
+    jobs = prewarm.plan_jobs('local', msgs=(None, "N/A", "OS: Windows", "os:  windows"), store=store)
+    splunk = [job.msg for job in jobs if job.template.name == 'INSTALL_SPLUNK_OTEL_COLLECTOR']
+    assert splunk == [None, "OS: Windows"]
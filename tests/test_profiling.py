@@ -0,0 +1,33 @@
+# tests/test_profiling.py
+"""--profile: one in-process run writes its cProfile stats, span trace and summary."""
+import json
+import pstats
+
+from click.testing import CliRunner
+
+import profiling
+import clitest_middleware
+
+
+def test_profile_writes_stats_trace_and_summary(fake_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'TRACE_ALLOCATIONS', False) # Slows the litellm import about tenfold
+    out_dir = tmp_path / 'profile'
+    result = CliRunner().invoke(clitest_middleware.main_command,
+                                ['--product', 'curl', '--operation', 'install', '--no-cache', '--quiet',
+                                 '--profile', str(out_dir)])
+    assert result.exit_code == 0, result.output
+    assert fake_server.requests_served == 1 # Profiled runs never go through the daemon
+    assert {path.name for path in out_dir.iterdir()} == {'profile.pstats', 'trace.json', 'summary.txt'}
+
+    stats = pstats.Stats(str(out_dir / 'profile.pstats'))
+    assert any(filename.endswith('chatsend.py') for filename, _, _ in stats.stats)
+
+    events = json.loads((out_dir / 'trace.json').read_text())['traceEvents']
+    spans = {event['name'] for event in events}
+    assert {'request', 'prompt', 'stream'} <= spans
+    assert all(event['ph'] == 'X' and event['dur'] >= 0 for event in events if event['name'] in spans)
+
+    summary = (out_dir / 'summary.txt').read_text()
+    for heading in ("Profiled time by package", "Spans (count, total):", "Imports after the profile started"):
+        assert heading in summary
+    assert "Profile written to" in result.stderr
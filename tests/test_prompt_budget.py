@@ -0,0 +1,98 @@
+# tests/test_prompt_budget.py
+"""OS-aware section selection, msg trimming to a token budget and per-target budgets."""
+import pytest
+
+import llm_config
+import prompt_budget
+import prompt_registry
+from prompt_registry import CompiledTemplate
+
+_OTEL = prompt_registry.lookup_execute('install', 'splunk-otel-collector')
+_CURL = prompt_registry.lookup_execute('install', 'curl')
+
+
+def _tokens(text: str) -> int:
+    return prompt_budget.count_tokens(text, None)[0]
+
+
+def _log(lines: int) -> str:
+    return "".join(f"step {i:05d}: compiling module {i % 97}\n" for i in range(lines))
+
+
+@pytest.mark.parametrize('msg, kept, dropped', [
+    (None, '<linux-examples>', '<windows-examples>'), # Default OS: MacOS, closest to the Linux steps
+    ("OS: Windows", '<windows-examples>', '<linux-examples>'),
+    ("Host: build-7, os=ubuntu", '<linux-examples>', '<windows-examples>'),
+])
+def test_sections_follow_the_stated_os(msg, kept, dropped):
+    text = prompt_budget.select_sections(_OTEL, msg).text
+    assert kept in text and dropped not in text
+
+
+def test_os_placeholder_renders_the_request_os():
+    assert prompt_budget.os_label(_OTEL, "OS: Windows") == 'Windows'
+    assert prompt_budget.os_label(_OTEL, None) == 'MacOS'
+    assert prompt_budget.os_label(prompt_registry.MODE_TEMPLATES['fix'], "error on debian, OS: Linux") == 'Linux'
+
+
+def test_template_written_for_one_os_keeps_it():
+    assert prompt_budget.template_os(_CURL) == 'macos'
+    assert prompt_budget.request_os(_CURL, "OS: Windows") == 'macos'
+    assert prompt_budget.select_sections(_CURL, "OS: Windows") is _CURL
+
+
+def test_template_without_os_keeps_every_section():
+    template = CompiledTemplate('T', "<linux-examples>l</linux-examples>\n<windows-examples>w</windows-examples>\n{msg}")
+    assert prompt_budget.request_os(template, None) is None
+    assert prompt_budget.select_sections(template, None) is template
+    assert '<linux-examples>' not in prompt_budget.select_sections(template, "OS: Windows").text
+
+
+def test_text_within_budget_is_unchanged():
+    text = _log(10)
+    assert prompt_budget.trim_text(text, _tokens(text)) == text
+
+
+@pytest.mark.parametrize('budget', [200, 1000, 4000])
+def test_trimmed_text_fits_and_keeps_head_and_tail(budget):
+    text = _log(3000)
+    trimmed = prompt_budget.trim_text(text, budget)
+    assert _tokens(trimmed) <= budget
+    assert _tokens(trimmed) >= budget * 0.8 # The budget is used, not just respected
+    head, _, tail = trimmed.partition("\n... [")
+    assert text.startswith(head) and head
+    tail = tail.split("] ...\n", 1)[1]
+    assert text.rstrip("\n").endswith(tail) and "step 02999" in tail # Errors sit at the end of a log
+    assert " lines / ~" in trimmed
+
+
+def test_repeated_lines_are_collapsed_before_cutting():
+    text = "start\n" + "retrying connection...\n" * 5000 + "fatal: timeout\n"
+    trimmed = prompt_budget.trim_text(text, 100)
+    assert trimmed == "start\nretrying connection...  [repeated 5000 times]\nfatal: timeout"
+
+
+def test_fit_msg_fits_the_rendered_prompt():
+    template = prompt_registry.MODE_TEMPLATES['fix']
+    values = dict(product='curl', operation='install', mode='fix', msg=_log(3000), os='MacOS')
+    msg = prompt_budget.fit_msg(template, values, 500, None)
+    assert _tokens(template.render(**dict(values, msg=msg))) <= 500
+    assert prompt_budget.fit_msg(template, dict(values, msg="short"), 500, None) == "short"
+    assert prompt_budget.fit_msg(template, values, None, None) == values['msg']
+
+
+def test_fit_msg_leaves_templates_without_msg_alone():
+    values = dict(product='p', operation='o', mode='execute', msg=_log(3000), os='MacOS')
+    assert prompt_budget.fit_msg(_OTEL, values, 100, None) == values['msg']
+
+
+def test_auto_budget_is_the_smallest_configured(monkeypatch):
+    budgets = {'local': 3000, 'openrouter': 16000, 'other': 800}
+    monkeypatch.setattr(llm_config, 'available_targets', lambda: list(budgets))
+    monkeypatch.setattr(llm_config, 'prompt_token_budget', budgets.get)
+    monkeypatch.setattr(llm_config, 'is_target_configured', lambda target: target != 'other')
+    assert prompt_budget.budget_for('auto') == 3000
+    assert prompt_budget.budget_for('openrouter') == 16000
+    assert prompt_budget.budget_for(None) is None
+    monkeypatch.setattr(llm_config, 'is_target_configured', lambda target: False)
+    assert prompt_budget.budget_for('auto') is None
@@ -0,0 +1,71 @@
+# tests/test_prompt_prefix.py
+"""Static template instructions go out as a shared system message, and their prefixes can be pre-warmed."""
+import asyncio
+
+import llm_config
+import llm_interface
+import llm_workflow
+import prompt_registry
+from benchmarks import harness
+
+
+def test_prompt_is_split_at_the_input_context():
+    prompt = "Install the product.\nUse bash blocks.\n\n<input_context>\nProduct: curl\n</input_context>\n"
+    assert llm_interface.build_messages(prompt) == [
+        {'role': 'system', 'content': "Install the product.\nUse bash blocks."},
+        {'role': 'user', 'content': "<input_context>\nProduct: curl\n</input_context>"},
+    ]
+
+
+def test_prompt_without_instructions_is_a_single_user_message():
+    for prompt in ["Just a question", "<input_context>\nProduct: curl\n</input_context>"]:
+        assert llm_interface.build_messages(prompt) == [{'role': 'user', 'content': prompt}]
+
+
+def test_requests_for_one_template_share_the_system_message():
+    with harness.quiet():
+        first = llm_workflow._get_prompt('curl', 'install', 'chat', "on ubuntu")
+        second = llm_workflow._get_prompt('wget', 'upgrade', 'chat', "which flags?")
+    first_messages, second_messages = llm_interface.build_messages(first), llm_interface.build_messages(second)
+    assert first_messages[0] == second_messages[0] and first_messages[0]['role'] == 'system'
+    assert "on ubuntu" in first_messages[1]['content'] and "curl" not in first_messages[0]['content']
+
+
+def test_cache_prompt_is_sent_to_llama_server_only():
+    config = llm_config.get_llm_config('local', 8012)
+    assert config.get('cache_prompt')
+    args = llm_interface.prepare_litellm_args("a\n<input_context>b</input_context>", config, 'local')
+    assert args['extra_body'] == {'cache_prompt': True} and args['messages'][0]['role'] == 'system'
+    args = llm_interface.prepare_litellm_args("a", {'model': 'openrouter/x', 'api_key': 'k'}, 'openrouter')
+    assert 'extra_body' not in args
+
+
+def test_warm_prompts_cover_each_distinct_prefix():
+    prompts = llm_workflow._warm_prompts()
+    prefixes = [prompt_registry.split_prompt(prompt)[0] for prompt in prompts]
+    assert len(prefixes) == len(set(prefixes)) and all(prefixes)
+    assert len(prompts) <= len(prompt_registry.MODE_TEMPLATES) + len(prompt_registry.EXECUTE_TEMPLATES)
+
+
+def test_prewarm_prefills_every_prefix_on_the_local_server(fake_server):
+    sent = []
+    response_for = fake_server.response_for
+
+    def recording_response_for(messages):
+        sent.append(messages)
+        return response_for(messages)
+
+    fake_server.response_for = recording_response_for
+    with harness.quiet():
+        warmed = asyncio.run(llm_workflow.aprewarm_prompt_cache('local'))
+    prompts = llm_workflow._warm_prompts()
+    assert warmed == len(prompts) == fake_server.requests_served
+    assert [messages[0]['content'] for messages in sent] == [prompt_registry.split_prompt(prompt)[0] for prompt in prompts]
+
+
+def test_prewarm_failures_are_reported_not_raised(fake_server, capsys):
+    fake_server.fail_requests = 1000
+    fake_server.fail_status = 400 # Not retried
+    with harness.quiet():
+        assert asyncio.run(llm_workflow.aprewarm_prompt_cache('local')) == 0
+    assert "Could not pre-warm the prompt cache" in capsys.readouterr().err
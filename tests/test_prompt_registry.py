@@ -0,0 +1,68 @@
+# tests/test_prompt_registry.py
+"""Prompt registry: template discovery, alias-aware lookup, fast rendering and the <input_context> split."""
+import pytest
+
+import llm_prompt
+import llm_workflow
+import prompt_registry
+from benchmarks import harness
+from prompt_registry import CompiledTemplate
+
+
+def test_every_operation_product_constant_is_discovered():
+    assert set(prompt_registry.MODE_TEMPLATES) == {'fix', 'chat'}
+    assert prompt_registry.MODE_TEMPLATES['fix'].text == llm_prompt.FIX
+    assert prompt_registry.EXECUTE_TEMPLATES[('INSTALL', 'CURL')].text == llm_prompt.INSTALL_CURL
+    assert ('UNINSTALL', 'SPLUNK_OTEL_COLLECTOR') in prompt_registry.EXECUTE_TEMPLATES
+    assert all(key[0] not in ('FIX', 'CHAT') for key in prompt_registry.EXECUTE_TEMPLATES)
+
+
+@pytest.mark.parametrize('operation, product', [
+    ('install', 'splunk-otel-collector'),
+    ('  Install ', 'Splunk OTel Collector'),
+    ('setup', 'otel collector'), # Aliases on both sides
+    ('add', 'splunk-otel'),
+])
+def test_lookup_normalizes_and_resolves_aliases(operation, product):
+    template = prompt_registry.lookup_execute(operation, product)
+    assert template is prompt_registry.EXECUTE_TEMPLATES[('INSTALL', 'SPLUNK_OTEL_COLLECTOR')]
+
+
+def test_unknown_pair_has_no_execute_template():
+    assert prompt_registry.lookup_execute('install', 'no-such-product') is None
+    assert prompt_registry.lookup_execute('frobnicate', 'curl') is None
+
+
+def test_clean_key_part():
+    assert prompt_registry.clean_key_part("  splunk--otel  collector! ") == 'SPLUNK_OTEL_COLLECTOR'
+    assert prompt_registry.clean_key_part("__a..b__") == 'A_B'
+    assert prompt_registry.clean_key_part("x") is prompt_registry.clean_key_part("x") # Memoized
+
+
+def test_render_matches_str_format():
+    text = "Do {operation} of {product} ({mode}).\n<input_context>{msg}</input_context>\n{{literal}}"
+    template = CompiledTemplate('T', text)
+    values = dict(operation='install', product='curl', mode='execute', msg="a {brace} é")
+    assert template.fields == ['operation', 'product', 'mode', 'msg']
+    assert template.render(**values) == text.format(**values)
+    with pytest.raises(KeyError):
+        template.render(operation='install')
+
+
+def test_render_falls_back_to_str_format_for_format_specs():
+    template = CompiledTemplate('T', "{count:>4}|{name!r}")
+    assert template.render(count=7, name="x") == "   7|'x'"
+
+
+def test_split_prompt():
+    prompt = "  Instructions.\n\n<input_context>\nmsg\n</input_context>\n"
+    assert prompt_registry.split_prompt(prompt) == ("Instructions.", "<input_context>\nmsg\n</input_context>")
+    assert prompt_registry.split_prompt("no marker") == ("", "no marker")
+
+
+def test_execute_without_a_specific_prompt_falls_back_to_chat():
+    with harness.quiet():
+        prompt = llm_workflow._get_prompt('no-such-product', 'install', 'execute', "help")
+        chat = llm_workflow._get_prompt('no-such-product', 'install', 'chat', "help")
+    assert prompt is not None and "Mode: execute" in prompt
+    assert prompt.replace("Mode: execute", "Mode: chat") == chat
@@ -0,0 +1,133 @@
+# tests/test_resp_fmt.py
+"""
+The streaming code block extractor finds exactly what a full parse of the response finds;
+parsed blocks are deduplicated and serialized for --format json.
+"""
+import json
+import random
+
+import pytest
+from click.testing import CliRunner
+
+import resp_fmt
+import clitest_middleware
+from benchmarks.fake_server import DEFAULT_CORPUS
+from resp_fmt import CodeBlock, StreamingCodeBlockExtractor
+
+# Fragments that make up fences, inline code and the corner cases between them
+_ALPHABET = ["`", "``", "```", "\n", " ", "\t", "a", "x y", "bash", "```bash\n", "é"]
+
+
+def _stream(text: str, sizes) -> list:
+    """Feeds text to a fresh extractor in chunks of the given sizes (cycled); returns the blocks."""
+    extractor = StreamingCodeBlockExtractor()
+    blocks = []
+    position = 0
+    for size in sizes:
+        if position >= len(text):
+            break
+        blocks += extractor.feed(text[position:position + size])
+        position += size
+    if position < len(text):
+        blocks += extractor.feed(text[position:])
+    return blocks + extractor.close()
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_random_text_streams_like_full_parse(seed):
+    rng = random.Random(seed)
+    for _ in range(2000):
+        text = "".join(rng.choice(_ALPHABET) for _ in range(rng.randint(0, 40)))
+        expected = resp_fmt.extract_code_blocks(text)
+        sizes = [rng.randint(1, 6) for _ in range(len(text) + 1)]
+        assert _stream(text, sizes) == expected, text
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 4, 17, 4096])
+def test_corpus_streams_like_full_parse(chunk_size):
+    for text in DEFAULT_CORPUS:
+        expected = resp_fmt.extract_code_blocks(text)
+        assert expected
+        assert _stream(text, [chunk_size] * len(text)) == expected
+
+
+def test_full_parse_offsets_match_raw_text():
+    text = DEFAULT_CORPUS[0]
+    blocks = resp_fmt.parse_code_blocks(text)
+    assert [block.kind for block in blocks] == ['fenced', 'inline', 'fenced', 'inline']
+    for block in blocks:
+        assert text[block.start:block.end] == block.raw
+    assert blocks[0].language == 'bash'
+    assert blocks[0].body.strip() == 'curl --version'
+
+
+def test_unterminated_fence_is_not_a_block():
+    assert _stream("```bash\necho hi\n", [2] * 20) == resp_fmt.extract_code_blocks("```bash\necho hi\n") == []
+
+
+def test_long_unterminated_header_streams_in_linear_time():
+    # A fence header that never ends used to be rescanned on every chunk
+    text = "```bash " + " " * 20000
+    assert _stream(text, [1] * len(text)) == resp_fmt.extract_code_blocks(text)
+
+
+# A response repeating its commands: a reformatted fence, the same body under other
+# languages, inline spans restating fence lines and each other
+_REPETITIVE = (
+    "Install it:\n```bash\nbrew update\nbrew install curl\n```\n"
+    "Again:\n```bash\n  brew update\nbrew   install curl  \n```\n"
+    "On Linux:\n```sh\nbrew update\nbrew install curl\n```\n"
+    "Or:\n```\nbrew update\nbrew install curl\n```\n"
+    "Then run `brew install curl` (or `$ brew  install curl`), check with `curl --version`, "
+    "and once more `curl  --version`."
+)
+
+
+def test_duplicates_are_dropped_in_order():
+    unique = resp_fmt.dedupe_code_blocks(resp_fmt.parse_code_blocks(_REPETITIVE))
+    # Whitespace and shell prompts do not make a block new; a language tag does
+    assert [(block.kind, block.language) for block in unique] == [
+        ('fenced', 'bash'), ('fenced', 'sh'), ('fenced', None), ('inline', None)]
+    assert unique[0].body == "brew update\nbrew install curl"
+    assert unique[-1].raw == "`curl --version`" # The first occurrence is kept
+
+
+def test_inline_span_repeating_a_fence_line_is_dropped():
+    blocks = resp_fmt.parse_code_blocks("```bash\napt-get update && apt-get install -y curl\n```\n`apt-get update && apt-get install -y curl`")
+    assert [block.kind for block in resp_fmt.dedupe_code_blocks(blocks)] == ['fenced']
+
+
+def test_raw_blocks_parse_like_the_full_text():
+    raw = resp_fmt.extract_code_blocks(_REPETITIVE)
+    lifted = resp_fmt.from_raw_blocks(raw)
+    parsed = resp_fmt.parse_code_blocks(_REPETITIVE)
+    assert [(b.kind, b.language, b.body, b.raw) for b in lifted] == [(b.kind, b.language, b.body, b.raw) for b in parsed]
+    assert all(block.start == 0 and block.end == len(block.raw) for block in lifted) # Relative to each block
+    assert resp_fmt.from_raw_blocks(["no code here"]) == []
+
+
+def test_json_document_schema():
+    blocks = resp_fmt.dedupe_code_blocks(resp_fmt.parse_code_blocks(_REPETITIVE))
+    document = json.loads(resp_fmt.code_blocks_to_json(blocks, duplicates_removed=3))
+    assert document == {
+        'duplicates_removed': 3,
+        'count': len(blocks),
+        'blocks': [{'kind': b.kind, 'language': b.language, 'body': b.body, 'start': b.start, 'end': b.end}
+                   for b in blocks],
+    }
+    assert document['blocks'][0]['kind'] == CodeBlock.FENCED and document['blocks'][-1]['language'] is None
+    assert json.loads(resp_fmt.code_blocks_to_json([])) == {'count': 0, 'blocks': []}
+    assert "é" in resp_fmt.code_blocks_to_json(resp_fmt.parse_code_blocks("`echo é`")) # Not \\u-escaped
+
+
+def test_format_json_prints_one_document(fake_server):
+    fake_server.corpus = [_REPETITIVE]
+    result = CliRunner().invoke(clitest_middleware.main_command,
+                                ['--product', 'curl', '--operation', 'install', '--no-daemon', '--no-cache', '--format', 'json'])
+    assert result.exit_code == 0, result.output
+    document = json.loads(result.stdout) # Progress output went to stderr
+    blocks = resp_fmt.parse_code_blocks(_REPETITIVE)
+    unique = resp_fmt.dedupe_code_blocks(blocks)
+    assert document['count'] == len(unique) == 4
+    assert document['duplicates_removed'] == len(blocks) - 4
+    assert document['blocks'] == [block.to_dict() for block in unique] # Offsets into the full response
@@ -0,0 +1,118 @@
+# tests/test_response_buffer.py
+"""Responses past the spill threshold: kept on disk, read back piece by piece and round-tripped through the cache."""
+import os
+import asyncio
+
+import pytest
+
+import chatsend
+import llm_config
+import response_cache
+import response_buffer
+from response_buffer import ResponseBuffer
+from single_flight import SingleFlight
+from output_sinks import CallbackSink
+from benchmarks import harness
+from benchmarks.fake_server import FakeOpenAIServer
+
+
+def _chunks(count: int) -> list:
+    return [f"line {i}: é ü 漢字 done\n" for i in range(count)] # Multi-byte text split across pieces
+
+
+@pytest.fixture
+def small_pieces(monkeypatch):
+    monkeypatch.setattr(response_buffer, 'PIECE_BYTES', 7) # Pieces end inside multi-byte characters
+
+
+def test_small_response_stays_in_memory():
+    buffer = ResponseBuffer(spill_chars=1000)
+    for chunk in _chunks(5):
+        buffer.append(chunk)
+    assert not buffer.spilled
+    assert buffer.chunks() == _chunks(5)
+
+
+def test_large_response_spills_and_reads_back(small_pieces):
+    chunks = _chunks(200)
+    buffer = ResponseBuffer(spill_chars=1000)
+    for chunk in chunks:
+        buffer.append(chunk)
+    assert buffer.spilled and len(buffer) == len("".join(chunks))
+    assert buffer.text() == "".join(chunks)
+    assert "".join(buffer) == "".join(chunks)
+    buffer.close()
+    assert not buffer.spilled and buffer.text() == ""
+
+
+@pytest.mark.parametrize('spill_at', [0, 30])
+def test_iteration_sees_the_text_up_to_its_start(small_pieces, spill_at):
+    buffer = ResponseBuffer(spill_chars=1000)
+    for chunk in _chunks(spill_at):
+        buffer.append(chunk)
+    backlog = iter(buffer)
+    first = next(backlog, "")
+    for chunk in _chunks(200)[spill_at:]: # Appends while reading, spilling part-way
+        buffer.append(chunk)
+    assert buffer.spilled
+    assert first + "".join(backlog) == "".join(_chunks(spill_at))
+    assert "".join(buffer) == "".join(_chunks(200))
+
+
+def test_close_waits_for_readers(small_pieces):
+    buffer = ResponseBuffer(spill_chars=10)
+    for chunk in _chunks(50):
+        buffer.append(chunk)
+    backlog = iter(buffer)
+    first = next(backlog)
+    buffer.close()
+    assert first + "".join(backlog) == "".join(_chunks(50))
+    assert not buffer.spilled # The last reader released the file
+
+
+def test_spilled_buffer_round_trips_through_the_cache(tmp_path, small_pieces):
+    buffer = ResponseBuffer(spill_chars=1000)
+    for chunk in _chunks(200):
+        buffer.append(chunk)
+    cache = response_cache.ResponseCache(path=os.path.join(tmp_path, 'responses.sqlite3'))
+    cache.put('k', buffer)
+    assert "".join(cache.get('k')) == "".join(_chunks(200))
+    cache.put('small', _chunks(3))
+    assert cache.get('small') == _chunks(3)
+
+
+def test_late_joiner_reads_a_spilled_backlog(monkeypatch):
+    monkeypatch.setattr(response_buffer, 'SPILL_CHARS', 100)
+    chunks = _chunks(100)
+    joined = []
+
+    async def upstream():
+        for i, chunk in enumerate(chunks):
+            await asyncio.sleep(0.02 if i == 50 else 0) # The joiner arrives here, past the spill
+            yield chunk
+
+    async def collect(flights, delay):
+        await asyncio.sleep(delay)
+        return "".join([chunk async for chunk in flights.stream('k', upstream, on_join=lambda: joined.append(1))])
+
+    async def main():
+        flights = SingleFlight()
+        return await asyncio.gather(collect(flights, 0), collect(flights, 0.01))
+
+    assert asyncio.run(main()) == ["".join(chunks)] * 2
+    assert joined == [1]
+
+
+def test_response_larger_than_the_spill_threshold_is_served_and_cached(monkeypatch):
+    monkeypatch.setattr(response_buffer, 'SPILL_CHARS', 500)
+    text = "".join(_chunks(300))
+    with FakeOpenAIServer(corpus=[text], chunk_size=64) as server, harness.local_target(server), harness.quiet():
+        config = llm_config.get_llm_config('local', server.port)
+        streamed = []
+        sink = CallbackSink(on_chunk=streamed.append)
+        first = asyncio.run(chatsend.asend("big answer", 'local', config, sink=sink))
+        second = asyncio.run(chatsend.asend("big answer", 'local', config, sink=CallbackSink()))
+        served = server.requests_served
+    assert first.response == "".join(streamed) == text
+    assert second.cache_hit and second.response == text
+    assert served == 1
@@ -0,0 +1,93 @@
+# tests/test_response_cache.py
+"""On-disk response cache: keys, TTL expiry and LRU / size-bounded eviction."""
+import json
+import os
+
+import pytest
+
+import response_cache
+from response_cache import ResponseCache, make_cache_key
+
+
+class _Clock:
+    """Stands in for time.time() in response_cache, advanced by the test."""
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(response_cache.time, 'time', clock)
+    return clock
+
+
+def _cache(tmp_path, **bounds) -> ResponseCache:
+    return ResponseCache(path=os.path.join(tmp_path, 'responses.sqlite3'), **bounds)
+
+
+def test_key_covers_prompt_model_and_endpoint():
+    config = {'model': 'openai/m', 'api_base': 'http://127.0.0.1:8012/v1'}
+    key = make_cache_key("prompt", config)
+    assert key == make_cache_key("prompt", dict(config, api_key='ignored'))
+    assert key != make_cache_key("prompt ", config)
+    assert key != make_cache_key("prompt", dict(config, model='openai/other'))
+    assert key != make_cache_key("prompt", dict(config, api_base='http://127.0.0.1:8013/v1'))
+
+
+def test_round_trip_keeps_chunks(tmp_path, clock):
+    cache = _cache(tmp_path)
+    assert cache.get('k') is None # No database yet
+    cache.put('k', ["a", "b ", "```é```"])
+    assert cache.get('k') == ["a", "b ", "```é```"]
+    cache.clear()
+    assert cache.get('k') is None
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = _cache(tmp_path, ttl_seconds=60)
+    cache.put('k', ["x"])
+    clock.now += 59
+    assert cache.get('k') == ["x"]
+    clock.now += 2 # Reads do not extend the lifetime
+    assert cache.get('k') is None
+
+
+def test_expired_entries_are_evicted_on_write(tmp_path, clock):
+    cache = _cache(tmp_path, ttl_seconds=60)
+    cache.put('old', ["x"])
+    clock.now += 61
+    cache.put('new', ["y"])
+    clock.now -= 61 # Even if the entry were read as fresh again, it is gone
+    assert cache.get('old') is None
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path, clock):
+    cache = _cache(tmp_path, ttl_seconds=0, max_entries=2)
+    cache.put('a', ["a"])
+    clock.now += 1
+    cache.put('b', ["b"])
+    clock.now += 1
+    assert cache.get('a') == ["a"] # 'a' is now more recently used than 'b'
+    clock.now += 1
+    cache.put('c', ["c"])
+    assert cache.get('b') is None
+    assert cache.get('a') == ["a"] and cache.get('c') == ["c"]
+
+
+def test_size_bound_evicts_until_it_fits(tmp_path, clock):
+    entry_size = len(json.dumps(["x" * 100]).encode('utf-8'))
+    cache = _cache(tmp_path, ttl_seconds=0, max_bytes=entry_size * 2)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, ["x" * 100])
+        clock.now += 1
+    assert [cache.get(key) is not None for key in ('a', 'b', 'c')] == [False, True, True]
+
+
+def test_response_larger_than_cache_is_not_stored(tmp_path, clock):
+    cache = _cache(tmp_path, max_bytes=50)
+    cache.put('big', ["x" * 100])
+    assert cache.get('big') is None
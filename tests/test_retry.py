@@ -0,0 +1,81 @@
+# tests/test_retry.py
+"""Retries of rate-limited and overloaded responses, with the server's Retry-After honoured."""
+import time
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import llm_config
+import llm_interface
+from benchmarks import harness
+from benchmarks.fake_server import FakeOpenAIServer
+
+
+def test_retry_after_is_read_from_provider_headers():
+    assert llm_interface._retry_after(SimpleNamespace(litellm_response_headers={'retry-after': '2.5'})) == 2.5
+    assert llm_interface._retry_after(SimpleNamespace(response=SimpleNamespace(headers={'retry-after': '3'}))) == 3.0
+    assert llm_interface._retry_after(SimpleNamespace(litellm_response_headers={'retry-after': '-1'})) == 0.0
+    # HTTP dates and missing headers fall back to backoff
+    assert llm_interface._retry_after(SimpleNamespace(litellm_response_headers={'retry-after': 'Wed, 21 Oct 2015 07:28:00 GMT'})) is None
+    assert llm_interface._retry_after(SimpleNamespace()) is None
+
+
+def test_retry_delay_is_jittered_backoff_or_retry_after():
+    base = llm_interface.RETRY_BASE_DELAY_SECONDS
+    for attempt in range(12):
+        delay = llm_interface._retry_delay(attempt, None)
+        assert 0.0 <= delay <= min(llm_interface.RETRY_MAX_DELAY_SECONDS, base * 2 ** attempt)
+    for _ in range(20):
+        assert 4.0 <= llm_interface._retry_delay(0, 4.0) <= 4.0 + base
+
+
+def _stream(server: FakeOpenAIServer, max_retries: int):
+    """Streams one request to the fake server through the 'local' target; returns (text, seconds)."""
+    config = dict(llm_config.get_llm_config('local', server.port), max_retries=max_retries)
+    litellm_args = llm_interface.prepare_litellm_args("retry test", config, 'local')
+
+    async def main():
+        started = time.perf_counter()
+        chunks = [chunk async for chunk in llm_interface.astream_litellm_response(litellm_args, config, 'local')]
+        return "".join(chunks), time.perf_counter() - started
+
+    with harness.local_target(server), harness.quiet():
+        return asyncio.run(main())
+
+
+def test_rate_limited_request_is_retried_after_retry_after():
+    with FakeOpenAIServer(fail_requests=2, fail_status=429, retry_after=0.2) as server:
+        text, elapsed = _stream(server, max_retries=2)
+    assert text in server.corpus
+    assert server.requests_served == 3
+    assert elapsed >= 0.4 # Both retries waited at least the server's Retry-After
+
+
+def test_overloaded_request_is_retried_with_backoff():
+    with FakeOpenAIServer(fail_requests=1, fail_status=503) as server:
+        text, _ = _stream(server, max_retries=1)
+    assert text in server.corpus
+    assert server.requests_served == 2
+
+
+def test_retries_are_bounded():
+    with FakeOpenAIServer(fail_requests=5, fail_status=429, retry_after=0) as server:
+        with pytest.raises(llm_interface.LLMRateLimitError):
+            _stream(server, max_retries=2)
+    assert server.requests_served == 3
+
+
+def test_retry_after_beyond_the_limit_fails_at_once():
+    retry_after = llm_interface.RETRY_MAX_DELAY_SECONDS + 1
+    with FakeOpenAIServer(fail_requests=1, fail_status=429, retry_after=retry_after) as server:
+        with pytest.raises(llm_interface.LLMRateLimitError):
+            _stream(server, max_retries=3)
+    assert server.requests_served == 1
+
+
+def test_client_errors_are_not_retried():
+    with FakeOpenAIServer(fail_requests=1, fail_status=400) as server:
+        with pytest.raises((llm_interface.LLMAPITError, llm_interface.LLMUnexpectedError)):
+            _stream(server, max_retries=3)
+    assert server.requests_served == 1
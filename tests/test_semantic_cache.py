@@ -0,0 +1,106 @@
+# tests/test_semantic_cache.py
+"""Near-duplicate matching of chat/fix messages: normalization, similarity threshold, scope and cleanup."""
+import os
+
+import pytest
+
+import chatsend
+import response_cache
+import semantic_cache
+from semantic_cache import SemanticIndex, make_query
+
+_CONFIG = {'model': 'openai/test-model', 'api_base': 'http://127.0.0.1:8012/v1'}
+
+_ERROR = (
+    "Installing the collector with the install script failed. The script downloaded the package, "
+    "then the service did not start because the configuration file could not be parsed: "
+    "error decoding exporters, unknown type signalfx for the metrics pipeline, "
+    "so systemd gave up after three restarts and the install script exited with status one"
+)
+
+
+def _query(msg: str, product: str = 'splunk-otel-collector', operation: str = 'install', mode: str = 'fix'):
+    return make_query(product, operation, mode, msg)
+
+
+@pytest.fixture
+def index(tmp_path):
+    return SemanticIndex(path=os.path.join(tmp_path, 'semantic.sqlite3'))
+
+
+def test_near_duplicate_above_the_threshold_hits(index):
+    index.add(_query(_ERROR), _CONFIG, 'k1')
+    edited = _ERROR.replace("three restarts", "five restarts")
+    similarity = semantic_cache.jaccard(_query(_ERROR).shingles, _query(edited).shingles)
+    assert semantic_cache.DEFAULT_THRESHOLD <= similarity < 1.0
+    assert index.lookup(_query(edited), _CONFIG) == ('k1', similarity)
+
+
+def test_different_message_misses(index):
+    index.add(_query(_ERROR), _CONFIG, 'k1')
+    assert index.lookup(_query("curl: (6) Could not resolve host: example.com while running the install script"), _CONFIG) is None
+    rewritten = _ERROR.replace("the configuration file could not be parsed", "the port 4317 was already in use by another process")
+    assert semantic_cache.jaccard(_query(_ERROR).shingles, _query(rewritten).shingles) < semantic_cache.DEFAULT_THRESHOLD
+    assert index.lookup(_query(rewritten), _CONFIG) is None
+
+
+@pytest.mark.parametrize('first, second', [
+    ("2024-05-01T12:00:03Z " + _ERROR, "2025-11-30 08:15:59.123 " + _ERROR),
+    ("Oct 17 09:12:44 host " + _ERROR, "Mar  3 23:01:02 host " + _ERROR),
+    (_ERROR + " see /var/log/otel/collector-1.log", _ERROR + " see /home/ci/build/logs/otel.log"),
+    (_ERROR + " (pid 4242, request 9f2c31aa0b7d)", _ERROR + " (PID: 77, request 0d51e9b3a2c4)"),
+    (_ERROR + " from 10.0.0.12:8080", _ERROR.upper() + "   FROM 192.168.1.7:443"),
+])
+def test_volatile_tokens_do_not_matter(index, first, second):
+    assert _query(first).normalized == _query(second).normalized
+    index.add(_query(first), _CONFIG, 'k1')
+    assert index.lookup(_query(second), _CONFIG) == ('k1', 1.0)
+
+
+@pytest.mark.parametrize('other_query, other_config', [
+    (dict(product='curl'), {}),
+    (dict(operation='uninstall'), {}),
+    (dict(mode='chat'), {}),
+    ({}, dict(model='openai/other-model')),
+    ({}, dict(api_base='http://127.0.0.1:8013/v1')),
+])
+def test_other_scope_misses(index, other_query, other_config):
+    index.add(_query(_ERROR), _CONFIG, 'k1')
+    assert index.lookup(_query(_ERROR, **other_query), dict(_CONFIG, **other_config)) is None
+    assert index.lookup(_query(_ERROR), _CONFIG) == ('k1', 1.0)
+
+
+def test_only_chat_and_fix_messages_are_indexed():
+    assert _query(_ERROR, mode='execute') is None
+    assert _query("   ") is None and _query(None) is None
+    assert _query(_ERROR, mode='chat') is not None
+
+
+def test_newer_response_replaces_the_pointer(index):
+    index.add(_query("12:00:01 " + _ERROR), _CONFIG, 'old')
+    index.add(_query("13:45:09 " + _ERROR), _CONFIG, 'new') # Same normalized message
+    assert index.lookup(_query("09:00:00 " + _ERROR), _CONFIG) == ('new', 1.0)
+
+
+def test_oldest_entries_are_evicted(tmp_path, monkeypatch):
+    clock = iter(range(1_000_000, 1_000_100))
+    monkeypatch.setattr(semantic_cache.time, 'time', lambda: next(clock))
+    index = SemanticIndex(path=os.path.join(tmp_path, 'semantic.sqlite3'), max_entries=2)
+    messages = [f"{_ERROR} on host number {word}" for word in ("alpha", "bravo", "charlie")]
+    index.threshold = 1.0 # Each message only matches itself
+    for i, msg in enumerate(messages):
+        index.add(_query(msg), _CONFIG, f'k{i}')
+    assert index.lookup(_query(messages[0]), _CONFIG) is None
+    assert index.lookup(_query(messages[2]), _CONFIG) == ('k2', 1.0)
+
+
+def test_entry_is_forgotten_once_its_response_is_evicted(tmp_path, index):
+    cache = response_cache.ResponseCache(path=os.path.join(tmp_path, 'responses.sqlite3'), ttl_seconds=0, max_entries=1)
+    cache.put('k1', ["answer one"])
+    index.add(_query(_ERROR), _CONFIG, 'k1')
+    assert chatsend._semantic_lookup(cache, index, _query(_ERROR), _CONFIG) == ["answer one"]
+    cache.put('k2', ["answer two"]) # LRU eviction drops 'k1'
+    assert cache.get('k1') is None
+    assert chatsend._semantic_lookup(cache, index, _query(_ERROR), _CONFIG) is None
+    # The stale pointer is gone: the lookup no longer finds a candidate at all
+    assert index.lookup(_query(_ERROR), _CONFIG) is None
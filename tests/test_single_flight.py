@@ -0,0 +1,193 @@
+# tests/test_single_flight.py
+"""Coalescing of identical streams: joining, errors, and leaders that go away."""
+import asyncio
+import threading
+from typing import Optional
+
+import pytest
+
+from single_flight import SingleFlight, FlightAbandoned
+
+
+class _Upstream:
+    """A fake upstream stream factory that counts starts and records when a stream is closed."""
+    def __init__(self, chunks: int = 10, delay: float = 0.01, first_delay: float = 0.0, fail_after: Optional[int] = None):
+        self.chunks = chunks
+        self.delay = delay
+        self.first_delay = first_delay
+        self.fail_after = fail_after
+        self.started = 0
+        self.closed = 0
+
+    async def __call__(self):
+        self.started += 1
+        try:
+            await asyncio.sleep(self.first_delay)
+            for i in range(self.chunks):
+                if self.fail_after is not None and i == self.fail_after:
+                    raise ValueError("upstream failed")
+                await asyncio.sleep(self.delay)
+                yield f"c{i} "
+        finally:
+            self.closed += 1
+
+
+async def _collect(flights: SingleFlight, upstream, out: list, on_join=None, key: str = 'k') -> None:
+    async for chunk in flights.stream(key, upstream, on_join=on_join):
+        out.append(chunk)
+
+
+def test_identical_requests_share_one_generation():
+    async def main():
+        flights = SingleFlight()
+        upstream = _Upstream()
+        joined = []
+        outputs = [[] for _ in range(3)]
+        leader = asyncio.create_task(_collect(flights, upstream, outputs[0]))
+        await asyncio.sleep(0.035) # Followers join part-way and get the backlog first
+        await asyncio.gather(leader, *(_collect(flights, upstream, out, on_join=lambda: joined.append(1))
+                                       for out in outputs[1:]))
+        return flights, upstream, joined, outputs
+
+    flights, upstream, joined, outputs = asyncio.run(main())
+    assert upstream.started == 1 and upstream.closed == 1
+    assert len(joined) == 2
+    assert outputs[0] == outputs[1] == outputs[2] == [f"c{i} " for i in range(10)]
+    assert flights.in_flight() == 0
+
+
+def test_different_keys_do_not_join():
+    async def main():
+        flights = SingleFlight()
+        upstream = _Upstream(chunks=3)
+        a, b = [], []
+        await asyncio.gather(_collect(flights, upstream, a, key='a'), _collect(flights, upstream, b, key='b'))
+        return upstream
+
+    assert asyncio.run(main()).started == 2
+
+
+def test_upstream_error_reaches_every_subscriber():
+    async def main():
+        flights = SingleFlight()
+        upstream = _Upstream(fail_after=2)
+        results = await asyncio.gather(_collect(flights, upstream, []), _collect(flights, upstream, []),
+                                       return_exceptions=True)
+        return flights, upstream, results
+
+    flights, upstream, results = asyncio.run(main())
+    assert upstream.started == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flights.in_flight() == 0
+
+
+def test_follower_survives_cancelled_leader_on_same_loop():
+    async def main():
+        flights = SingleFlight()
+        upstream = _Upstream(chunks=20)
+        follower_out = []
+        leader = asyncio.create_task(_collect(flights, upstream, []))
+        await asyncio.sleep(0.03)
+        follower = asyncio.create_task(_collect(flights, upstream, follower_out))
+        await asyncio.sleep(0.03)
+        leader.cancel()
+        await follower
+        return flights, upstream, follower_out
+
+    flights, upstream, follower_out = asyncio.run(main())
+    assert upstream.started == 1
+    assert follower_out == [f"c{i} " for i in range(20)]
+    assert flights.in_flight() == 0
+
+
+def test_abandoned_flight_closes_upstream():
+    async def main():
+        flights = SingleFlight()
+        upstream = _Upstream(chunks=20)
+        leader = asyncio.create_task(_collect(flights, upstream, []))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        await asyncio.gather(leader, return_exceptions=True)
+        await asyncio.sleep(0.02) # The pump's cancellation runs on the next iterations
+        return flights, upstream
+
+    flights, upstream = asyncio.run(main())
+    assert upstream.closed == 1
+    assert flights.in_flight() == 0
+
+
+def _cross_loop(first_delay: float, leader_leaves_after: float):
+    """A leader on one thread leaves after a follower on another thread joined; returns the follower's outcome."""
+    flights = SingleFlight()
+    upstream = _Upstream(chunks=5, first_delay=first_delay)
+    leader_started = threading.Event()
+    follower_joined = threading.Event()
+    follower_out, follower_errors = [], []
+
+    def leader():
+        async def main():
+            task = asyncio.create_task(_collect(flights, upstream, []))
+            leader_started.set()
+            await asyncio.to_thread(follower_joined.wait, 5)
+            await asyncio.sleep(leader_leaves_after)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        asyncio.run(main()) # The leader's loop stops with its caller
+
+    def follower():
+        leader_started.wait(5)
+        async def main():
+            await asyncio.sleep(0.02)
+            try:
+                await _collect(flights, upstream, follower_out, on_join=follower_joined.set)
+            except Exception as e:
+                follower_errors.append(e)
+        asyncio.run(main())
+
+    threads = [threading.Thread(target=leader), threading.Thread(target=follower)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert not any(thread.is_alive() for thread in threads)
+    return flights, upstream, follower_out, follower_errors
+
+
+def test_flight_is_handed_over_when_leader_leaves_before_streaming():
+    flights, upstream, follower_out, follower_errors = _cross_loop(first_delay=0.5, leader_leaves_after=0.0)
+    assert follower_errors == []
+    assert follower_out == [f"c{i} " for i in range(5)]
+    assert upstream.started == 2 # The follower restarted the request on its own loop
+    assert flights.in_flight() == 0
+
+
+def test_flight_that_already_streamed_fails_followers_on_other_loops():
+    flights, upstream, follower_out, follower_errors = _cross_loop(first_delay=0.0, leader_leaves_after=0.02)
+    assert len(follower_errors) == 1 and isinstance(follower_errors[0], FlightAbandoned)
+    assert upstream.started == 1
+    assert flights.in_flight() == 0
+
+
+def test_finished_flight_is_not_joined():
+    async def main():
+        flights = SingleFlight()
+        upstream = _Upstream(chunks=2)
+        await _collect(flights, upstream, [])
+        await _collect(flights, upstream, [])
+        return upstream
+
+    assert asyncio.run(main()).started == 2
+
+
+@pytest.mark.parametrize('subscribers', [2, 8])
+def test_many_subscribers_receive_identical_streams(subscribers):
+    async def main():
+        flights = SingleFlight()
+        upstream = _Upstream(chunks=30, delay=0.001)
+        outputs = [[] for _ in range(subscribers)]
+        await asyncio.gather(*(_collect(flights, upstream, out) for out in outputs))
+        return upstream, outputs
+
+    upstream, outputs = asyncio.run(main())
+    assert upstream.started == 1
+    assert all(out == outputs[0] for out in outputs) and len(outputs[0]) == 30
@@ -0,0 +1,129 @@
+# tests/test_target_router.py
+"""'auto' routing: failover before any output, hedging a slow first target, and no failover once output was sent."""
+import asyncio
+from typing import Dict, List, Optional
+
+import pytest
+
+import chatsend
+import llm_config
+import llm_interface
+import target_router
+from output_sinks import OutputSink
+from target_router import TargetRouter
+
+
+class _Script:
+    """What the fake chatsend.asend does for one target."""
+    def __init__(self, first_delay: float = 0.0, chunks: Optional[List[str]] = None,
+                 error: Optional[str] = None):
+        self.first_delay = first_delay
+        self.chunks = chunks if chunks is not None else []
+        self.error = error # Returned after the chunks (if any) were streamed
+        self.started = 0
+        self.cancelled = 0
+
+
+class _RecordingSink(OutputSink):
+    def __init__(self):
+        self.events: List[tuple] = []
+
+    def prompt(self, prompt: str) -> None:
+        self.events.append(('prompt', prompt))
+
+    def stream_start(self) -> None:
+        self.events.append(('stream_start',))
+
+    def chunk(self, text: str) -> None:
+        self.events.append(('chunk', text))
+
+    def stream_end(self) -> None:
+        self.events.append(('stream_end',))
+
+    def chunks(self) -> List[str]:
+        return [event[1] for event in self.events if event[0] == 'chunk']
+
+
+@pytest.fixture
+def targets(monkeypatch):
+    """Targets 'a' and 'b' (ranked in that order), served by scripts the test fills in."""
+    scripts: Dict[str, _Script] = {}
+
+    async def fake_asend(prompt, target, config, use_cache=True, refresh=False, sink=None, similar=None):
+        script = scripts[target]
+        script.started += 1
+        try:
+            sink.prompt(prompt)
+            await asyncio.sleep(script.first_delay)
+            for chunk in script.chunks:
+                sink.chunk(chunk)
+                await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            script.cancelled += 1
+            raise
+        if script.error:
+            return chatsend.SendResult(None, script.error)
+        sink.stream_end()
+        return chatsend.SendResult("".join(script.chunks))
+
+    async def no_import():
+        pass
+
+    monkeypatch.setattr(chatsend, 'asend', fake_asend)
+    monkeypatch.setattr(llm_interface, 'aload_litellm', no_import)
+    monkeypatch.setattr(llm_config, 'available_targets', lambda: ['a', 'b'])
+    monkeypatch.setattr(llm_config, 'is_target_configured', lambda target: True)
+    return scripts
+
+
+def _route(router: TargetRouter, sink: OutputSink, hedge: bool = False):
+    return asyncio.run(router.aroute("prompt", lambda target: {'model': target}, sink, hedge=hedge))
+
+
+def test_failure_before_output_fails_over(targets):
+    targets['a'] = _Script(error="LLMConnectionError")
+    targets['b'] = _Script(chunks=["from ", "b"])
+    router, sink = TargetRouter(), _RecordingSink()
+    assert _route(router, sink) == ("from b", 'b', None)
+    assert sink.chunks() == ["from ", "b"]
+    assert [event[0] for event in sink.events].count('prompt') == 1 # Shown once across attempts
+    assert router.stats('a').failures == 1 and not router.stats('a').is_healthy()
+    assert router.rank() == ['b', 'a'] # 'a' is in its cooldown
+
+
+def test_every_target_failing_returns_the_last_error(targets):
+    targets['a'] = _Script(error="LLMConnectionError")
+    targets['b'] = _Script(error="LLMAPITError")
+    sink = _RecordingSink()
+    assert _route(TargetRouter(), sink) == (None, None, "LLMAPITError")
+    assert sink.chunks() == []
+
+
+def test_slow_first_target_is_hedged(targets, monkeypatch):
+    monkeypatch.setattr(target_router, 'DEFAULT_HEDGE_DELAY_SECONDS', 0.05)
+    targets['a'] = _Script(first_delay=5.0, chunks=["from a"])
+    targets['b'] = _Script(chunks=["from ", "b"])
+    router, sink = TargetRouter(), _RecordingSink()
+    assert _route(router, sink, hedge=True) == ("from b", 'b', None)
+    assert targets['a'].cancelled == 1 # The loser stops generating
+    assert sink.chunks() == ["from ", "b"] # and nothing of it reached the caller
+    assert router.stats('a').ewma_ttft >= 0.05 # Its wait counts as a lower bound of its TTFT
+    assert router.stats('a').failures == 0
+
+
+def test_without_hedging_the_slow_target_is_awaited(targets, monkeypatch):
+    monkeypatch.setattr(target_router, 'DEFAULT_HEDGE_DELAY_SECONDS', 0.01)
+    targets['a'] = _Script(first_delay=0.1, chunks=["from a"])
+    targets['b'] = _Script(chunks=["from b"])
+    assert _route(TargetRouter(), _RecordingSink()) == ("from a", 'a', None)
+    assert targets['b'].started == 0
+
+
+def test_failure_after_output_does_not_fail_over(targets):
+    targets['a'] = _Script(chunks=["partial "], error="LLMConnectionError")
+    targets['b'] = _Script(chunks=["from b"])
+    router, sink = TargetRouter(), _RecordingSink()
+    assert _route(router, sink) == (None, 'a', "LLMConnectionError")
+    assert targets['b'].started == 0
+    assert sink.chunks() == ["partial "]
+    assert router.stats('a').failures == 1